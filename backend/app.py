@@ -23,19 +23,38 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 print(f"Flask database URI: {app.config['SQLALCHEMY_DATABASE_URI']}")
 
+# Encode datetimes, dates and enums natively in JSON responses
+from serializers import FastJSONProvider
+app.json = FastJSONProvider(app)
+
+# bcrypt work factor and the number of threads hashing passwords (see passwords.py)
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+if os.getenv('PASSWORD_HASH_WORKERS'):
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS'))
+if os.getenv('IMPORT_HASH_WORKERS'):
+    app.config['IMPORT_HASH_WORKERS'] = int(os.getenv('IMPORT_HASH_WORKERS'))
+
+# Optional group commit of message inserts (see message_writer.py)
+app.config['MESSAGE_GROUP_COMMIT'] = os.getenv('MESSAGE_GROUP_COMMIT', 'false').lower() == 'true'
+
 # Import extensions from models
 from models import db, bcrypt
+from message_writer import message_writer
+from tokens import is_token_revoked
 
 # Initialize extensions with the app
 db.init_app(app)
 bcrypt.init_app(app)
 jwt = JWTManager(app)
+jwt.token_in_blocklist_loader(is_token_revoked)
+message_writer.init_app(app)
 
 # Enable CORS with proper settings
 CORS(app, 
     origins=["http://localhost:3000"], 
     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["Content-Type", "Authorization"],
+    expose_headers=["X-Next-Cursor", "X-Before-Cursor", "X-After-Cursor"],
     supports_credentials=True
 )
 
@@ -69,6 +88,10 @@ app.register_blueprint(messages_bp, url_prefix='/api/messages')
 app.register_blueprint(participants_bp, url_prefix='/api/participants')
 app.register_blueprint(researchers_bp, url_prefix='/api/researchers')
 
+# Register maintenance CLI commands
+from commands import register_commands
+register_commands(app)
+
 # Database tables will be created by init_db_standalone.py
 # Commenting out automatic table creation to avoid conflicts
 # with app.app_context():
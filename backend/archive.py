@@ -0,0 +1,62 @@
+"""
+Cold storage for old messages.
+
+``archive_messages`` moves messages out of the hot ``messages`` table into
+``messages_archive`` in batches, each batch an INSERT ... SELECT plus a
+DELETE in one transaction. A read message is archived when its study is
+completed or cancelled, or when it is older than a cutoff; unread messages
+stay hot so unread counts and mark-as-read keep working. Keeping the hot
+table small keeps its indexes in the page cache; thread reads merge each
+page from both tables (see ``routes/messages.py``).
+
+Archived messages keep their conversation summaries, and move from the
+``messages_fts`` search index to ``messages_archive_fts`` through the
+tables' triggers.
+"""
+
+from sqlalchemy import and_, delete, insert, or_, select
+from models import db, ArchivedMessage, Message, Study, StudyStatus
+
+FINISHED_STUDY_STATUSES = (StudyStatus.COMPLETED, StudyStatus.CANCELLED)
+DEFAULT_BATCH_SIZE = 1000
+
+_COLUMNS = ['id', 'study_id', 'sender_id', 'receiver_id', 'content', 'type', 'read', 'created_at', 'read_at']
+
+
+def archivable_filter(older_than=None, finished_studies=True):
+    """Criteria for messages to archive, or None when nothing was asked for"""
+    criteria = []
+    if finished_studies:
+        criteria.append(Message.study_id.in_(
+            select(Study.id).where(Study.status.in_(FINISHED_STUDY_STATUSES))
+        ))
+    if older_than is not None:
+        criteria.append(Message.created_at < older_than)
+    if not criteria:
+        return None
+    return and_(Message.read.is_(True), or_(*criteria))
+
+
+def archive_messages(older_than=None, finished_studies=True, batch_size=DEFAULT_BATCH_SIZE):
+    """Move matching messages to the archive; returns how many were moved"""
+    criteria = archivable_filter(older_than, finished_studies)
+    if criteria is None:
+        return 0
+
+    moved = 0
+    while True:
+        ids = db.session.scalars(
+            select(Message.id).where(criteria).order_by(Message.created_at, Message.id).limit(batch_size)
+        ).all()
+        if not ids:
+            return moved
+
+        db.session.execute(insert(ArchivedMessage).from_select(
+            _COLUMNS, select(*[getattr(Message, name) for name in _COLUMNS]).where(Message.id.in_(ids))
+        ))
+        db.session.execute(
+            delete(Message).where(Message.id.in_(ids)),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        moved += len(ids)
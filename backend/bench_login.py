@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Login throughput benchmark.
+
+Creates throwaway users in a temporary SQLite database, then fires
+concurrent POST /api/auth/login requests through the test client and
+reports logins per second. Use it to compare BCRYPT_LOG_ROUNDS and
+PASSWORD_HASH_WORKERS settings:
+
+    python bench_login.py --users 20 --logins 200 --concurrency 16 --rounds 12
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=20, help='Distinct accounts to log in as')
+    parser.add_argument('--logins', type=int, default=200, help='Total login requests')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt work factor (BCRYPT_LOG_ROUNDS)')
+    parser.add_argument('--workers', type=int, help='Hashing threads (PASSWORD_HASH_WORKERS)')
+    args = parser.parse_args()
+
+    # Configure the app before it is imported
+    db_dir = tempfile.mkdtemp(prefix='resmatch-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.rounds)
+    if args.workers:
+        os.environ['PASSWORD_HASH_WORKERS'] = str(args.workers)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app, db
+    from models import User, UserRole
+
+    with app.app_context():
+        db.create_all()
+        emails = []
+        for i in range(args.users):
+            user = User(id=str(uuid.uuid4()), email=f'bench{i}@example.com', name=f'Bench {i}',
+                        role=UserRole.PARTICIPANT)
+            user.set_password('password123')
+            db.session.add(user)
+            emails.append(user.email)
+        db.session.commit()
+
+    def login(i):
+        response = app.test_client().post('/api/auth/login', json={
+            'email': emails[i % len(emails)],
+            'password': 'password123'
+        })
+        return response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        statuses = list(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - started
+
+    failed = sum(1 for status in statuses if status != 200)
+    print(f"{args.logins} logins, {args.concurrency} concurrent, cost {args.rounds}: "
+          f"{elapsed:.2f}s, {args.logins / elapsed:.1f} logins/s, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
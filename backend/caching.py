@@ -0,0 +1,86 @@
+"""
+Small in-process caches.
+
+Entries live for at most ``ttl`` seconds and the least recently used entry is
+evicted once ``maxsize`` is reached. Caches are per process, so every code
+path that writes the underlying rows is responsible for invalidating them.
+"""
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+_MISSING = object()
+_caches = weakref.WeakSet()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry time to live"""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory):
+        """Return the cached value, computing and storing it on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def clear_all():
+    """Empty every cache in the process (used when the database is swapped out)"""
+    for cache in list(_caches):
+        cache.clear()
+
+
+# Catalog facet counts keyed by listing filters; cleared on every study write
+study_facets = TTLCache(maxsize=256, ttl=300)
+
+# Study membership (researcher, applicants, participants) keyed by study id;
+# invalidated whenever a study's applications or participations change
+study_members = TTLCache(maxsize=4096, ttl=300)
+
+# (role, name, email) per user id for authorization without a users query;
+# short-lived because nothing invalidates it on account changes
+user_summaries = TTLCache(maxsize=4096, ttl=30)
+
+# Current token version per user id, checked on every authenticated request;
+# invalidated by tokens.revoke_tokens, so only other processes see it late
+token_versions = TTLCache(maxsize=4096, ttl=30)
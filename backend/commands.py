@@ -0,0 +1,117 @@
+"""
+Maintenance commands for the Flask CLI (``flask --app app <command>``).
+"""
+
+import csv
+import json
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import text
+from models import db, MESSAGE_FTS_DDL, MESSAGE_ARCHIVE_FTS_DDL
+from counters import recount_study_counters
+from conversations import rebuild_conversations
+from archive import archive_messages, DEFAULT_BATCH_SIZE as ARCHIVE_BATCH_SIZE
+from importers import import_studies, import_participants, iter_ndjson, summarize_results, DEFAULT_CHUNK_SIZE
+
+
+def register_commands(app):
+    """Attach maintenance commands to the app's CLI group"""
+
+    @app.cli.command('recount-studies')
+    @click.option('--study-id', 'study_ids', multiple=True, help='Only repair these studies (repeatable).')
+    def recount_studies(study_ids):
+        """Recompute applications_count and participants_current from source rows."""
+        repaired = recount_study_counters(list(study_ids) or None)
+        db.session.commit()
+        click.echo(f"Repaired counters on {repaired} studies")
+
+    @app.cli.command('rebuild-conversations')
+    def rebuild_conversations_command():
+        """Recompute every conversation summary from the messages table."""
+        written = rebuild_conversations()
+        db.session.commit()
+        click.echo(f"Rebuilt {written} conversation summaries")
+
+    @app.cli.command('archive-messages')
+    @click.option('--older-than-days', type=click.IntRange(min=1), help='Also archive messages older than this.')
+    @click.option('--finished-studies/--no-finished-studies', default=True, show_default=True,
+                  help='Archive messages of completed and cancelled studies.')
+    @click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True, help='Messages per transaction.')
+    def archive_messages_command(older_than_days, finished_studies, batch_size):
+        """Move old messages from the messages table to messages_archive."""
+        older_than = None
+        if older_than_days:
+            older_than = datetime.utcnow() - timedelta(days=older_than_days)
+        moved = archive_messages(older_than, finished_studies, batch_size=max(1, batch_size))
+        click.echo(f"Archived {moved} messages")
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """Create the message full-text indexes if missing and re-index every hot and archived message."""
+        if db.engine.dialect.name != 'sqlite':
+            raise click.ClickException('Message search requires SQLite')
+        for table, fts_table, ddl in (('messages', 'messages_fts', MESSAGE_FTS_DDL),
+                                      ('messages_archive', 'messages_archive_fts', MESSAGE_ARCHIVE_FTS_DDL)):
+            # Drop any index built by an older schema (keyed by the implicit rowid)
+            for trigger in ('insert', 'delete', 'update'):
+                db.session.execute(text(f'DROP TRIGGER IF EXISTS {fts_table}_{trigger}'))
+            db.session.execute(text(f'DROP TABLE IF EXISTS {fts_table}'))
+            columns = [row[1] for row in db.session.execute(text(f'PRAGMA table_info({table})'))]
+            if 'search_rowid' not in columns:
+                db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN search_rowid INTEGER'))
+            db.session.execute(text(
+                f'CREATE UNIQUE INDEX IF NOT EXISTS ix_{table}_search_rowid ON {table} (search_rowid)'
+            ))
+            last = db.session.execute(text(f'SELECT IFNULL(MAX(search_rowid), 0) FROM {table}')).scalar()
+            db.session.execute(text(
+                f'UPDATE {table} SET search_rowid = :last + rowid WHERE search_rowid IS NULL'
+            ), {'last': last})
+            for statement in ddl:
+                db.session.execute(text(statement))
+            db.session.execute(text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')"))
+        db.session.commit()
+        click.echo("Rebuilt the message search index")
+
+    @app.cli.command('import-studies')
+    @click.argument('path', type=click.File('r'))
+    @click.option('--researcher-id', required=True, help='Owner of the imported studies.')
+    @click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Rows per transaction.')
+    @click.option('--ndjson/--json', default=None, help='Input format (default: guessed from the file extension).')
+    def import_studies_command(path, researcher_id, chunk_size, ndjson):
+        """Load studies from a JSON array or NDJSON file."""
+        if ndjson is None:
+            ndjson = path.name.endswith(('.ndjson', '.jsonl'))
+        records = iter_ndjson(path) if ndjson else json.load(path)
+        if not ndjson and not isinstance(records, list):
+            raise click.BadParameter('expected a JSON array of studies', param_hint='PATH')
+
+        summary = summarize_results(import_studies(records, researcher_id, chunk_size=max(1, chunk_size)))
+        for result in summary['results']:
+            if result['status'] == 'error':
+                click.echo(f"Row {result['index']}: {result['error']}", err=True)
+        click.echo(f"Imported {summary['created']} studies, {summary['failed']} failed")
+
+    @app.cli.command('import-participants')
+    @click.argument('path', type=click.File('r'))
+    @click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Rows per transaction.')
+    @click.option('--ndjson/--json', default=None, help='Input format (default: guessed from the file extension).')
+    @click.option('--invite', is_flag=True, help='Create rows without a password and issue invite tokens.')
+    @click.option('--invites-out', type=click.File('w'), help='Write email,invite_token CSV here.')
+    def import_participants_command(path, chunk_size, ndjson, invite, invites_out):
+        """Create participant accounts from a JSON array or NDJSON roster."""
+        if ndjson is None:
+            ndjson = path.name.endswith(('.ndjson', '.jsonl'))
+        records = iter_ndjson(path) if ndjson else json.load(path)
+        if not ndjson and not isinstance(records, list):
+            raise click.BadParameter('expected a JSON array of participants', param_hint='PATH')
+
+        summary = summarize_results(import_participants(records, chunk_size=max(1, chunk_size), invite=invite))
+        writer = csv.writer(invites_out) if invites_out else None
+        if writer:
+            writer.writerow(['email', 'invite_token'])
+        for result in summary['results']:
+            if result['status'] == 'error':
+                click.echo(f"Row {result['index']}: {result['error']}", err=True)
+            elif writer and 'invite_token' in result:
+                writer.writerow([result['email'], result['invite_token']])
+        click.echo(f"Imported {summary['created']} participants, {summary['failed']} failed")
@@ -0,0 +1,247 @@
+"""
+Materialized conversation summaries.
+
+Every message touches two ``conversations`` rows: the sender's view of the
+thread and the receiver's. Both are upserted in the same transaction as the
+message, so the inbox is a single indexed read of the caller's rows instead
+of a scan of every message they ever exchanged. Each user's total unread
+count is kept alongside in ``unread_counters`` so badge counts are a
+primary-key lookup.
+"""
+
+from datetime import datetime
+from sqlalchemy import and_, case, delete, func, insert, literal, or_, select, union_all, update
+from models import db, ArchivedMessage, Conversation, Message, UnreadCounter
+from upserts import conflict_insert
+
+
+def conversation_id(user_id, other_user_id, study_id=None):
+    """Deterministic key of ``user_id``'s view of a thread"""
+    return f"{user_id}:{other_user_id}:{study_id or 'general'}"
+
+
+def _summary_rows(messages):
+    """Fold messages into one summary delta per affected conversation"""
+    rows = {}
+    for message in messages:
+        sides = (
+            (message['sender_id'], message['receiver_id'], 0),
+            (message['receiver_id'], message['sender_id'], 0 if message.get('read') else 1)
+        )
+        for user_id, other_user_id, unread in sides:
+            key = conversation_id(user_id, other_user_id, message.get('study_id'))
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {
+                    'id': key,
+                    'user_id': user_id,
+                    'other_user_id': other_user_id,
+                    'study_id': message.get('study_id'),
+                    'last_message_id': message['id'],
+                    'last_message_at': message['created_at'],
+                    'unread_count': 0,
+                    'total_count': 0
+                }
+            elif message['created_at'] >= row['last_message_at']:
+                row['last_message_id'] = message['id']
+                row['last_message_at'] = message['created_at']
+            row['unread_count'] += unread
+            row['total_count'] += 1
+    return list(rows.values())
+
+
+def record_messages(messages):
+    """Add new messages to their senders' and receivers' conversation summaries.
+
+    ``messages`` are dicts with ``id``, ``sender_id``, ``receiver_id``,
+    ``study_id`` and ``created_at`` (and optionally ``read``). Runs inside the
+    caller's transaction; the caller commits.
+    """
+    rows = _summary_rows(messages)
+    if not rows:
+        return
+
+    stmt = conflict_insert(Conversation)
+    newer = stmt.excluded.last_message_at >= func.coalesce(Conversation.last_message_at, stmt.excluded.last_message_at)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Conversation.id],
+        set_={
+            'unread_count': Conversation.unread_count + stmt.excluded.unread_count,
+            'total_count': Conversation.total_count + stmt.excluded.total_count,
+            'last_message_id': case((newer, stmt.excluded.last_message_id), else_=Conversation.last_message_id),
+            'last_message_at': case((newer, stmt.excluded.last_message_at), else_=Conversation.last_message_at),
+            'updated_at': datetime.utcnow()
+        }
+    )
+    db.session.execute(stmt, rows)
+
+    unread = {}
+    for row in rows:
+        if row['unread_count']:
+            unread[row['user_id']] = unread.get(row['user_id'], 0) + row['unread_count']
+    if unread:
+        stmt = conflict_insert(UnreadCounter)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UnreadCounter.user_id],
+            set_={
+                'unread_count': UnreadCounter.unread_count + stmt.excluded.unread_count,
+                'updated_at': datetime.utcnow()
+            }
+        )
+        db.session.execute(stmt, [
+            {'user_id': user_id, 'unread_count': count} for user_id, count in unread.items()
+        ])
+
+
+def _decrement_unread(key, amount):
+    db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == key, Conversation.unread_count > 0)
+        .values(unread_count=case(
+            (Conversation.unread_count > amount, Conversation.unread_count - amount), else_=0
+        )),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def _decrement_user_unread(user_id, amount):
+    db.session.execute(
+        update(UnreadCounter)
+        .where(UnreadCounter.user_id == user_id)
+        .values(unread_count=case(
+            (UnreadCounter.unread_count > amount, UnreadCounter.unread_count - amount), else_=0
+        )),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def mark_read(message):
+    """Take an unread message off its receiver's unread counters"""
+    _decrement_unread(conversation_id(message.receiver_id, message.sender_id, message.study_id), 1)
+    _decrement_user_unread(message.receiver_id, 1)
+
+
+def mark_read_up_to(user_id, message):
+    """Mark ``user_id``'s messages in ``message``'s conversation read up to and including it.
+
+    Only the unread messages of that one conversation are written, found
+    through the ``(receiver_id, read)`` index. The conversation's read marker
+    moves forward (never back) and its unread counter drops by the number of
+    messages marked. Returns that number; the caller commits.
+    """
+    other_user_id = message.sender_id if message.receiver_id == user_id else message.receiver_id
+    same_study = Message.study_id.is_(None) if message.study_id is None else Message.study_id == message.study_id
+    now = datetime.utcnow()
+
+    result = db.session.execute(
+        update(Message)
+        .where(
+            Message.receiver_id == user_id,
+            Message.read.is_(False),
+            Message.sender_id == other_user_id,
+            same_study,
+            or_(
+                Message.created_at < message.created_at,
+                and_(Message.created_at == message.created_at, Message.id <= message.id)
+            )
+        )
+        .values(read=True, read_at=now),
+        execution_options={'synchronize_session': False}
+    )
+
+    key = conversation_id(user_id, other_user_id, message.study_id)
+    db.session.execute(
+        update(Conversation)
+        .where(
+            Conversation.id == key,
+            or_(Conversation.last_read_at.is_(None), Conversation.last_read_at < message.created_at)
+        )
+        .values(last_read_message_id=message.id, last_read_at=message.created_at),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount:
+        _decrement_unread(key, result.rowcount)
+        _decrement_user_unread(user_id, result.rowcount)
+    return result.rowcount
+
+
+def unread_total(user_id):
+    """Unread messages across all of ``user_id``'s conversations"""
+    return db.session.scalar(
+        select(UnreadCounter.unread_count).where(UnreadCounter.user_id == user_id)
+    ) or 0
+
+
+def unread_totals(user_ids):
+    """``{user_id: unread}`` for many users with one query"""
+    totals = dict.fromkeys(user_ids, 0)
+    rows = db.session.execute(
+        select(UnreadCounter.user_id, UnreadCounter.unread_count).where(UnreadCounter.user_id.in_(totals))
+    )
+    totals.update(rows.all())
+    return totals
+
+
+def unread_by_study(user_id):
+    """``{study_id or None: unread}`` for ``user_id``'s conversations with unread messages"""
+    rows = db.session.execute(
+        select(Conversation.study_id, func.sum(Conversation.unread_count))
+        .where(Conversation.user_id == user_id, Conversation.unread_count > 0)
+        .group_by(Conversation.study_id)
+    )
+    return {study_id: unread for study_id, unread in rows}
+
+
+def rebuild_conversations():
+    """Recompute every summary from the messages and archive tables in one INSERT ... SELECT.
+
+    Per-user unread counters are then rebuilt from the summaries. Returns
+    the number of conversations written; the caller owns the commit.
+    """
+    # Both ends of every message, hot and archived
+    sides = union_all(*[
+        statement
+        for model in (Message, ArchivedMessage)
+        for statement in (
+            select(
+                model.id, model.sender_id.label('user_id'), model.receiver_id.label('other_user_id'),
+                model.study_id, model.created_at, literal(0).label('unread')
+            ),
+            select(
+                model.id, model.receiver_id, model.sender_id,
+                model.study_id, model.created_at, case((model.read, 0), else_=1)
+            )
+        )
+    ]).subquery('sides')
+
+    thread = (sides.c.user_id, sides.c.other_user_id, func.coalesce(sides.c.study_id, ''))
+    ranked = select(
+        sides,
+        func.row_number().over(
+            partition_by=thread, order_by=(sides.c.created_at.desc(), sides.c.id.desc())
+        ).label('rank'),
+        func.count().over(partition_by=thread).label('total_count'),
+        func.sum(sides.c.unread).over(partition_by=thread).label('unread_count')
+    ).subquery('ranked')
+
+    key = ranked.c.user_id + ':' + ranked.c.other_user_id + ':' + func.coalesce(ranked.c.study_id, 'general')
+    summaries = select(
+        key, ranked.c.user_id, ranked.c.other_user_id, ranked.c.study_id,
+        ranked.c.id, ranked.c.created_at, ranked.c.unread_count, ranked.c.total_count
+    ).where(ranked.c.rank == 1)
+
+    db.session.execute(delete(Conversation))
+    result = db.session.execute(insert(Conversation).from_select(
+        ['id', 'user_id', 'other_user_id', 'study_id', 'last_message_id',
+         'last_message_at', 'unread_count', 'total_count'],
+        summaries
+    ))
+
+    db.session.execute(delete(UnreadCounter))
+    db.session.execute(insert(UnreadCounter).from_select(
+        ['user_id', 'unread_count'],
+        select(Conversation.user_id, func.sum(Conversation.unread_count))
+        .group_by(Conversation.user_id)
+        .having(func.sum(Conversation.unread_count) > 0)
+    ))
+    return result.rowcount
@@ -0,0 +1,80 @@
+"""
+Denormalized per-study counters.
+
+``Study.applications_count`` and ``Study.participants_current`` are kept in
+step with their rows by relative ``UPDATE studies SET x = x + n`` statements
+issued in the same transaction as the application/participation write, so
+concurrent writers never lose an increment and readers never need an
+aggregate query.
+"""
+
+from sqlalchemy import func, or_, select, update
+from models import db, Study, StudyApplication, StudyParticipation, ParticipationStatus
+
+# Participation statuses that occupy a slot in a study
+ENROLLED_STATUSES = (ParticipationStatus.ACTIVE, ParticipationStatus.COMPLETED)
+
+
+def increment_applications(study_id, amount=1):
+    """Adjust a study's application counter inside the current transaction"""
+    db.session.execute(
+        update(Study)
+        .where(Study.id == study_id)
+        .values(applications_count=func.coalesce(Study.applications_count, 0) + amount),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def increment_participants(study_id, amount=1):
+    """Adjust a study's enrolled participant counter inside the current transaction"""
+    db.session.execute(
+        update(Study)
+        .where(Study.id == study_id)
+        .values(participants_current=func.coalesce(Study.participants_current, 0) + amount),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def reserve_participant_slots(study_id, amount):
+    """Atomically claim ``amount`` enrolment slots if the study has room.
+
+    The capacity check and the increment are a single conditional UPDATE, so
+    concurrent approvals can never push a study past ``participants_needed``.
+    Returns False (and changes nothing) when there is not enough room.
+    """
+    current = func.coalesce(Study.participants_current, 0)
+    result = db.session.execute(
+        update(Study)
+        .where(Study.id == study_id, current + amount <= Study.participants_needed)
+        .values(participants_current=current + amount),
+        execution_options={'synchronize_session': False}
+    )
+    return result.rowcount == 1
+
+
+def recount_study_counters(study_ids=None):
+    """Recompute both counters from the source tables in a single statement.
+
+    Only studies whose stored counters drifted are rewritten. Returns the
+    number of repaired studies; the caller owns the commit.
+    """
+    applications = select(func.count(StudyApplication.id)).where(
+        StudyApplication.study_id == Study.id
+    ).scalar_subquery()
+    participants = select(func.count(StudyParticipation.id)).where(
+        StudyParticipation.study_id == Study.id,
+        StudyParticipation.status.in_(ENROLLED_STATUSES)
+    ).scalar_subquery()
+
+    stmt = update(Study).values(
+        applications_count=applications,
+        participants_current=participants
+    ).where(or_(
+        func.coalesce(Study.applications_count, -1) != applications,
+        func.coalesce(Study.participants_current, -1) != participants
+    ))
+    if study_ids is not None:
+        stmt = stmt.where(Study.id.in_(study_ids))
+
+    result = db.session.execute(stmt, execution_options={'synchronize_session': False})
+    return result.rowcount
@@ -0,0 +1,107 @@
+"""
+Batched application decisions.
+
+A decision over many applications runs as one transaction: the applications
+are read with one query, updated with one UPDATE, and approvals enrol
+participants with one executemany INSERT plus one conditional counter
+update that enforces the study's capacity.
+"""
+
+import uuid
+from datetime import datetime
+from sqlalchemy import insert, select, update
+from models import db, Study, StudyApplication, StudyParticipation, ApplicationStatus, ParticipationStatus
+from counters import reserve_participant_slots
+
+DECISIONS = (ApplicationStatus.APPROVED, ApplicationStatus.REJECTED)
+MAX_BATCH_SIZE = 1000
+
+
+class DecisionConflict(Exception):
+    """Raised when a concurrent writer changed the rows being decided"""
+
+
+def decide_applications(study_id, application_ids, decision):
+    """Apply ``decision`` to pending applications of a study.
+
+    Returns one result per requested id, in request order. Approvals beyond
+    the study's remaining capacity are refused, oldest applications first.
+    Raises DecisionConflict if another request decided the same applications
+    or filled the study concurrently; the caller should roll back.
+    """
+    application_ids = list(dict.fromkeys(application_ids))
+    rows = db.session.execute(
+        select(StudyApplication.id, StudyApplication.user_id, StudyApplication.status)
+        .where(StudyApplication.study_id == study_id, StudyApplication.id.in_(application_ids))
+        .order_by(StudyApplication.created_at, StudyApplication.id)
+    ).all()
+
+    errors = {}
+    pending = []
+    found = {row.id for row in rows}
+    for application_id in application_ids:
+        if application_id not in found:
+            errors[application_id] = 'Application not found'
+    for row in rows:
+        if row.status != ApplicationStatus.PENDING:
+            errors[row.id] = f'Application is already {row.status.value}'
+        else:
+            pending.append(row)
+
+    if decision == ApplicationStatus.APPROVED and pending:
+        needed, current = db.session.execute(
+            select(Study.participants_needed, Study.participants_current).where(Study.id == study_id)
+        ).one()
+        remaining = max(0, needed - (current or 0))
+        for row in pending[remaining:]:
+            errors[row.id] = 'Study is full'
+        pending = pending[:remaining]
+
+    decided_ids = [row.id for row in pending]
+    if decided_ids:
+        result = db.session.execute(
+            update(StudyApplication)
+            .where(StudyApplication.id.in_(decided_ids), StudyApplication.status == ApplicationStatus.PENDING)
+            .values(status=decision),
+            execution_options={'synchronize_session': False}
+        )
+        if result.rowcount != len(decided_ids):
+            raise DecisionConflict('Some applications were decided concurrently')
+
+    if decision == ApplicationStatus.APPROVED and decided_ids:
+        _enroll(study_id, [row.user_id for row in pending])
+
+    return [
+        {'id': application_id, 'status': 'error', 'error': errors[application_id]}
+        if application_id in errors else
+        {'id': application_id, 'status': decision.value}
+        for application_id in application_ids
+    ]
+
+
+def _enroll(study_id, user_ids):
+    """Create participations for newly approved users and claim their slots"""
+    enrolled = set(db.session.scalars(
+        select(StudyParticipation.user_id).where(
+            StudyParticipation.study_id == study_id, StudyParticipation.user_id.in_(user_ids)
+        )
+    ))
+    new_user_ids = [user_id for user_id in user_ids if user_id not in enrolled]
+    if not new_user_ids:
+        return
+
+    if not reserve_participant_slots(study_id, len(new_user_ids)):
+        raise DecisionConflict('Study capacity changed concurrently')
+
+    now = datetime.utcnow()
+    db.session.execute(insert(StudyParticipation), [
+        {
+            'id': str(uuid.uuid4()),
+            'study_id': study_id,
+            'user_id': user_id,
+            'status': ParticipationStatus.ACTIVE,
+            'consent_given': False,
+            'start_date': now
+        }
+        for user_id in new_user_ids
+    ])
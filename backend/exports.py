@@ -0,0 +1,133 @@
+"""
+Streaming exports of study applicants and participants.
+
+Rows are pulled from the database in ``yield_per`` batches and encoded
+incrementally as CSV or NDJSON (optionally gzip-compressed), so memory use
+stays flat no matter how many rows a study has.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from enum import Enum
+from sqlalchemy import select
+from models import db, StudyApplication, StudyParticipation, User, ParticipantProfile
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+BATCH_SIZE = 500
+FLUSH_BYTES = 64 * 1024
+
+_PROFILE_COLUMNS = (
+    User.id.label('user_id'),
+    User.name,
+    User.email,
+    ParticipantProfile.date_of_birth,
+    ParticipantProfile.gender,
+    ParticipantProfile.location,
+    ParticipantProfile.phone_number
+)
+
+
+def applications_query(study_id, statuses=None):
+    stmt = select(
+        StudyApplication.id.label('application_id'),
+        StudyApplication.status,
+        StudyApplication.message,
+        StudyApplication.created_at,
+        *_PROFILE_COLUMNS
+    ).join(
+        User, StudyApplication.user_id == User.id
+    ).outerjoin(
+        ParticipantProfile, ParticipantProfile.user_id == User.id
+    ).where(
+        StudyApplication.study_id == study_id
+    ).order_by(StudyApplication.created_at, StudyApplication.id)
+    if statuses:
+        stmt = stmt.where(StudyApplication.status.in_(statuses))
+    return stmt
+
+
+def participants_query(study_id, statuses):
+    return select(
+        StudyParticipation.id.label('participation_id'),
+        StudyParticipation.status,
+        StudyParticipation.consent_given,
+        StudyParticipation.start_date,
+        StudyParticipation.end_date,
+        StudyParticipation.created_at,
+        *_PROFILE_COLUMNS
+    ).join(
+        User, StudyParticipation.user_id == User.id
+    ).outerjoin(
+        ParticipantProfile, ParticipantProfile.user_id == User.id
+    ).where(
+        StudyParticipation.study_id == study_id,
+        StudyParticipation.status.in_(statuses)
+    ).order_by(StudyParticipation.created_at, StudyParticipation.id)
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def _csv_cell(value):
+    value = _plain(value)
+    # Keep spreadsheet applications from evaluating user-supplied text
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def _encode_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_cell(value) for value in row])
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _encode_ndjson(columns, rows):
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, map(_plain, row))))
+        lines.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+            size = 0
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_rows(stmt, fmt, compress=False):
+    """Yield encoded chunks (bytes) for every row of ``stmt``"""
+    result = db.session.execute(stmt.execution_options(yield_per=BATCH_SIZE))
+    columns = list(result.keys())
+    encode = _encode_csv if fmt == 'csv' else _encode_ndjson
+    chunks = (chunk.encode('utf-8') for chunk in encode(columns, result))
+    return _gzip(chunks) if compress else chunks
@@ -0,0 +1,115 @@
+"""
+Identity of the authenticated user.
+
+``get_current_user_id`` unpacks the JWT identity, which is either the user
+id or (in older tokens) a ``{'user_id': ...}`` dict. ``role_required``
+gates a view on the caller's role, taken from the token's ``role`` claim
+when present and otherwise from a short-lived in-process summary of the
+user, so most role checks need no query.
+
+Users fetched through these helpers are remembered on ``flask.g`` for the
+rest of the request, so handlers that need the same users several times (or
+for many messages at once) load each of them with at most one query.
+"""
+
+from collections import namedtuple
+from functools import wraps
+from flask import current_app, g, jsonify
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from models import db, User, UserRole
+from caching import user_summaries
+
+UserSummary = namedtuple('UserSummary', ['id', 'role', 'name', 'email'])
+
+
+def _cache():
+    if '_user_cache' not in g:
+        g._user_cache = {}
+    return g._user_cache
+
+
+def remember_users(users):
+    """Add already loaded users to the request cache"""
+    cache = _cache()
+    for user in users:
+        if user is not None:
+            cache[user.id] = user
+
+
+def get_cached_users(user_ids):
+    """Return ``{user_id: User or None}``, querying only ids not seen yet"""
+    cache = _cache()
+    missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in cache]
+    if missing:
+        found = User.query.filter(User.id.in_(missing)).all()
+        remember_users(found)
+        for user_id in missing:
+            cache.setdefault(user_id, None)
+    return {user_id: cache[user_id] for user_id in user_ids}
+
+
+def get_cached_user(user_id):
+    return get_cached_users([user_id])[user_id]
+
+
+def get_current_user_id():
+    """User id of the current JWT (raises KeyError for a malformed identity)"""
+    identity = get_jwt_identity()
+    if isinstance(identity, dict):
+        return identity['user_id']
+    return identity
+
+
+def get_current_user():
+    """The authenticated User (or None), loaded at most once per request"""
+    return get_cached_user(get_current_user_id())
+
+
+def get_user_summary(user_id):
+    """``UserSummary`` of a user, or None if it does not exist.
+
+    Served from a process-wide TTL cache unless ``USER_SUMMARY_CACHE`` is
+    turned off; a request that already loaded the user reuses it.
+    """
+    use_cache = current_app.config.get('USER_SUMMARY_CACHE', True)
+    summary = user_summaries.get(user_id) if use_cache else None
+    if summary is None:
+        user = _cache().get(user_id)
+        if user is None:
+            row = db.session.query(User.id, User.role, User.name, User.email).filter(User.id == user_id).first()
+        else:
+            row = (user.id, user.role, user.name, user.email)
+        if row is None:
+            return None
+        summary = UserSummary(*row)
+        if use_cache:
+            user_summaries.set(user_id, summary)
+    return summary
+
+
+def get_current_role():
+    """Role of the caller from the token claims, falling back to the user summary"""
+    role = get_jwt().get('role')
+    if role:
+        return UserRole(role)
+    summary = get_user_summary(get_current_user_id())
+    return summary.role if summary else None
+
+
+def role_required(*roles, error='User not found'):
+    """Reject callers whose role is not in ``roles`` with a 404 ``error``.
+
+    Must be applied below ``@jwt_required()``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                role = get_current_role()
+            except (KeyError, ValueError):
+                return jsonify({'error': 'Invalid token format'}), 422
+            if role not in roles:
+                return jsonify({'error': error}), 404
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
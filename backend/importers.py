@@ -0,0 +1,299 @@
+"""
+Bulk import helpers shared by the HTTP endpoints and the Flask CLI.
+
+Records are validated one by one, then written with a single executemany
+INSERT per chunk, each chunk in its own transaction. Every input record gets
+a result entry so callers can report exactly which rows were loaded.
+
+Participant imports also hash each chunk's passwords in parallel before the
+chunk is written (see ``passwords.hash_passwords``), and can create accounts
+without a password, returning a signed invite token per participant instead.
+"""
+
+import json
+import uuid
+from datetime import datetime
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Study, StudyStatus, User, UserRole, ParticipantProfile, normalize_email
+from caching import study_facets
+from passwords import hash_passwords, UNUSABLE_PASSWORD
+from tokens import issue_invite
+
+PARTICIPANT_REQUIRED_FIELDS = ['email', 'name']
+# bcrypt only uses the first 72 bytes of a password
+MAX_PASSWORD_BYTES = 72
+STUDY_REQUIRED_FIELDS = ['title', 'description', 'institution', 'category', 'duration', 'participants_needed']
+STUDY_TEXT_FIELDS = ['title', 'description', 'institution', 'category', 'duration']
+STUDY_OPTIONAL_TEXT_FIELDS = ['location', 'irb_approval_number', 'consent_form']
+DEFAULT_CHUNK_SIZE = 500
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+def _parse_date(data, field):
+    value = data.get(field)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {field}, expected YYYY-MM-DD")
+
+
+def study_row_from_payload(data, researcher_id, allow_status=False):
+    """Validate a study payload and return the column values for an INSERT.
+
+    Raises ValueError with a client-facing message when the payload is invalid.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    if not all(k in data for k in STUDY_REQUIRED_FIELDS):
+        raise ValueError('Missing required fields')
+    for field in STUDY_TEXT_FIELDS:
+        if not isinstance(data[field], str):
+            raise ValueError(f'{field} must be a string')
+    for field in STUDY_OPTIONAL_TEXT_FIELDS:
+        if data.get(field) is not None and not isinstance(data[field], str):
+            raise ValueError(f'{field} must be a string')
+
+    try:
+        participants_needed = int(data['participants_needed'])
+    except (TypeError, ValueError):
+        raise ValueError('participants_needed must be an integer')
+    if participants_needed <= 0:
+        raise ValueError('participants_needed must be positive')
+
+    compensation = data.get('compensation')
+    if compensation is not None and (isinstance(compensation, bool) or not isinstance(compensation, (int, float))):
+        raise ValueError('compensation must be a number')
+
+    status = StudyStatus.DRAFT
+    if allow_status and data.get('status'):
+        try:
+            status = StudyStatus(data['status'])
+        except ValueError:
+            raise ValueError(f"Invalid status: {data['status']}")
+
+    return {
+        'id': str(uuid.uuid4()),
+        'title': data['title'],
+        'description': data['description'],
+        'institution': data['institution'],
+        'researcher_id': researcher_id,
+        'category': data['category'],
+        'duration': data['duration'],
+        'compensation': compensation,
+        'location': data.get('location'),
+        'participants_needed': participants_needed,
+        'status': status,
+        'irb_approval_number': data.get('irb_approval_number'),
+        'consent_form': data.get('consent_form'),
+        'requirements': json.dumps(data.get('requirements', [])),
+        'start_date': _parse_date(data, 'start_date'),
+        'end_date': _parse_date(data, 'end_date'),
+        'application_deadline': _parse_date(data, 'application_deadline')
+    }
+
+
+def participant_rows_from_payload(data, invite=False):
+    """Validate a participant payload and return ``(user row, profile row, password)``.
+
+    ``password`` is None when ``invite`` is set and the payload has none.
+    Raises ValueError with a client-facing message when the payload is invalid.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    if not all(data.get(k) for k in PARTICIPANT_REQUIRED_FIELDS):
+        raise ValueError('Missing required fields')
+    if not all(isinstance(data[k], str) for k in PARTICIPANT_REQUIRED_FIELDS):
+        raise ValueError('email and name must be strings')
+    email = data['email'].strip()
+    if '@' not in email:
+        raise ValueError(f'Invalid email: {email}')
+    password = data.get('password')
+    if password is None:
+        if not invite:
+            raise ValueError('Missing password')
+    elif not isinstance(password, str) or not password:
+        raise ValueError('password must be a non-empty string')
+    elif len(password.encode('utf-8')) > MAX_PASSWORD_BYTES:
+        raise ValueError(f'password must be at most {MAX_PASSWORD_BYTES} bytes')
+
+    user_id = str(uuid.uuid4())
+    user = {
+        'id': user_id,
+        'email': email,
+        'email_normalized': normalize_email(email),
+        'name': data['name'],
+        'role': UserRole.PARTICIPANT
+    }
+    profile = {
+        'id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'date_of_birth': _parse_date(data, 'date_of_birth'),
+        'gender': data.get('gender'),
+        'location': data.get('location'),
+        'bio': data.get('bio'),
+        'interests': json.dumps(data.get('interests', [])),
+        'availability': json.dumps(data.get('availability', {})),
+        'phone_number': data.get('phone_number')
+    }
+    return user, profile, password
+
+
+def iter_ndjson(lines):
+    """Decode NDJSON lines lazily, yielding a ValueError for each bad line"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f'Invalid JSON: {e}')
+
+
+def _insert_chunk(model, chunk):
+    try:
+        db.session.execute(insert(model), [row for _, row in chunk])
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        if len(chunk) > 1:
+            # Retry row by row so only the offending rows are reported
+            for entry in chunk:
+                _insert_chunk(model, [entry])
+            return
+        error = str(getattr(e, 'orig', None) or e)
+        for result, _ in chunk:
+            result.pop('id', None)
+            result.update(status='error', error=error)
+
+
+def import_studies(records, researcher_id, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Import an iterable of study payloads owned by ``researcher_id``.
+
+    Returns one result per record, in input order.
+    """
+    results = []
+    chunk = []
+
+    for index, record in enumerate(records):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            row = study_row_from_payload(record, researcher_id, allow_status=True)
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'error': str(e)})
+            continue
+
+        result = {'index': index, 'status': 'created', 'id': row['id']}
+        results.append(result)
+        chunk.append((result, row))
+
+        if len(chunk) >= chunk_size:
+            _insert_chunk(Study, chunk)
+            chunk = []
+
+    if chunk:
+        _insert_chunk(Study, chunk)
+
+    study_facets.clear()
+    return results
+
+
+def _insert_participant_chunk(chunk):
+    # Report accounts that already exist per row instead of failing the chunk
+    emails = [user['email_normalized'] for _, user, _, _ in chunk]
+    existing = set(db.session.scalars(
+        select(User.email_normalized).where(User.email_normalized.in_(emails))
+    ))
+    pending = []
+    for entry in chunk:
+        result, user, _, _ = entry
+        if user['email_normalized'] in existing:
+            result.pop('id', None)
+            result.update(status='error', error='User with this email already exists')
+        else:
+            pending.append(entry)
+    if not pending:
+        db.session.rollback()
+        return
+
+    # Hash the chunk's passwords in parallel; invited users get none
+    passwords = [password for _, _, _, password in pending if password]
+    hashes = iter(hash_passwords(passwords))
+    hashed = []
+    for entry in pending:
+        result, user, _, password = entry
+        password_hash = next(hashes) if password else UNUSABLE_PASSWORD
+        if isinstance(password_hash, Exception):
+            result.pop('id', None)
+            result.update(status='error', error=f'Could not hash password: {password_hash}')
+            continue
+        user['password_hash'] = password_hash
+        if not password:
+            result['invite_token'] = issue_invite(user['id'])
+        hashed.append(entry)
+    pending = hashed
+    if not pending:
+        db.session.rollback()
+        return
+
+    try:
+        db.session.execute(insert(User), [user for _, user, _, _ in pending])
+        db.session.execute(insert(ParticipantProfile), [profile for _, _, profile, _ in pending])
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        error = str(getattr(e, 'orig', None) or e)
+        for result, _, _, _ in pending:
+            result.pop('id', None)
+            result.pop('invite_token', None)
+            result.update(status='error', error=error)
+
+
+def import_participants(records, chunk_size=DEFAULT_CHUNK_SIZE, invite=False):
+    """Create participant accounts (with profiles) from an iterable of payloads.
+
+    With ``invite``, records without a password get an unusable one and an
+    ``invite_token`` in their result, redeemable at ``/api/auth/accept-invite``.
+    Returns one result per record, in input order.
+    """
+    results = []
+    chunk = []
+    seen = set()
+
+    for index, record in enumerate(records):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            user, profile, password = participant_rows_from_payload(record, invite=invite)
+            if user['email_normalized'] in seen:
+                raise ValueError('Duplicate email in import')
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'error': str(e)})
+            continue
+
+        seen.add(user['email_normalized'])
+        result = {'index': index, 'status': 'created', 'id': user['id'], 'email': user['email']}
+        results.append(result)
+        chunk.append((result, user, profile, password))
+
+        if len(chunk) >= chunk_size:
+            _insert_participant_chunk(chunk)
+            chunk = []
+
+    if chunk:
+        _insert_participant_chunk(chunk)
+
+    return results
+
+
+def summarize_results(results):
+    created = sum(1 for r in results if r['status'] == 'created')
+    return {
+        'created': created,
+        'failed': len(results) - created,
+        'results': results
+    }
@@ -13,6 +13,10 @@ from datetime import datetime, timedelta, date
 import uuid
 import bcrypt
 
+# Timestamps are stored in the same text form SQLAlchemy writes
+# (YYYY-MM-DD HH:MM:SS.ffffff) so keyset cursors compare correctly
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
 def init_database():
     """Initialize database with tables and mock data"""
     print("Initializing ResMatch Database...")
@@ -71,14 +75,17 @@ def create_tables(cursor):
         CREATE TABLE users (
             id TEXT PRIMARY KEY,
             email TEXT UNIQUE NOT NULL,
+            email_normalized TEXT NOT NULL,
             name TEXT NOT NULL,
             role TEXT NOT NULL CHECK (role IN ('RESEARCHER', 'PARTICIPANT', 'ADMIN')),
             password_hash TEXT NOT NULL,
             avatar TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            token_version INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now'))
         )
     ''')
+    cursor.execute('CREATE UNIQUE INDEX ix_users_email_normalized ON users (email_normalized)')
     
     # Researcher profiles table
     cursor.execute('''
@@ -90,8 +97,8 @@ def create_tables(cursor):
             title TEXT,
             bio TEXT,
             verified BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
             FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
         )
     ''')
@@ -108,8 +115,8 @@ def create_tables(cursor):
             interests TEXT,
             availability TEXT,
             phone_number TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
             FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
         )
     ''')
@@ -128,6 +135,7 @@ def create_tables(cursor):
             location TEXT,
             participants_needed INTEGER,
             participants_current INTEGER DEFAULT 0,
+            applications_count INTEGER NOT NULL DEFAULT 0,
             status TEXT DEFAULT 'ACTIVE' CHECK (status IN ('ACTIVE', 'COMPLETED', 'CANCELLED', 'DRAFT')),
             irb_approval_number TEXT,
             consent_form TEXT,  -- Added consent_form column
@@ -135,12 +143,18 @@ def create_tables(cursor):
             start_date DATE,
             end_date DATE,
             application_deadline DATE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
             FOREIGN KEY (researcher_id) REFERENCES users (id) ON DELETE CASCADE
         )
     ''')
     
+    # Indexes backing catalog filters and facet GROUP BYs
+    cursor.execute('CREATE INDEX ix_studies_researcher_id ON studies (researcher_id)')
+    cursor.execute('CREATE INDEX ix_studies_category ON studies (category)')
+    cursor.execute('CREATE INDEX ix_studies_status ON studies (status)')
+    cursor.execute('CREATE INDEX ix_studies_location ON studies (location)')
+    
     # Study applications table
     cursor.execute('''
         CREATE TABLE study_applications (
@@ -150,8 +164,8 @@ def create_tables(cursor):
             status TEXT DEFAULT 'PENDING' CHECK (status IN ('PENDING', 'APPROVED', 'REJECTED', 'WITHDRAWN')),
             message TEXT,
             consent_form TEXT,  -- Added consent_form column
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
             FOREIGN KEY (study_id) REFERENCES studies (id) ON DELETE CASCADE,
             FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
             UNIQUE(study_id, user_id)
@@ -169,14 +183,18 @@ def create_tables(cursor):
             start_date TIMESTAMP,
             end_date TIMESTAMP,
             notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
             FOREIGN KEY (study_id) REFERENCES studies (id) ON DELETE CASCADE,
             FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
             UNIQUE(study_id, user_id)
         )
     ''')
     
+    # Indexes backing paginated, status-filtered applicant and participant views
+    cursor.execute('CREATE INDEX ix_study_applications_study_status_created ON study_applications (study_id, status, created_at)')
+    cursor.execute('CREATE INDEX ix_study_participations_study_status_created ON study_participations (study_id, status, created_at)')
+    
     # Messages table
     cursor.execute('''
         CREATE TABLE messages (
@@ -188,13 +206,124 @@ def create_tables(cursor):
             type TEXT DEFAULT 'TEXT' CHECK (type IN ('TEXT', 'FILE', 'SYSTEM')),
             read BOOLEAN DEFAULT FALSE,
             read_at TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            search_rowid INTEGER,
+            FOREIGN KEY (study_id) REFERENCES studies (id) ON DELETE SET NULL,
+            FOREIGN KEY (sender_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (receiver_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    
+    cursor.execute('CREATE INDEX ix_messages_sender_receiver_created ON messages (sender_id, receiver_id, created_at, id)')
+    cursor.execute('CREATE INDEX ix_messages_receiver_read ON messages (receiver_id, read)')
+    cursor.execute('CREATE INDEX ix_messages_sender_created ON messages (sender_id, created_at, id)')
+    cursor.execute('CREATE INDEX ix_messages_receiver_created ON messages (receiver_id, created_at, id)')
+    cursor.execute('CREATE UNIQUE INDEX ix_messages_search_rowid ON messages (search_rowid)')
+    
+    # Cold storage for archived messages
+    cursor.execute('''
+        CREATE TABLE messages_archive (
+            id TEXT PRIMARY KEY,
+            study_id TEXT,
+            sender_id TEXT NOT NULL,
+            receiver_id TEXT NOT NULL,
+            content TEXT NOT NULL,
+            type TEXT DEFAULT 'TEXT',
+            read BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP,
+            read_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            search_rowid INTEGER,
             FOREIGN KEY (study_id) REFERENCES studies (id) ON DELETE SET NULL,
             FOREIGN KEY (sender_id) REFERENCES users (id) ON DELETE CASCADE,
             FOREIGN KEY (receiver_id) REFERENCES users (id) ON DELETE CASCADE
         )
     ''')
+    cursor.execute('CREATE INDEX ix_messages_archive_sender_receiver_created ON messages_archive (sender_id, receiver_id, created_at, id)')
+    cursor.execute('CREATE INDEX ix_messages_archive_sender_created ON messages_archive (sender_id, created_at, id)')
+    cursor.execute('CREATE INDEX ix_messages_archive_receiver_created ON messages_archive (receiver_id, created_at, id)')
+    cursor.execute('CREATE UNIQUE INDEX ix_messages_archive_search_rowid ON messages_archive (search_rowid)')
+    
+    # Full-text index over message content, kept current by triggers and
+    # keyed by the stable messages.search_rowid
+    cursor.execute('''
+        CREATE VIRTUAL TABLE messages_fts USING fts5(
+            content, content='messages', content_rowid='search_rowid', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+            UPDATE messages SET search_rowid = (SELECT IFNULL(MAX(search_rowid), 0) + 1 FROM messages)
+            WHERE id = new.id AND search_rowid IS NULL;
+            INSERT INTO messages_fts(rowid, content) SELECT search_rowid, content FROM messages WHERE id = new.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.search_rowid, old.content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.search_rowid, old.content);
+            INSERT INTO messages_fts(rowid, content) VALUES (new.search_rowid, new.content);
+        END
+    ''')
+    
+    # The same index over the archive, so archived messages stay searchable
+    cursor.execute('''
+        CREATE VIRTUAL TABLE messages_archive_fts USING fts5(
+            content, content='messages_archive', content_rowid='search_rowid', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER messages_archive_fts_insert AFTER INSERT ON messages_archive BEGIN
+            UPDATE messages_archive SET search_rowid = (SELECT IFNULL(MAX(search_rowid), 0) + 1 FROM messages_archive)
+            WHERE id = new.id AND search_rowid IS NULL;
+            INSERT INTO messages_archive_fts(rowid, content)
+            SELECT search_rowid, content FROM messages_archive WHERE id = new.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER messages_archive_fts_delete AFTER DELETE ON messages_archive BEGIN
+            INSERT INTO messages_archive_fts(messages_archive_fts, rowid, content) VALUES ('delete', old.search_rowid, old.content);
+        END
+    ''')
+    
+    # Conversation summaries, one row per user and thread
+    cursor.execute('''
+        CREATE TABLE conversations (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            other_user_id TEXT NOT NULL,
+            study_id TEXT,
+            last_message_id TEXT,
+            last_message_at TIMESTAMP,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            total_count INTEGER NOT NULL DEFAULT 0,
+            last_read_message_id TEXT,
+            last_read_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (other_user_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (study_id) REFERENCES studies (id) ON DELETE SET NULL,
+            FOREIGN KEY (last_message_id) REFERENCES messages (id) ON DELETE SET NULL,
+            FOREIGN KEY (last_read_message_id) REFERENCES messages (id) ON DELETE SET NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX ix_conversations_user_last_message ON conversations (user_id, last_message_at, id)')
+    
+    # Total unread messages per user
+    cursor.execute('''
+        CREATE TABLE unread_counters (
+            user_id TEXT PRIMARY KEY,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
     
     print("Database tables created successfully!")
 
@@ -230,8 +359,8 @@ def create_mock_data(conn, cursor):
         researcher_data['password_hash'] = password_hash
     
     cursor.executemany('''
-        INSERT INTO users (id, email, name, role, password_hash)
-        VALUES (:id, :email, :name, :role, :password_hash)
+        INSERT INTO users (id, email, email_normalized, name, role, password_hash)
+        VALUES (:id, :email, lower(trim(:email)), :name, :role, :password_hash)
     ''', researchers_data)
     
     # Create researcher profiles
@@ -310,8 +439,8 @@ def create_mock_data(conn, cursor):
         participant_data['password_hash'] = password_hash
     
     cursor.executemany('''
-        INSERT INTO users (id, email, name, role, password_hash)
-        VALUES (:id, :email, :name, :role, :password_hash)
+        INSERT INTO users (id, email, email_normalized, name, role, password_hash)
+        VALUES (:id, :email, lower(trim(:email)), :name, :role, :password_hash)
     ''', participants_data)
     
     # Create participant profiles
@@ -391,7 +520,7 @@ def create_mock_data(conn, cursor):
             'compensation': 50.0,
             'location': 'Remote',
             'participants_needed': 100,
-            'participants_current': 45,
+            'participants_current': 0,
             'status': 'ACTIVE',
             'irb_approval_number': 'IRB-2025-123456',
             'consent_form': 'Standard consent form for social media research',
@@ -417,7 +546,7 @@ def create_mock_data(conn, cursor):
             'compensation': 30.0,
             'location': 'Remote',
             'participants_needed': 80,
-            'participants_current': 78,
+            'participants_current': 0,
             'status': 'ACTIVE',
             'irb_approval_number': 'IRB-2025-234567',
             'consent_form': 'Sleep study consent with wearable device tracking',
@@ -442,7 +571,7 @@ def create_mock_data(conn, cursor):
             'compensation': 75.0,
             'location': 'Los Angeles, CA',
             'participants_needed': 60,
-            'participants_current': 25,
+            'participants_current': 0,
             'status': 'ACTIVE',
             'irb_approval_number': 'IRB-2025-345678',
             'consent_form': 'Exercise study consent with cognitive testing',
@@ -512,7 +641,7 @@ def create_mock_data(conn, cursor):
             'user_id': participants_data[0]['id'],  # Sarah Johnson
             'status': 'ACTIVE',
             'consent_given': 1,
-            'start_date': (datetime.utcnow() - timedelta(days=14)).isoformat(),
+            'start_date': (datetime.utcnow() - timedelta(days=14)).strftime(TIMESTAMP_FORMAT),
             'notes': 'Participant is very engaged and providing detailed responses.'
         },
         {
@@ -521,7 +650,7 @@ def create_mock_data(conn, cursor):
             'user_id': participants_data[1]['id'],  # Michael Chen
             'status': 'ACTIVE',
             'consent_given': 1,
-            'start_date': (datetime.utcnow() - timedelta(days=7)).isoformat(),
+            'start_date': (datetime.utcnow() - timedelta(days=7)).strftime(TIMESTAMP_FORMAT),
             'notes': 'Consistently submitting sleep tracking data on time.'
         }
     ]
@@ -531,6 +660,20 @@ def create_mock_data(conn, cursor):
         VALUES (:id, :study_id, :user_id, :status, :consent_given, :start_date, :notes)
     ''', participations_data)
     
+    # Keep the denormalized counters in step with the mock rows (the same
+    # counts as counters.recount_study_counters)
+    cursor.execute('''
+        UPDATE studies SET
+            applications_count = (
+                SELECT COUNT(*) FROM study_applications WHERE study_applications.study_id = studies.id
+            ),
+            participants_current = (
+                SELECT COUNT(*) FROM study_participations
+                WHERE study_participations.study_id = studies.id
+                AND study_participations.status IN ('ACTIVE', 'COMPLETED')
+            )
+    ''')
+    
     # Create some messages
     messages_data = [
         {
@@ -585,6 +728,35 @@ def create_mock_data(conn, cursor):
         VALUES (:id, :study_id, :sender_id, :receiver_id, :content, :type, :read)
     ''', messages_data)
     
+    # Build conversation summaries from the messages
+    cursor.execute('''
+        INSERT INTO conversations (id, user_id, other_user_id, study_id, last_message_id,
+                                   last_message_at, unread_count, total_count)
+        SELECT user_id || ':' || other_user_id || ':' || COALESCE(study_id, 'general'),
+               user_id, other_user_id, study_id, id, created_at, unread_count, total_count
+        FROM (
+            SELECT sides.*,
+                   ROW_NUMBER() OVER thread_newest AS rank,
+                   COUNT(*) OVER thread AS total_count,
+                   SUM(unread) OVER thread AS unread_count
+            FROM (
+                SELECT id, sender_id AS user_id, receiver_id AS other_user_id, study_id, created_at, 0 AS unread
+                FROM messages
+                UNION ALL
+                SELECT id, receiver_id, sender_id, study_id, created_at, CASE WHEN read THEN 0 ELSE 1 END
+                FROM messages
+            ) AS sides
+            WINDOW thread AS (PARTITION BY user_id, other_user_id, COALESCE(study_id, '')),
+                   thread_newest AS (thread ORDER BY created_at DESC, id DESC)
+        )
+        WHERE rank = 1
+    ''')
+    cursor.execute('''
+        INSERT INTO unread_counters (user_id, unread_count)
+        SELECT user_id, SUM(unread_count) FROM conversations
+        GROUP BY user_id HAVING SUM(unread_count) > 0
+    ''')
+    
     # Commit all changes
     conn.commit()
     print("Mock data created successfully!")
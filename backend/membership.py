@@ -0,0 +1,58 @@
+"""
+Who belongs to a study, for authorization checks.
+
+A study's researcher, applicants and participants are resolved with one
+query and cached per study, so checks such as "may these two users message
+each other about this study" become set lookups. Writers of applications or
+participations must call ``invalidate_study_members`` after committing.
+"""
+
+from collections import namedtuple
+from sqlalchemy import literal, select, union_all
+from models import db, Study, StudyApplication, StudyParticipation
+from caching import study_members
+
+StudyMembers = namedtuple('StudyMembers', ['study_id', 'title', 'researcher_id', 'applicant_ids', 'participant_ids'])
+
+
+def _load_members(study_id):
+    rows = db.session.execute(union_all(
+        select(literal('study'), Study.researcher_id, Study.title).where(Study.id == study_id),
+        select(literal('applicant'), StudyApplication.user_id, literal(None)).where(StudyApplication.study_id == study_id),
+        select(literal('participant'), StudyParticipation.user_id, literal(None)).where(StudyParticipation.study_id == study_id)
+    )).all()
+
+    study = next((row for row in rows if row[0] == 'study'), None)
+    if study is None:
+        return None
+    return StudyMembers(
+        study_id=study_id,
+        title=study[2],
+        researcher_id=study[1],
+        applicant_ids=frozenset(row[1] for row in rows if row[0] == 'applicant'),
+        participant_ids=frozenset(row[1] for row in rows if row[0] == 'participant')
+    )
+
+
+def get_study_members(study_id):
+    """Cached ``StudyMembers`` of a study, or None when it does not exist"""
+    members = study_members.get(study_id)
+    if members is None:
+        members = _load_members(study_id)
+        # Missing studies are not cached so a later insert is seen immediately
+        if members is not None:
+            study_members.set(study_id, members)
+    return members
+
+
+def is_associated(members, user_id):
+    """True if the user runs, applied to or participates in the study"""
+    return (
+        user_id == members.researcher_id
+        or user_id in members.applicant_ids
+        or user_id in members.participant_ids
+    )
+
+
+def invalidate_study_members(study_id):
+    study_members.invalidate(study_id)
@@ -0,0 +1,156 @@
+"""
+Optional group commit for message inserts.
+
+With ``MESSAGE_GROUP_COMMIT`` enabled, ``send_message`` hands its validated
+row to a single background writer instead of committing on its own. The
+writer collects rows for up to ``MESSAGE_GROUP_COMMIT_INTERVAL_MS`` (or
+until ``MESSAGE_GROUP_COMMIT_MAX_BATCH`` rows are waiting) and writes the
+whole batch, with its conversation summaries, in one transaction, so a burst
+of messages costs one commit (one fsync on SQLite) instead of one per
+message. Each request blocks on a future until its own row is durable, so
+responses still mean "saved".
+
+If a batch fails, its rows are retried one transaction each so a single bad
+row only fails its own request.
+
+A request that times out cancels its row. The writer claims every row before
+flushing it and drops cancelled ones, so a timed-out send is either never
+written (``WriteTimeout``, safe to retry) or, if it was already claimed,
+waited for until it commits.
+"""
+
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from sqlalchemy import insert
+from models import db, Message
+from conversations import record_messages
+
+_STOP = object()
+
+
+class WriteTimeout(Exception):
+    """The row was not written within the timeout and has been withdrawn"""
+
+
+class MessageWriter:
+    """Background thread that commits queued message rows in batches"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MESSAGE_GROUP_COMMIT', False)
+        app.config.setdefault('MESSAGE_GROUP_COMMIT_INTERVAL_MS', 5)
+        app.config.setdefault('MESSAGE_GROUP_COMMIT_MAX_BATCH', 200)
+        app.config.setdefault('MESSAGE_GROUP_COMMIT_TIMEOUT', 10)
+        app.extensions['message_writer'] = self
+        self.app = app
+        atexit.register(self.stop)
+
+    @property
+    def enabled(self):
+        return bool(self.app and self.app.config['MESSAGE_GROUP_COMMIT'])
+
+    def submit(self, row):
+        """Queue a message row; the returned future resolves once it is committed"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((row, future))
+        return future
+
+    def write(self, row):
+        """Queue a message row and wait for its commit"""
+        future = self.submit(row)
+        try:
+            return future.result(timeout=self.app.config['MESSAGE_GROUP_COMMIT_TIMEOUT'])
+        except FutureTimeoutError:
+            # Not the builtin TimeoutError before Python 3.11
+            if future.cancel():
+                raise WriteTimeout('Message could not be saved in time, please retry')
+            # Already claimed by the writer: it is being committed right now
+            return future.result()
+
+    def stop(self):
+        """Flush what is queued and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = self._collect(batch)
+            with self.app.app_context():
+                self._commit(batch)
+            if stopping:
+                return
+
+    def _collect(self, batch):
+        """Gather more queued rows until the interval passes or the batch is full"""
+        interval = self.app.config['MESSAGE_GROUP_COMMIT_INTERVAL_MS'] / 1000
+        max_batch = self.app.config['MESSAGE_GROUP_COMMIT_MAX_BATCH']
+        deadline = time.monotonic() + interval
+        while len(batch) < max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return True
+            batch.append(item)
+        return False
+
+    def _commit(self, batch):
+        # Claim each row; rows whose request already gave up are dropped
+        batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            self._write([row for row, _ in batch])
+        except Exception:
+            db.session.rollback()
+            # Isolate the failing row(s)
+            for row, future in batch:
+                try:
+                    self._write([row])
+                except Exception as e:
+                    db.session.rollback()
+                    future.set_exception(e)
+                else:
+                    future.set_result(row)
+        else:
+            for row, future in batch:
+                future.set_result(row)
+        finally:
+            db.session.remove()
+
+    @staticmethod
+    def _write(rows):
+        db.session.execute(insert(Message), rows)
+        record_messages(rows)
+        db.session.commit()
+
+
+message_writer = MessageWriter()
@@ -1,11 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import validates
 from datetime import datetime
 from enum import Enum
+from passwords import bcrypt, hash_password, check_password
 
 # These will be initialized in app.py
 db = SQLAlchemy()
-bcrypt = Bcrypt()
 
 # Enums
 class UserRole(Enum):
@@ -37,16 +38,24 @@ class MessageType(Enum):
     CONSENT_FORM = "CONSENT_FORM"
     NOTIFICATION = "NOTIFICATION"
 
+def normalize_email(email):
+    """Lookup form of an email address: trimmed and lowercased"""
+    return email.strip().lower() if email else email
+
 # Models
 class User(db.Model):
     __tablename__ = 'users'
     
     id = db.Column(db.String, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
+    # Case-insensitive lookup key, kept in sync with email by the validator below
+    email_normalized = db.Column(db.String(120), unique=True, index=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     role = db.Column(db.Enum(UserRole), default=UserRole.PARTICIPANT, nullable=False)
     avatar = db.Column(db.String(255))
+    # Bumped to revoke every token issued so far (see tokens.py)
+    token_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -59,11 +68,16 @@ class User(db.Model):
     sent_messages = db.relationship('Message', foreign_keys='Message.sender_id', backref='sender')
     received_messages = db.relationship('Message', foreign_keys='Message.receiver_id', backref='receiver')
     
+    @validates('email')
+    def _normalize_email(self, key, email):
+        self.email_normalized = normalize_email(email)
+        return email
+    
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return check_password(self.password_hash, password)
 
 class ResearcherProfile(db.Model):
     __tablename__ = 'researcher_profiles'
@@ -99,15 +113,16 @@ class Study(db.Model):
     id = db.Column(db.String, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
-    researcher_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    researcher_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
     institution = db.Column(db.String(200))
-    category = db.Column(db.String(100), nullable=False)
+    category = db.Column(db.String(100), nullable=False, index=True)
     duration = db.Column(db.String(50), nullable=False)
     compensation = db.Column(db.Float)
-    location = db.Column(db.String(200))
+    location = db.Column(db.String(200), index=True)
     participants_needed = db.Column(db.Integer, nullable=False)
     participants_current = db.Column(db.Integer, default=0)
-    status = db.Column(db.Enum(StudyStatus), default=StudyStatus.ACTIVE)
+    applications_count = db.Column(db.Integer, default=0, nullable=False)
+    status = db.Column(db.Enum(StudyStatus), default=StudyStatus.ACTIVE, index=True)
     irb_approval_number = db.Column(db.String(100))
     consent_form = db.Column(db.Text)
     requirements = db.Column(db.Text)  # JSON string
@@ -124,6 +139,10 @@ class Study(db.Model):
 
 class StudyApplication(db.Model):
     __tablename__ = 'study_applications'
+    __table_args__ = (
+        db.UniqueConstraint('study_id', 'user_id', name='uq_study_applications_study_user'),
+        db.Index('ix_study_applications_study_status_created', 'study_id', 'status', 'created_at'),
+    )
     
     id = db.Column(db.String, primary_key=True)
     study_id = db.Column(db.String, db.ForeignKey('studies.id'), nullable=False)
@@ -135,6 +154,9 @@ class StudyApplication(db.Model):
 
 class StudyParticipation(db.Model):
     __tablename__ = 'study_participations'
+    __table_args__ = (
+        db.Index('ix_study_participations_study_status_created', 'study_id', 'status', 'created_at'),
+    )
     
     id = db.Column(db.String, primary_key=True)
     study_id = db.Column(db.String, db.ForeignKey('studies.id'), nullable=False)
@@ -149,6 +171,13 @@ class StudyParticipation(db.Model):
 
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index('ix_messages_sender_receiver_created', 'sender_id', 'receiver_id', 'created_at', 'id'),
+        db.Index('ix_messages_receiver_read', 'receiver_id', 'read'),
+        # Per-direction mailbox pages (see pagination.paginate_union)
+        db.Index('ix_messages_sender_created', 'sender_id', 'created_at', 'id'),
+        db.Index('ix_messages_receiver_created', 'receiver_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.String, primary_key=True)
     study_id = db.Column(db.String, db.ForeignKey('studies.id'))
@@ -159,4 +188,107 @@ class Message(db.Model):
     read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     read_at = db.Column(db.DateTime)
+    # Stable integer key of the row in messages_fts, assigned by the insert
+    # trigger. The implicit rowid of a table with a TEXT primary key may be
+    # renumbered by VACUUM, which would point the index at the wrong rows.
+    search_rowid = db.Column(db.Integer, unique=True, index=True)
+
+
+# Cold storage for old messages, moved out of messages by archive.archive_messages
+class ArchivedMessage(db.Model):
+    __tablename__ = 'messages_archive'
+    __table_args__ = (
+        db.Index('ix_messages_archive_sender_receiver_created', 'sender_id', 'receiver_id', 'created_at', 'id'),
+        db.Index('ix_messages_archive_sender_created', 'sender_id', 'created_at', 'id'),
+        db.Index('ix_messages_archive_receiver_created', 'receiver_id', 'created_at', 'id'),
+    )
+
+    id = db.Column(db.String, primary_key=True)
+    study_id = db.Column(db.String, db.ForeignKey('studies.id'))
+    sender_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    receiver_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    type = db.Column(db.Enum(MessageType), default=MessageType.TEXT)
+    read = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime)
+    read_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Key of the row in messages_archive_fts, numbered by its own insert
+    # trigger (hot numbers can be reused once their message is archived)
+    search_rowid = db.Column(db.Integer, unique=True, index=True)
 
+    sender = db.relationship('User', foreign_keys=[sender_id])
+    receiver = db.relationship('User', foreign_keys=[receiver_id])
+    study = db.relationship('Study')
+
+# Full-text index over message content (SQLite FTS5). It is an external-content
+# table, so it stores only the index and reads text from messages, keyed by
+# messages.search_rowid; the triggers number new messages and keep the index
+# in step with every insert, update and delete.
+MESSAGE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, content='messages', content_rowid='search_rowid', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "UPDATE messages SET search_rowid = (SELECT IFNULL(MAX(search_rowid), 0) + 1 FROM messages) "
+    "WHERE id = new.id AND search_rowid IS NULL; "
+    "INSERT INTO messages_fts(rowid, content) SELECT search_rowid, content FROM messages WHERE id = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.search_rowid, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.search_rowid, old.content); "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.search_rowid, new.content); END",
+)
+
+# The same index over messages_archive, so archived messages stay searchable.
+# Archived rows are only ever inserted and deleted.
+MESSAGE_ARCHIVE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_archive_fts USING fts5("
+    "content, content='messages_archive', content_rowid='search_rowid', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_archive_fts_insert AFTER INSERT ON messages_archive BEGIN "
+    "UPDATE messages_archive SET search_rowid = (SELECT IFNULL(MAX(search_rowid), 0) + 1 FROM messages_archive) "
+    "WHERE id = new.id AND search_rowid IS NULL; "
+    "INSERT INTO messages_archive_fts(rowid, content) "
+    "SELECT search_rowid, content FROM messages_archive WHERE id = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS messages_archive_fts_delete AFTER DELETE ON messages_archive BEGIN "
+    "INSERT INTO messages_archive_fts(messages_archive_fts, rowid, content) "
+    "VALUES ('delete', old.search_rowid, old.content); END",
+)
+
+for table, fts_table, ddl in ((Message.__table__, 'messages_fts', MESSAGE_FTS_DDL),
+                              (ArchivedMessage.__table__, 'messages_archive_fts', MESSAGE_ARCHIVE_FTS_DDL)):
+    for statement in ddl:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(table, 'before_drop', DDL(f'DROP TABLE IF EXISTS {fts_table}').execute_if(dialect='sqlite'))
+
+# One row per user and conversation thread (other user + optional study),
+# maintained by conversations.record_messages alongside each message write
+class Conversation(db.Model):
+    __tablename__ = 'conversations'
+    __table_args__ = (
+        db.Index('ix_conversations_user_last_message', 'user_id', 'last_message_at', 'id'),
+    )
+
+    id = db.Column(db.String, primary_key=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    other_user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    study_id = db.Column(db.String, db.ForeignKey('studies.id'))
+    last_message_id = db.Column(db.String, db.ForeignKey('messages.id'))
+    last_message_at = db.Column(db.DateTime)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    total_count = db.Column(db.Integer, default=0, nullable=False)
+    last_read_message_id = db.Column(db.String, db.ForeignKey('messages.id'))
+    last_read_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    other_user = db.relationship('User', foreign_keys=[other_user_id])
+    study = db.relationship('Study')
+    last_message = db.relationship('Message', foreign_keys=[last_message_id])
+
+# Total unread messages per user, kept next to the conversation summaries
+class UnreadCounter(db.Model):
+    __tablename__ = 'unread_counters'
+
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), primary_key=True)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,137 @@
+"""
+Keyset (cursor) pagination over ``(created_at, id)``.
+
+A cursor is an opaque URL-safe token holding the sort key of the last row of
+a page. The next page starts strictly after that key, so paging stays cheap
+with an index on the sort columns and stable while rows are being inserted.
+List endpoints keep returning a JSON array and report the cursor for the
+next page in the ``X-Next-Cursor`` response header.
+
+Cursor comparisons are done on the stored text, so every timestamp column
+used here must be written in the ORM's ``YYYY-MM-DD HH:MM:SS.ffffff`` form
+(init_db.py's column defaults match it).
+"""
+
+import base64
+import binascii
+from datetime import datetime
+from sqlalchemy import and_, or_, select, union_all
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+# Message threads page in both directions from the newest message
+BEFORE_CURSOR_HEADER = 'X-Before-Cursor'
+AFTER_CURSOR_HEADER = 'X-After-Cursor'
+
+
+def encode_cursor(created_at, row_id):
+    raw = f'{created_at.isoformat()}|{row_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, id)`` from a cursor, raising ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|', 1)
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError('Invalid cursor')
+
+
+def page_size(args, default=DEFAULT_PAGE_SIZE):
+    """Read the ``limit`` query argument, clamped to ``MAX_PAGE_SIZE``"""
+    limit = args.get('limit', default, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def keyset_filter(created_col, id_col, cursor, descending=False):
+    """Filter for rows strictly after ``cursor`` in the given sort direction"""
+    created_at, row_id = decode_cursor(cursor)
+    if descending:
+        return or_(created_col < created_at, and_(created_col == created_at, id_col < row_id))
+    return or_(created_col > created_at, and_(created_col == created_at, id_col > row_id))
+
+
+def paginate(query, created_col, id_col, cursor=None, limit=DEFAULT_PAGE_SIZE,
+             descending=False, key=None):
+    """Fetch one page of ``query`` ordered by ``(created_col, id_col)``.
+
+    ``key`` extracts ``(created_at, id)`` from a result row and defaults to
+    the row's own attributes. Returns ``(rows, next_cursor)``; ``next_cursor``
+    is None on the last page.
+    """
+    if cursor:
+        query = query.filter(keyset_filter(created_col, id_col, cursor, descending))
+    if descending:
+        query = query.order_by(created_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(created_col.asc(), id_col.asc())
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    created_at, row_id = key(last) if key else (last.created_at, last.id)
+    return rows, encode_cursor(created_at, row_id)
+
+
+def paginate_union(model, branches, cursor=None, limit=DEFAULT_PAGE_SIZE,
+                   descending=False, options=()):
+    """``paginate`` over the rows of ``model`` matching any of ``branches``.
+
+    ``branches`` are disjoint filter conditions. An OR of them cannot walk an
+    index in ``(created_at, id)`` order, so each branch is ordered and limited
+    on its own (ideally along an index ending in ``created_at, id``) and only
+    the branches' pages are merged with UNION ALL and sorted. ``options`` are
+    loader options for the returned ``model`` rows.
+    """
+    created_col, id_col = model.created_at, model.id
+    if descending:
+        order = (created_col.desc(), id_col.desc())
+    else:
+        order = (created_col.asc(), id_col.asc())
+
+    pages = []
+    for condition in branches:
+        stmt = select(id_col.label('id')).where(condition)
+        if cursor:
+            stmt = stmt.where(keyset_filter(created_col, id_col, cursor, descending))
+        stmt = stmt.order_by(*order).limit(limit + 1)
+        # SQLite only allows ORDER BY/LIMIT on compound members inside a subquery
+        pages.append(select(stmt.subquery().c.id))
+    ids = union_all(*pages).subquery()
+
+    query = model.query.join(ids, id_col == ids.c.id).options(*options)
+    return paginate(query, created_col, id_col, limit=limit, descending=descending)
+
+
+def merge_pages(pages, limit=DEFAULT_PAGE_SIZE, descending=False, key=None):
+    """Merge ``(rows, next_cursor)`` pages fetched with the same cursor.
+
+    Each page must come from ``paginate`` (or ``paginate_union``) over a
+    different table with the same cursor, limit and direction. ``key`` is as
+    for ``paginate``. Returns one ``(rows, next_cursor)`` page in
+    ``(created_at, id)`` order, with a cursor whenever any source still has
+    rows past the merged page.
+    """
+    key = key or (lambda row: (row.created_at, row.id))
+    rows = sorted(
+        (row for page_rows, _ in pages for row in page_rows),
+        key=key, reverse=descending
+    )
+    if len(rows) <= limit and not any(cursor for _, cursor in pages):
+        return rows, None
+    rows = rows[:limit]
+    if not rows:
+        return rows, None
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def with_next_cursor(response, next_cursor):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
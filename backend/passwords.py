@@ -0,0 +1,109 @@
+"""
+Password hashing on a bounded worker pool.
+
+bcrypt is deliberately slow and CPU bound. Hashes and checks run on a small
+shared thread pool (``PASSWORD_HASH_WORKERS`` threads; bcrypt releases the
+GIL while it works), so a burst of logins or registrations queues for the
+pool instead of occupying every CPU and starving the other requests.
+
+The work factor comes from ``BCRYPT_LOG_ROUNDS``. Hashes stored with a
+different cost are replaced with a fresh hash after the next successful
+login (see ``needs_rehash``).
+
+Bulk imports hash on a separate, temporary pool (``hash_passwords``) so a
+large roster does not queue ahead of interactive logins.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from flask_bcrypt import Bcrypt
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_WORKERS = max(1, min(4, os.cpu_count() or 1))
+DEFAULT_IMPORT_WORKERS = os.cpu_count() or 1
+
+# Stored for accounts that have no password yet (e.g. invited participants);
+# never matches any password
+UNUSABLE_PASSWORD = '!'
+
+# Initialized in app.py (re-exported by models)
+bcrypt = Bcrypt()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = current_app.config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        return _executor
+
+
+def log_rounds():
+    return current_app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS)
+
+
+def hash_password(password):
+    """bcrypt hash of ``password`` at the configured cost, as text"""
+    future = _pool().submit(bcrypt.generate_password_hash, password, log_rounds())
+    return future.result().decode('utf-8')
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash many passwords in parallel, returning the hashes in input order.
+
+    A password that cannot be hashed gets the exception in its place, so
+    one bad value does not fail the others. Runs on its own pool of
+    ``workers`` threads (``IMPORT_HASH_WORKERS``, default one per CPU),
+    shut down once every password is hashed.
+    """
+    passwords = list(passwords)
+    if not passwords:
+        return []
+    rounds = log_rounds()
+    workers = workers or current_app.config.get('IMPORT_HASH_WORKERS', DEFAULT_IMPORT_WORKERS)
+
+    def hash_one(password):
+        try:
+            return bcrypt.generate_password_hash(password, rounds).decode('utf-8')
+        except (TypeError, ValueError) as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(passwords)), thread_name_prefix='password-import') as executor:
+        return list(executor.map(hash_one, passwords))
+
+
+def has_usable_password(password_hash):
+    return bool(password_hash) and not password_hash.startswith(UNUSABLE_PASSWORD)
+
+
+def check_password(password_hash, password):
+    if not has_usable_password(password_hash):
+        return False
+    return _pool().submit(bcrypt.check_password_hash, password_hash, password).result()
+
+
+def hash_cost(password_hash):
+    """Work factor of a stored ``$2b$<cost>$...`` hash, or None if unrecognised"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(password_hash):
+    return hash_cost(password_hash) != log_rounds()
+
+
+def shutdown():
+    """Stop the worker pool (it is recreated on next use)"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
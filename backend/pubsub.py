@@ -0,0 +1,107 @@
+"""
+Publish/subscribe hub for pushing events to connected clients.
+
+Routes publish ``(event, data)`` pairs to a per-user channel after their
+transaction commits, and the Server-Sent Events endpoint relays whatever
+arrives on the caller's channel. Delivery goes through a broker:
+``LocalBroker`` fans out within this process, which is enough for a single
+server. Multi-process deployments can install a broker with the same
+``publish``/``subscribe`` interface (for example one backed by Redis
+pub/sub) with ``hub.use(broker)``.
+"""
+
+import json
+import queue
+import threading
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscription:
+    """Bounded queue of events for one connected client"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            # A stalled client loses its oldest event rather than blocking publishers
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(message)
+
+    def get(self, timeout=None):
+        """Next message, or None if nothing arrived within ``timeout`` seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process broker delivering to subscriptions in this process only"""
+
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._channels.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._channels.get(subscription.channel)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._channels[subscription.channel]
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._channels.get(channel, ()))
+
+
+class Hub:
+    """Per-user event channels on top of a pluggable broker"""
+
+    def __init__(self, broker=None):
+        self.broker = broker or LocalBroker()
+
+    def use(self, broker):
+        self.broker = broker
+
+    @staticmethod
+    def channel(user_id):
+        return f'user:{user_id}'
+
+    def publish(self, user_id, event, data):
+        self.broker.publish(self.channel(user_id), {'event': event, 'data': data})
+
+    def subscribe(self, user_id):
+        return self.broker.subscribe(self.channel(user_id))
+
+
+def format_sse(message):
+    """Encode a published message as a Server-Sent Events frame"""
+    return f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+
+hub = Hub()
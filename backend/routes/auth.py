@@ -1,6 +1,11 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from models import db, User, ResearcherProfile, ParticipantProfile, UserRole
+from flask_jwt_extended import jwt_required
+from sqlalchemy.exc import IntegrityError
+from models import db, User, ResearcherProfile, ParticipantProfile, UserRole, normalize_email
+from identity import get_current_user, get_current_user_id
+from passwords import needs_rehash, has_usable_password
+from tokens import issue_token, revoke_tokens, load_invite
+from serializers import user_account, user_profile, researcher_profile_summary, participant_profile_summary
 import uuid
 
 auth_bp = Blueprint('auth', __name__)
@@ -11,13 +16,10 @@ def register():
         data = request.get_json()
 
         # Validate required fields
-        if not data or not all(k in data for k in ['email', 'password', 'name', 'role']):
+        if not isinstance(data, dict) or not all(k in data for k in ['email', 'password', 'name', 'role']):
             return jsonify({'error': 'Missing required fields'}), 400
-
-        # Check if user already exists
-        existing_user = User.query.filter_by(email=data['email']).first()
-        if existing_user:
-            return jsonify({'error': 'User with this email already exists'}), 400
+        if not all(isinstance(data[k], str) for k in ['email', 'password', 'name']):
+            return jsonify({'error': 'email, password and name must be strings'}), 400
 
         # Validate role
         if data['role'] not in [role.value for role in UserRole]:
@@ -32,39 +34,28 @@ def register():
         )
         user.set_password(data['password'])
 
-        db.session.add(user)
-        db.session.commit()
-
-        # Create profile based on role
+        # Create profile based on role, in the same transaction as the user
         if user.role == UserRole.RESEARCHER:
-            researcher_profile = ResearcherProfile(
-                id=str(uuid.uuid4()),
-                user_id=user.id
-            )
-            db.session.add(researcher_profile)
+            user.researcher_profile = ResearcherProfile(id=str(uuid.uuid4()))
         else:
-            participant_profile = ParticipantProfile(
-                id=str(uuid.uuid4()),
-                user_id=user.id
-            )
-            db.session.add(participant_profile)
+            user.participant_profile = ParticipantProfile(id=str(uuid.uuid4()))
 
-        db.session.commit()
+        db.session.add(user)
+        try:
+            # The unique email_normalized index rejects duplicate accounts
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': 'User with this email already exists'}), 400
 
-        # Create access token
-        access_token = create_access_token(
-            identity=user.id
-        )
+        # Create access token carrying the role/profile claims
+        access_token = issue_token(user)
+        user_data = user_account(user)
+        db.session.commit()
 
         return jsonify({
             'message': 'User created successfully',
-            'user': {
-                'id': user.id,
-                'email': user.email,
-                'name': user.name,
-                'role': user.role.value,
-                'created_at': user.created_at.isoformat()
-            },
+            'user': user_data,
             'token': access_token
         }), 201
         
@@ -78,88 +69,101 @@ def login():
     try:
         data = request.get_json()
 
-        if not data or not all(k in data for k in ['email', 'password']):
+        if not isinstance(data, dict) or not all(k in data for k in ['email', 'password']):
             return jsonify({'error': 'Missing email or password'}), 400
+        if not isinstance(data['email'], str) or not isinstance(data['password'], str):
+            return jsonify({'error': 'email and password must be strings'}), 400
 
         # Find user
-        user = User.query.filter_by(email=data['email']).first()
+        user = User.query.filter_by(email_normalized=normalize_email(data['email'])).first()
 
         if not user or not user.check_password(data['password']):
             return jsonify({'error': 'Invalid credentials'}), 401
 
-        # Create access token
-        access_token = create_access_token(
-            identity=user.id
-        )
+        # Upgrade hashes created with an outdated work factor
+        if needs_rehash(user.password_hash):
+            user.set_password(data['password'])
+            db.session.commit()
+
+        # Create access token carrying the role/profile claims
+        access_token = issue_token(user)
 
         return jsonify({
             'message': 'Login successful',
-            'user': {
-                'id': user.id,
-                'email': user.email,
-                'name': user.name,
-                'role': user.role.value,
-                'created_at': user.created_at.isoformat()
-            },
+            'user': user_account(user),
+            'token': access_token
+        })
+        
+    except Exception as e:
+        print(e)
+        return jsonify({'error': str(e)}), 500
+
+@auth_bp.route('/accept-invite', methods=['POST'])
+def accept_invite():
+    """Set the password of an imported participant and log them in"""
+    try:
+        data = request.get_json()
+
+        if not data or not all(k in data for k in ['token', 'password']):
+            return jsonify({'error': 'Missing token or password'}), 400
+
+        user_id = load_invite(data['token'])
+        user = db.session.get(User, user_id) if user_id else None
+        if not user:
+            return jsonify({'error': 'Invalid or expired invite'}), 400
+
+        # Invites are single use: they only work while no password is set
+        if has_usable_password(user.password_hash):
+            return jsonify({'error': 'Invite already used'}), 400
+
+        user.set_password(data['password'])
+        access_token = issue_token(user)
+        user_data = user_account(user)
+        db.session.commit()
+
+        return jsonify({
+            'message': 'Invite accepted',
+            'user': user_data,
             'token': access_token
         })
         
     except Exception as e:
         print(e)
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@auth_bp.route('/revoke', methods=['POST'])
+@jwt_required()
+def revoke():
+    """Sign out everywhere: invalidate every token issued to the caller"""
+    try:
+        revoke_tokens(get_current_user_id())
+        return jsonify({'message': 'Tokens revoked'})
+        
+    except Exception as e:
+        print(e)
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
     try:
-        identity = get_jwt_identity()
-        print(f"DEBUG: get_jwt_identity() returned: {identity}, type: {type(identity)}")
-
-        if identity is None:
-            return jsonify({'error': 'No identity in token'}), 422
-
-        if isinstance(identity, dict):
-            current_user_id = identity.get('user_id')
-            if not current_user_id:
-                return jsonify({'error': 'No user_id in token identity'}), 422
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
+        if not current_user_id:
+            return jsonify({'error': 'No user_id in token identity'}), 422
         
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        profile_data = {
-            'id': user.id,
-            'email': user.email,
-            'name': user.name,
-            'role': user.role.value,
-            'avatar': user.avatar,
-            'created_at': user.created_at.isoformat(),
-            'updated_at': user.updated_at.isoformat()
-        }
+        profile_data = user_profile(user)
         
         # Add profile-specific data
         if user.role == UserRole.RESEARCHER and user.researcher_profile:
-            profile_data['researcher_profile'] = {
-                'id': user.researcher_profile.id,
-                'institution': user.researcher_profile.institution,
-                'department': user.researcher_profile.department,
-                'title': user.researcher_profile.title,
-                'bio': user.researcher_profile.bio,
-                'verified': user.researcher_profile.verified
-            }
+            profile_data['researcher_profile'] = researcher_profile_summary(user.researcher_profile)
         elif user.role == UserRole.PARTICIPANT and user.participant_profile:
-            profile_data['participant_profile'] = {
-                'id': user.participant_profile.id,
-                'date_of_birth': user.participant_profile.date_of_birth.isoformat() if user.participant_profile.date_of_birth else None,
-                'gender': user.participant_profile.gender,
-                'location': user.participant_profile.location,
-                'bio': user.participant_profile.bio,
-                'interests': user.participant_profile.interests,
-                'availability': user.participant_profile.availability,
-                'phone_number': user.participant_profile.phone_number
-            }
+            profile_data['participant_profile'] = participant_profile_summary(user.participant_profile)
         
         return jsonify(profile_data)
         
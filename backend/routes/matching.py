@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Study, User, ParticipantProfile, StudyApplication, StudyParticipation, UserRole
+from flask_jwt_extended import jwt_required
+from models import db, Study, User, ParticipantProfile, StudyApplication, StudyParticipation, UserRole, StudyStatus
+from sqlalchemy import func
+from identity import get_current_user, get_current_user_id, role_required
+from serializers import user_with_profile, study_match
 import json
 
 matching_bp = Blueprint('matching', __name__)
@@ -82,11 +85,7 @@ def calculate_match_score(participant, study):
 @jwt_required()
 def get_matched_participants(study_id):
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
         
         # Check if study exists and user is the researcher
         study = Study.query.get(study_id)
@@ -110,13 +109,9 @@ def get_matched_participants(study_id):
         for participant in available_participants:
             match_score = calculate_match_score(participant, study)
             if match_score >= 50:  # Only show matches with 50% or higher
-                matched_participants.append({
-                    'id': participant.id,
-                    'name': participant.name,
-                    'email': participant.email,
-                    'participant_profile': participant.participant_profile,
-                    'match_score': match_score
-                })
+                participant_data = user_with_profile(participant)
+                participant_data['match_score'] = match_score
+                matched_participants.append(participant_data)
         
         # Sort by match score (highest first)
         matched_participants.sort(key=lambda x: x['match_score'], reverse=True)
@@ -133,21 +128,20 @@ def get_matched_participants(study_id):
 
 @matching_bp.route('/studies', methods=['POST'])
 @jwt_required()
+@role_required(UserRole.PARTICIPANT, error='Participant not found')
 def get_matched_studies():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
-        
-        # Check if user exists and is a participant
-        participant = User.query.get(current_user_id)
-        if not participant or participant.role != UserRole.PARTICIPANT:
+        current_user_id = get_current_user_id()
+        
+        participant = get_current_user()
+        if not participant:
             return jsonify({'error': 'Participant not found'}), 404
         
-        # Get all active studies
-        studies = Study.query.filter_by(status='ACTIVE').all()
+        # Get all active studies that still have capacity
+        studies = Study.query.filter(
+            Study.status == StudyStatus.ACTIVE,
+            func.coalesce(Study.participants_current, 0) < Study.participants_needed
+        ).all()
         
         # Filter out already applied studies
         applied_study_ids = [app.study_id for app in StudyApplication.query.filter_by(user_id=current_user_id).all()]
@@ -156,8 +150,7 @@ def get_matched_studies():
         available_studies = [
             study for study in studies
             if study.id not in applied_study_ids and \
-               study.id not in participating_study_ids and \
-               study.participants_current < study.participants_needed
+               study.id not in participating_study_ids
         ]
         
         # Calculate match scores
@@ -189,26 +182,10 @@ def get_matched_studies():
                         else:
                             requirements.append(f"{req['type']}: {req.get('value', 'N/A')}")
 
-                matched_studies.append({
-                    'id': study.id,
-                    'title': study.title,
-                    'description': study.description,
-                    'institution': study.institution,
-                    'category': study.category,
-                    'duration': study.duration,
-                    'compensation': study.compensation,
-                    'location': study.location,
-                    'participants_needed': study.participants_needed,
-                    'participants_current': study.participants_current,
-                    'requirements': requirements,
-                    'researcher': {
-                        'id': study.researcher.id,
-                        'name': study.researcher.name,
-                        'email': study.researcher.email
-                    } if study.researcher else None,
-                    'matchScore': int(match_score),  # Frontend expects matchScore with capital S
-                    'created_at': study.created_at.isoformat()
-                })
+                study_data = study_match(study)
+                study_data['requirements'] = requirements
+                study_data['matchScore'] = int(match_score)  # Frontend expects matchScore with capital S
+                matched_studies.append(study_data)
         
         # Sort by match score (highest first)
         matched_studies.sort(key=lambda x: x['matchScore'], reverse=True)
@@ -1,8 +1,24 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Message, User, Study, StudyApplication, MessageType
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
+from models import db, ArchivedMessage, Conversation, Message, User, Study, StudyParticipation, MessageType, ParticipationStatus
+from serializers import message_detail, message_preview, user_with_role, study_ref
+from conversations import (
+    record_messages, mark_read, mark_read_up_to, unread_total, unread_totals, unread_by_study
+)
+from pubsub import hub, format_sse
+from identity import get_cached_users, get_current_user_id, remember_users
+from membership import get_study_members, is_associated
+from search import search_supported, fts_query, highlight, search_messages_query
+from message_writer import message_writer, WriteTimeout
+from pagination import (
+    paginate, paginate_union, merge_pages, page_size, with_next_cursor, encode_cursor,
+    BEFORE_CURSOR_HEADER, AFTER_CURSOR_HEADER
+)
 import uuid
 from datetime import datetime
+from types import SimpleNamespace
 
 messages_bp = Blueprint('messages', __name__)
 
@@ -10,74 +26,78 @@ messages_bp = Blueprint('messages', __name__)
 @jwt_required()
 def get_messages():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
         
         # Get query parameters
         study_id = request.args.get('study_id')
         other_user_id = request.args.get('other_user_id')
         
-        # Build query
-        query = Message.query.filter(
-            (Message.sender_id == current_user_id) | 
-            (Message.receiver_id == current_user_id)
-        )
-        
-        if study_id:
-            query = query.filter(Message.study_id == study_id)
-        
-        if other_user_id:
-            query = query.filter(
-                ((Message.sender_id == current_user_id) & (Message.receiver_id == other_user_id)) |
-                ((Message.sender_id == other_user_id) & (Message.receiver_id == current_user_id))
+        def thread_page(model, cursor, limit, descending):
+            # One branch per direction, so each walks its own index in
+            # (created_at, id) order instead of sorting the whole mailbox
+            if other_user_id:
+                branches = [
+                    (model.sender_id == current_user_id) & (model.receiver_id == other_user_id),
+                    (model.sender_id == other_user_id) & (model.receiver_id == current_user_id)
+                ]
+            else:
+                branches = [
+                    model.sender_id == current_user_id,
+                    (model.receiver_id == current_user_id) & (model.sender_id != current_user_id)
+                ]
+            if study_id:
+                branches = [branch & (model.study_id == study_id) for branch in branches]
+            
+            # Sender, receiver and study come back with the messages; the inner
+            # joins drop messages whose users no longer exist
+            return paginate_union(
+                model, branches, cursor=cursor, limit=limit, descending=descending,
+                options=(
+                    joinedload(model.sender, innerjoin=True),
+                    joinedload(model.receiver, innerjoin=True),
+                    joinedload(model.study)
+                )
             )
         
-        messages = query.order_by(Message.created_at.asc()).all()
+        # Without a cursor the newest page is returned; ``before`` scrolls back
+        # and ``after`` fetches newer messages. Pages are always ascending.
+        before = request.args.get('before')
+        after = request.args.get('after')
+        if before and after:
+            return jsonify({'error': 'Use either before or after, not both'}), 400
+        limit = page_size(request.args)
+        
+        # Archived messages (read messages of finished studies, or old ones)
+        # can be newer than hot ones, so every page merges both tables
+        descending = not after
+        cursor = after or before
+        messages, page_cursor = merge_pages(
+            [thread_page(model, cursor, limit, descending) for model in (Message, ArchivedMessage)],
+            limit=limit, descending=descending
+        )
+        older_cursor = None
+        if descending:
+            older_cursor = page_cursor
+            messages.reverse()
         
         messages_data = []
         for message in messages:
-            sender = User.query.get(message.sender_id)
-            receiver = User.query.get(message.receiver_id)
-            if not sender or not receiver:
-                continue
-                
-            messages_data.append({
-                'id': message.id,
-                'content': message.content,
-                'type': message.type.value,
-                'read': message.read,
-                'created_at': message.created_at.isoformat(),
-                'sender': {
-                    'id': sender.id,
-                    'name': sender.name,
-                    'email': sender.email,
-                    'role': sender.role.value
-                },
-                'receiver': {
-                    'id': receiver.id,
-                    'name': receiver.name,
-                    'email': receiver.email,
-                    'role': receiver.role.value
-                },
-                'study': {
-                    'id': message.study.id,
-                    'title': message.study.title
-                } if message.study else None
-            })
-        
-        # Mark messages as read if user is receiver
-        Message.query.filter_by(
-            receiver_id=current_user_id,
-            read=False
-        ).update({'read': True})
+            remember_users((message.sender, message.receiver))
+            messages_data.append(message_detail(message))
         
-        db.session.commit()
+        newer_cursor = after
+        if messages:
+            newer_cursor = encode_cursor(messages[-1].created_at, messages[-1].id)
         
-        return jsonify(messages_data)
+        response = jsonify(messages_data)
+        if older_cursor:
+            response.headers[BEFORE_CURSOR_HEADER] = older_cursor
+        if newer_cursor:
+            response.headers[AFTER_CURSOR_HEADER] = newer_cursor
+        return response
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -85,11 +105,7 @@ def get_messages():
 @jwt_required()
 def send_message():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
         
         data = request.get_json()
         
@@ -102,153 +118,216 @@ def send_message():
             return jsonify({'error': 'Cannot send message to yourself'}), 400
         
         # Verify both users exist
-        receiver = User.query.get(data['receiver_id'])
-        sender = User.query.get(current_user_id)
+        users = get_cached_users([data['receiver_id'], current_user_id])
+        receiver = users[data['receiver_id']]
+        sender = users[current_user_id]
         
         if not receiver or not sender:
             return jsonify({'error': 'One or both users not found'}), 404
         
         # If study_id is provided, verify it exists and user has access
+        members = None
         if 'study_id' in data and data['study_id']:
-            study = Study.query.get(data['study_id'])
-            if not study:
+            members = get_study_members(data['study_id'])
+            if not members:
                 return jsonify({'error': 'Study not found'}), 404
             
-            # Verify at least one user is associated with study (researcher or participant)
-            study_obj = Study.query.get(data['study_id'])
-            sender_is_researcher = study_obj and study_obj.researcher_id == current_user_id
-            receiver_is_researcher = study_obj and study_obj.researcher_id == data['receiver_id']
-            
-            sender_application = StudyApplication.query.filter_by(
-                study_id=data['study_id'],
-                user_id=current_user_id
-            ).first()
-            
-            receiver_application = StudyApplication.query.filter_by(
-                study_id=data['study_id'],
-                user_id=data['receiver_id']
-            ).first()
-            
-            # Allow if sender or receiver is the researcher, or if either has an application
-            if not sender_is_researcher and not receiver_is_researcher and not sender_application and not receiver_application:
+            # Allow if either user is the researcher, an applicant or a participant
+            if not is_associated(members, current_user_id) and not is_associated(members, data['receiver_id']):
                 return jsonify({'error': 'One or both users are not associated with this study'}), 403
         
         # Create message
-        message = Message(
-            id=str(uuid.uuid4()),
-            sender_id=current_user_id,
-            receiver_id=data['receiver_id'],
-            content=data['content'],
-            study_id=data.get('study_id'),
-            type=MessageType(data.get('type', 'TEXT'))
-        )
+        row = {
+            'id': str(uuid.uuid4()),
+            'sender_id': current_user_id,
+            'receiver_id': data['receiver_id'],
+            'content': data['content'],
+            'study_id': data.get('study_id'),
+            'type': MessageType(data.get('type', 'TEXT')),
+            'read': False,
+            'created_at': datetime.utcnow()
+        }
         
-        db.session.add(message)
-        db.session.commit()
+        # Serialize from what is already loaded: the users fetched above and
+        # the study reference from the membership cache
+        message_data = message_detail(SimpleNamespace(
+            **row, sender=sender, receiver=receiver,
+            study=SimpleNamespace(id=members.study_id, title=members.title) if members else None
+        ))
+        
+        if message_writer.enabled:
+            # Committed together with other concurrent sends
+            message_writer.write(row)
+        else:
+            db.session.execute(insert(Message), [row])
+            record_messages([row])
+            db.session.commit()
+        
+        # Push to both users' open streams once the message is durable
+        receiver_unread = unread_total(data['receiver_id'])
+        hub.publish(data['receiver_id'], 'message', message_data)
+        hub.publish(data['receiver_id'], 'unread_count', {'unread_count': receiver_unread})
+        hub.publish(current_user_id, 'message', message_data)
         
         return jsonify({
             'message': 'Message sent successfully',
-            'message_data': {
-                'id': message.id,
-                'content': message.content,
-                'type': message.type.value,
-                'read': message.read,
-                'created_at': message.created_at.isoformat(),
-                'sender': {
-                    'id': sender.id,
-                    'name': sender.name,
-                    'email': sender.email
-                },
-                'receiver': {
-                    'id': receiver.id,
-                    'name': receiver.name,
-                    'email': receiver.email
-                }
-            }
+            'message_data': message_data
         }), 201
         
+    except WriteTimeout as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@messages_bp.route('/broadcast', methods=['POST'])
+@jwt_required()
+def broadcast_message():
+    """Send one message to every active participant of a study (study researcher only)"""
+    try:
+        current_user_id = get_current_user_id()
+        
+        data = request.get_json()
+        
+        # Validate required fields
+        if not data or not all(data.get(k) for k in ['study_id', 'content']):
+            return jsonify({'error': 'Missing required fields'}), 400
+        
+        study = db.session.get(Study, data['study_id'])
+        if not study or study.researcher_id != current_user_id:
+            return jsonify({'error': 'Study not found or access denied'}), 404
+        
+        message_type = MessageType(data.get('type', 'TEXT'))
+        sender = get_cached_users([current_user_id])[current_user_id]
+        
+        # All recipients in one query
+        recipients = User.query.join(
+            StudyParticipation, StudyParticipation.user_id == User.id
+        ).filter(
+            StudyParticipation.study_id == study.id,
+            StudyParticipation.status == ParticipationStatus.ACTIVE,
+            User.id != current_user_id
+        ).distinct().all()
+        
+        now = datetime.utcnow()
+        rows = [{
+            'id': str(uuid.uuid4()),
+            'study_id': study.id,
+            'sender_id': current_user_id,
+            'receiver_id': recipient.id,
+            'content': data['content'],
+            'type': message_type,
+            'read': False,
+            'created_at': now
+        } for recipient in recipients]
+        
+        if rows:
+            db.session.execute(insert(Message), rows)
+            record_messages(rows)
+        
+        # Push payloads match message_detail; build them before the commit
+        # expires the loaded rows
+        payloads = [
+            message_detail(SimpleNamespace(**row, sender=sender, receiver=recipient, study=study))
+            for row, recipient in zip(rows, recipients)
+        ]
+        study_data = study_ref(study)
+        db.session.commit()
+        
+        unread = unread_totals([row['receiver_id'] for row in rows])
+        for payload in payloads:
+            receiver_id = payload['receiver']['id']
+            hub.publish(receiver_id, 'message', payload)
+            hub.publish(receiver_id, 'unread_count', {'unread_count': unread[receiver_id]})
+        
+        return jsonify({
+            'message': 'Broadcast sent successfully',
+            'study': study_data,
+            'recipients': len(rows)
+        }), 201
+        
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@messages_bp.route('/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_events():
+    """Server-Sent Events feed of the caller's message and unread_count events.
+
+    EventSource cannot send headers, so the token may also be passed as the
+    ``jwt`` query parameter.
+    """
+    current_user_id = get_current_user_id()
+    
+    # Subscribe before responding so nothing published meanwhile is missed
+    subscription = hub.subscribe(current_user_id)
+    heartbeat = current_app.config.get('SSE_HEARTBEAT_SECONDS', 15)
+    
+    def events():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                message = subscription.get(timeout=heartbeat)
+                yield format_sse(message) if message else ': keep-alive\n\n'
+        finally:
+            subscription.close()
+    
+    response = current_app.response_class(events(), mimetype='text/event-stream')
+    # The generator's finally never runs if the body is not iterated
+    # (client gone before streaming starts), so release on close as well
+    response.call_on_close(subscription.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @messages_bp.route('/conversations', methods=['GET'])
 @jwt_required()
 def get_conversations():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
 
-        # Get all messages involving user
-        messages = Message.query.filter(
-            (Message.sender_id == current_user_id) |
-            (Message.receiver_id == current_user_id)
-        ).order_by(Message.created_at.desc()).all()
+        # One summary row per conversation, newest first
+        query = Conversation.query.filter(
+            Conversation.user_id == current_user_id,
+            Conversation.last_message_at.isnot(None)
+        ).options(
+            joinedload(Conversation.other_user, innerjoin=True),
+            joinedload(Conversation.study),
+            joinedload(Conversation.last_message)
+        )
+        conversations, next_cursor = paginate(
+            query, Conversation.last_message_at, Conversation.id,
+            cursor=request.args.get('cursor'), limit=page_size(request.args), descending=True,
+            key=lambda conversation: (conversation.last_message_at, conversation.id)
+        )
         
-        # Group messages by conversation (other user + study)
-        conversations = {}
+        # Last messages that were moved to the archive, in one query
+        last_messages = {conversation.last_message_id: conversation.last_message for conversation in conversations}
+        archived_ids = [message_id for message_id, message in last_messages.items() if message_id and message is None]
+        if archived_ids:
+            last_messages.update(
+                (message.id, message)
+                for message in ArchivedMessage.query.filter(ArchivedMessage.id.in_(archived_ids))
+            )
         
-        for message in messages:
-            other_user_id = message.sender_id if message.sender_id != current_user_id else message.receiver_id
-            # Get other user from database
-            other_user = User.query.get(other_user_id)
-            if not other_user:
-                continue
-            conversation_key = f"{other_user_id}-{message.study_id or 'general'}"
-            
-            if conversation_key not in conversations:
-                conversations[conversation_key] = {
-                    'id': conversation_key,
-                    'other_user': {
-                        'id': other_user.id,
-                        'name': other_user.name,
-                        'email': other_user.email,
-                        'role': other_user.role.value
-                    },
-                    'study': {
-                        'id': message.study.id,
-                        'title': message.study.title
-                    } if message.study else None,
-                    'last_message': None,
-                    'last_message_datetime': None,  # Store datetime for comparison
-                    'unread_count': 0,
-                    'total_messages': 0
-                }
-            
-            conversation = conversations[conversation_key]
-            conversation['total_messages'] += 1
-            
-            # Count unread messages (where current user is receiver and message is unread)
-            if message.receiver_id == current_user_id and not message.read:
-                conversation['unread_count'] += 1
-            
-            # Update last message if this one is more recent
-            if not conversation['last_message'] or \
-               message.created_at > conversation['last_message_datetime']:
-                conversation['last_message'] = {
-                    'id': message.id,
-                    'content': message.content,
-                    'type': message.type.value,
-                    'created_at': message.created_at.isoformat()
-                }
-                conversation['last_message_datetime'] = message.created_at
-        
-        # Convert to array and sort by last message time
-        conversation_list = sorted(
-            conversations.values(),
-            key=lambda x: x['last_message_datetime'] if x['last_message_datetime'] else datetime.min,
-            reverse=True
-        )
-
-        # Remove internal datetime fields before returning JSON
-        for conversation in conversation_list:
-            if 'last_message_datetime' in conversation:
-                del conversation['last_message_datetime']
+        conversation_list = [{
+            'id': f"{conversation.other_user_id}-{conversation.study_id or 'general'}",
+            'other_user': user_with_role(conversation.other_user),
+            'study': study_ref(conversation.study) if conversation.study else None,
+            'last_message': message_preview(last_messages[conversation.last_message_id])
+            if last_messages.get(conversation.last_message_id) else None,
+            'unread_count': conversation.unread_count,
+            'total_messages': conversation.total_count
+        } for conversation in conversations]
 
-        return jsonify(conversation_list)
+        return with_next_cursor(jsonify(conversation_list), next_cursor)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except KeyError as e:
         print(f"KeyError in get_conversations: {e}")
         import traceback
@@ -260,15 +339,100 @@ def get_conversations():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@messages_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_messages():
+    try:
+        current_user_id = get_current_user_id()
+        
+        if not search_supported():
+            return jsonify({'error': 'Message search is only available on SQLite'}), 501
+        
+        match = fts_query(request.args.get('q', ''))
+        if not match:
+            return jsonify({'error': 'Missing search query'}), 400
+        
+        # Hot and archived matches are paged separately and merged
+        cursor, limit = request.args.get('cursor'), page_size(request.args)
+        key = lambda row: (row[0].created_at, row[0].id)
+        rows, next_cursor = merge_pages([
+            paginate(
+                search_messages_query(current_user_id, match, model), model.created_at, model.id,
+                cursor=cursor, limit=limit, descending=True, key=key
+            )
+            for model in (Message, ArchivedMessage)
+        ], limit=limit, descending=True, key=key)
+        
+        results = []
+        for message, snippet in rows:
+            result = message_detail(message)
+            result['snippet'] = highlight(snippet)
+            results.append(result)
+        
+        return with_next_cursor(jsonify(results), next_cursor)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@messages_bp.route('/unread-count', methods=['GET'])
+@jwt_required()
+def get_unread_count():
+    try:
+        current_user_id = get_current_user_id()
+        
+        # Served from the counter tables; the messages table is not read
+        result = {'unread_count': unread_total(current_user_id)}
+        if request.args.get('by_study', 'false').lower() == 'true':
+            result['by_study'] = {
+                study_id or 'general': unread
+                for study_id, unread in unread_by_study(current_user_id).items()
+            }
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@messages_bp.route('/read-marker', methods=['POST'])
+@jwt_required()
+def set_read_marker():
+    try:
+        current_user_id = get_current_user_id()
+        
+        data = request.get_json()
+        if not data or not data.get('message_id'):
+            return jsonify({'error': 'Missing required fields'}), 400
+        
+        # The marker message identifies the conversation and how far it was
+        # read; threads also return archived messages, so look there too
+        message = db.session.get(Message, data['message_id']) or db.session.get(ArchivedMessage, data['message_id'])
+        if not message or current_user_id not in (message.sender_id, message.receiver_id):
+            return jsonify({'error': 'Message not found'}), 404
+        
+        marked = mark_read_up_to(current_user_id, message)
+        unread = unread_total(current_user_id)
+        db.session.commit()
+        
+        if marked:
+            hub.publish(current_user_id, 'unread_count', {'unread_count': unread})
+        
+        return jsonify({
+            'message': 'Messages marked as read',
+            'marked': marked,
+            'unread_count': unread
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @messages_bp.route('/<message_id>/read', methods=['PUT'])
 @jwt_required()
 def mark_message_as_read(message_id):
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
         
         # Verify message exists and user is receiver
         message = Message.query.get(message_id)
@@ -280,6 +444,9 @@ def mark_message_as_read(message_id):
             return jsonify({'error': 'Only message receiver can mark as read'}), 403
         
         # Mark as read
+        if not message.read:
+            mark_read(message)
+            message.read_at = datetime.utcnow()
         message.read = True
         db.session.commit()
         
@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from models import db, User, ParticipantProfile, Study, StudyApplication, StudyParticipation, UserRole
+from identity import get_current_user_id, role_required
+from serializers import participant_profile, application_with_study, participation_with_study
+from importers import import_participants, iter_ndjson, summarize_results, NDJSON_MIMETYPES, DEFAULT_CHUNK_SIZE
 import json
 import uuid
 
@@ -8,35 +11,16 @@ participants_bp = Blueprint('participants', __name__)
 
 @participants_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@role_required(UserRole.PARTICIPANT, error='Participant not found')
 def get_participant_profile():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
-        
-        user = User.query.get(current_user_id)
-        if not user or user.role != UserRole.PARTICIPANT:
-            return jsonify({'error': 'Participant not found'}), 404
+        current_user_id = get_current_user_id()
         
-        profile = user.participant_profile
+        profile = ParticipantProfile.query.filter_by(user_id=current_user_id).first()
         if not profile:
             return jsonify({'error': 'Profile not found'}), 404
         
-        profile_data = {
-            'id': profile.id,
-            'user_id': profile.user_id,
-            'date_of_birth': profile.date_of_birth.isoformat() if profile.date_of_birth else None,
-            'gender': profile.gender,
-            'location': profile.location,
-            'bio': profile.bio,
-            'interests': json.loads(profile.interests) if profile.interests else [],
-            'availability': json.loads(profile.availability) if profile.availability else [],
-            'phone_number': profile.phone_number,
-            'created_at': profile.created_at.isoformat(),
-            'updated_at': profile.updated_at.isoformat()
-        }
+        profile_data = participant_profile(profile)
         
         return jsonify({
             'participant_profile': profile_data
@@ -49,19 +33,12 @@ def get_participant_profile():
 
 @participants_bp.route('/profile', methods=['PUT'])
 @jwt_required()
+@role_required(UserRole.PARTICIPANT, error='Participant not found')
 def update_participant_profile():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
         
-        user = User.query.get(current_user_id)
-        if not user or user.role != UserRole.PARTICIPANT:
-            return jsonify({'error': 'Participant not found'}), 404
-        
-        profile = user.participant_profile
+        profile = ParticipantProfile.query.filter_by(user_id=current_user_id).first()
         if not profile:
             # Create profile if it doesn't exist
             profile = ParticipantProfile(
@@ -100,17 +77,7 @@ def update_participant_profile():
         
         return jsonify({
             'message': 'Profile updated successfully',
-            'profile': {
-                'id': profile.id,
-                'date_of_birth': profile.date_of_birth.isoformat() if profile.date_of_birth else None,
-                'gender': profile.gender,
-                'location': profile.location,
-                'bio': profile.bio,
-                'interests': json.loads(profile.interests) if profile.interests else [],
-                'availability': json.loads(profile.availability) if profile.availability else [],
-                'phone_number': profile.phone_number,
-                'updated_at': profile.updated_at.isoformat()
-            }
+            'profile': participant_profile(profile)
         })
         
     except Exception as e:
@@ -119,17 +86,10 @@ def update_participant_profile():
 
 @participants_bp.route('/applications', methods=['GET'])
 @jwt_required()
+@role_required(UserRole.PARTICIPANT, error='Participant not found')
 def get_participant_applications():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
-        
-        user = User.query.get(current_user_id)
-        if not user or user.role != UserRole.PARTICIPANT:
-            return jsonify({'error': 'Participant not found'}), 404
+        current_user_id = get_current_user_id()
         
         # Get applications with study details
         applications = db.session.query(
@@ -144,34 +104,7 @@ def get_participant_applications():
             StudyApplication.created_at.desc()
         ).all()
         
-        applications_data = []
-        for application, study, researcher in applications:
-            applications_data.append({
-                'id': application.id,
-                'status': application.status.value,
-                'message': application.message,
-                'created_at': application.created_at.isoformat(),
-                'updated_at': application.updated_at.isoformat(),
-                'study': {
-                    'id': study.id,
-                    'title': study.title,
-                    'description': study.description,
-                    'institution': study.institution,
-                    'category': study.category,
-                    'duration': study.duration,
-                    'compensation': study.compensation,
-                    'location': study.location,
-                    'participants_needed': study.participants_needed,
-                    'participants_current': study.participants_current,
-                    'status': study.status.value,
-                    'application_deadline': study.application_deadline.isoformat() if study.application_deadline else None,
-                    'researcher': {
-                        'id': researcher.id,
-                        'name': researcher.name,
-                        'email': researcher.email
-                    }
-                }
-            })
+        applications_data = [application_with_study(application) for application, study, researcher in applications]
         
         return jsonify(applications_data)
         
@@ -180,17 +113,10 @@ def get_participant_applications():
 
 @participants_bp.route('/participations', methods=['GET'])
 @jwt_required()
+@role_required(UserRole.PARTICIPANT, error='Participant not found')
 def get_participant_participations():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
-        
-        user = User.query.get(current_user_id)
-        if not user or user.role != UserRole.PARTICIPANT:
-            return jsonify({'error': 'Participant not found'}), 404
+        current_user_id = get_current_user_id()
         
         # Get participations with study details
         participations = db.session.query(
@@ -205,35 +131,32 @@ def get_participant_participations():
             StudyParticipation.created_at.desc()
         ).all()
         
-        participations_data = []
-        for participation, study, researcher in participations:
-            participations_data.append({
-                'id': participation.id,
-                'status': participation.status.value,
-                'consent_given': participation.consent_given,
-                'start_date': participation.start_date.isoformat(),
-                'end_date': participation.end_date.isoformat() if participation.end_date else None,
-                'notes': participation.notes,
-                'created_at': participation.created_at.isoformat(),
-                'updated_at': participation.updated_at.isoformat(),
-                'study': {
-                    'id': study.id,
-                    'title': study.title,
-                    'description': study.description,
-                    'institution': study.institution,
-                    'category': study.category,
-                    'duration': study.duration,
-                    'compensation': study.compensation,
-                    'location': study.location,
-                    'researcher': {
-                        'id': researcher.id,
-                        'name': researcher.name,
-                        'email': researcher.email
-                    }
-                }
-            })
+        participations_data = [participation_with_study(participation) for participation, study, researcher in participations]
         
         return jsonify(participations_data)
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+@participants_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+@role_required(UserRole.ADMIN, error='Admin not found')
+def bulk_import_participants():
+    try:
+        # Accept either a JSON array or a streamed NDJSON body
+        if request.mimetype in NDJSON_MIMETYPES:
+            records = iter_ndjson(request.stream)
+        else:
+            records = request.get_json(silent=True)
+            if not isinstance(records, list):
+                return jsonify({'error': 'Expected a JSON array or NDJSON body'}), 400
+        
+        chunk_size = max(1, request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int))
+        invite = request.args.get('invite', 'false').lower() == 'true'
+        results = import_participants(records, chunk_size=chunk_size, invite=invite)
+        
+        return jsonify(summarize_results(results))
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
@@ -1,39 +1,24 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, ResearcherProfile, UserRole
+from flask_jwt_extended import jwt_required
+from models import db, ResearcherProfile, UserRole
+from identity import get_current_user_id, role_required
+from serializers import researcher_profile
 import uuid
 
 researchers_bp = Blueprint('researchers', __name__)
 
 @researchers_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@role_required(UserRole.RESEARCHER, error='Researcher not found')
 def get_researcher_profile():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
         
-        user = User.query.get(current_user_id)
-        if not user or user.role != UserRole.RESEARCHER:
-            return jsonify({'error': 'Researcher not found'}), 404
-        
-        profile = user.researcher_profile
+        profile = ResearcherProfile.query.filter_by(user_id=current_user_id).first()
         if not profile:
             return jsonify({'error': 'Profile not found'}), 404
         
-        profile_data = {
-            'id': profile.id,
-            'user_id': profile.user_id,
-            'institution': profile.institution,
-            'department': profile.department,
-            'title': profile.title,
-            'bio': profile.bio,
-            'verified': profile.verified,
-            'created_at': profile.created_at.isoformat(),
-            'updated_at': profile.updated_at.isoformat()
-        }
+        profile_data = researcher_profile(profile)
         
         return jsonify({
             'researcher_profile': profile_data
@@ -52,19 +37,12 @@ def get_researcher_profile():
 
 @researchers_bp.route('/profile', methods=['PUT'])
 @jwt_required()
+@role_required(UserRole.RESEARCHER, error='Researcher not found')
 def update_researcher_profile():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
-        
-        user = User.query.get(current_user_id)
-        if not user or user.role != UserRole.RESEARCHER:
-            return jsonify({'error': 'Researcher not found'}), 404
+        current_user_id = get_current_user_id()
         
-        profile = user.researcher_profile
+        profile = ResearcherProfile.query.filter_by(user_id=current_user_id).first()
         if not profile:
             # Create profile if it doesn't exist
             profile = ResearcherProfile(
@@ -93,15 +71,7 @@ def update_researcher_profile():
         
         return jsonify({
             'message': 'Profile updated successfully',
-            'profile': {
-                'id': profile.id,
-                'institution': profile.institution,
-                'department': profile.department,
-                'title': profile.title,
-                'bio': profile.bio,
-                'verified': profile.verified,
-                'updated_at': profile.updated_at.isoformat()
-            }
+            'profile': researcher_profile(profile)
         })
         
     except KeyError as e:
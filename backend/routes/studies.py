@@ -1,64 +1,88 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Study, StudyApplication, StudyParticipation, User, StudyStatus, ApplicationStatus
+from flask import Blueprint, request, jsonify, current_app, stream_with_context
+from flask_jwt_extended import jwt_required
+from models import db, Study, StudyApplication, StudyParticipation, User, ResearcherProfile, StudyStatus, ApplicationStatus, ParticipationStatus
+from sqlalchemy import case, func, literal, select
+from sqlalchemy.orm import joinedload, contains_eager
+from caching import study_facets
+from identity import get_current_user_id
+from membership import invalidate_study_members
+from serializers import (
+    study_listing, study_created, study_detail, application_created,
+    application_with_user, participation_with_user
+)
+from counters import increment_applications, ENROLLED_STATUSES
+from upserts import conflict_insert
+from pagination import paginate, page_size, with_next_cursor
+from exports import applications_query, participants_query, stream_rows, FORMATS as EXPORT_FORMATS
+from enrollment import decide_applications, DecisionConflict, DECISIONS, MAX_BATCH_SIZE
+from importers import study_row_from_payload, import_studies, iter_ndjson, summarize_results, NDJSON_MIMETYPES, DEFAULT_CHUNK_SIZE
 import uuid
-import json
-from datetime import datetime, date
+from collections import Counter
+import hashlib
+from datetime import datetime
 
 studies_bp = Blueprint('studies', __name__)
 
+# Compensation buckets reported by the facets endpoint, in display order
+COMPENSATION_BUCKETS = case(
+    (Study.compensation.is_(None), 'none'),
+    (Study.compensation <= 0, 'none'),
+    (Study.compensation < 25, 'under_25'),
+    (Study.compensation < 50, '25_to_50'),
+    (Study.compensation < 100, '50_to_100'),
+    else_='100_plus'
+)
+
+def _listing_filters():
+    """Read the catalog filters shared by the listing and facets endpoints"""
+    return (
+        request.args.get('category'),
+        request.args.get('status'),
+        request.args.get('researcher_id')
+    )
+
+def _filter_studies(query, filters):
+    category, status, researcher_id = filters
+    if category:
+        query = query.filter(Study.category == category)
+    if status:
+        query = query.filter(Study.status == StudyStatus(status))
+    if researcher_id:
+        query = query.filter(Study.researcher_id == researcher_id)
+    return query
+
+def _compute_facets(filters):
+    def counts(column):
+        rows = _filter_studies(
+            db.session.query(column, func.count(Study.id)), filters
+        ).group_by(column).all()
+        # NULL and '' share the 'unspecified' bucket, so add rather than overwrite
+        totals = Counter()
+        for value, count in rows:
+            totals[(value.value if isinstance(value, StudyStatus) else value) or 'unspecified'] += count
+        return dict(totals)
+    
+    by_category = counts(Study.category)
+    return {
+        'total': sum(by_category.values()),
+        'category': by_category,
+        'status': counts(Study.status),
+        'location': counts(Study.location),
+        'compensation': counts(COMPENSATION_BUCKETS)
+    }
+
 @studies_bp.route('/', methods=['GET'])
 def get_studies():
     try:
-        # Get query parameters
-        category = request.args.get('category')
-        status = request.args.get('status')
-        researcher_id = request.args.get('researcher_id')
-        
-        # Build query
-        query = Study.query
-        
-        if category:
-            query = query.filter(Study.category == category)
-        if status:
-            query = query.filter(Study.status == StudyStatus(status))
-        if researcher_id:
-            query = query.filter(Study.researcher_id == researcher_id)
-        
-        studies = query.all()
+        # Build query from the listing filters
+        studies = _filter_studies(Study.query, _listing_filters()).options(
+            joinedload(Study.researcher).joinedload(User.researcher_profile)
+        ).all()
         
         studies_data = []
         for study in studies:
             try:
-                institution = study.institution
-                if not institution and study.researcher and study.researcher.researcher_profile:
-                    institution = study.researcher.researcher_profile.institution
-                
-                studies_data.append({
-                    'id': study.id,
-                    'title': study.title,
-                    'description': study.description,
-                    'institution': institution,
-                    'category': study.category,
-                    'duration': study.duration,
-                    'compensation': study.compensation,
-                    'location': study.location,
-                    'participants_needed': study.participants_needed,
-                    'participants_current': study.participants_current,
-                    'status': study.status.value,
-                    'irb_approval_number': study.irb_approval_number,
-                    'requirements': json.loads(study.requirements) if study.requirements else [],
-                    'start_date': study.start_date.isoformat() if study.start_date else None,
-                    'end_date': study.end_date.isoformat() if study.end_date else None,
-                    'application_deadline': study.application_deadline.isoformat() if study.application_deadline else None,
-                    'created_at': study.created_at.isoformat(),
-                    'updated_at': study.updated_at.isoformat(),
-                    'researcher': {
-                        'id': study.researcher.id,
-                        'name': study.researcher.name,
-                        'email': study.researcher.email
-                    } if study.researcher else None
-                })
+                studies_data.append(study_listing(study))
             except Exception as e:
                 print(f"Error processing study {study.id}: {e}")
                 continue
@@ -76,117 +100,106 @@ def get_studies():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@studies_bp.route('/facets', methods=['GET'])
+def get_study_facets():
+    try:
+        filters = _listing_filters()
+        facets = study_facets.get_or_set(filters, lambda: _compute_facets(filters))
+        return jsonify(facets)
+        
+    except ValueError as e:
+        return jsonify({'error': f'Invalid filter: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @studies_bp.route('/', methods=['POST'])
 @jwt_required()
 def create_study():
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
         
         data = request.get_json()
         
-        # Validate required fields
-        required_fields = ['title', 'description', 'institution', 'category', 'duration', 'participants_needed']
-        if not data or not all(k in data for k in required_fields):
-            return jsonify({'error': 'Missing required fields'}), 400
-        
-        # Create new study
-        study = Study(
-            id=str(uuid.uuid4()),
-            title=data['title'],
-            description=data['description'],
-            institution=data['institution'],
-            researcher_id=current_user_id,
-            category=data['category'],
-            duration=data['duration'],
-            compensation=data.get('compensation'),
-            location=data.get('location'),
-            participants_needed=data['participants_needed'],
-            status=StudyStatus.DRAFT,
-            irb_approval_number=data.get('irb_approval_number'),
-            consent_form=data.get('consent_form'),
-            requirements=json.dumps(data.get('requirements', [])),
-            start_date=datetime.strptime(data['start_date'], '%Y-%m-%d').date() if data.get('start_date') else None,
-            end_date=datetime.strptime(data['end_date'], '%Y-%m-%d').date() if data.get('end_date') else None,
-            application_deadline=datetime.strptime(data['application_deadline'], '%Y-%m-%d').date() if data.get('application_deadline') else None
-        )
+        # Validate payload and create new study
+        try:
+            study = Study(**study_row_from_payload(data, current_user_id))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         db.session.add(study)
         db.session.commit()
-        
-        institution = study.institution
-        if not institution and study.researcher and study.researcher.researcher_profile:
-            institution = study.researcher.researcher_profile.institution
+        study_facets.clear()
         
         return jsonify({
             'message': 'Study created successfully',
-            'study': {
-                'id': study.id,
-                'title': study.title,
-                'description': study.description,
-                'institution': institution,
-                'category': study.category,
-                'duration': study.duration,
-                'compensation': study.compensation,
-                'location': study.location,
-                'participants_needed': study.participants_needed,
-                'participants_current': study.participants_current,
-                'status': study.status.value,
-                'created_at': study.created_at.isoformat()
-            }
+            'study': study_created(study)
         }), 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@studies_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+def bulk_import_studies():
+    try:
+        current_user_id = get_current_user_id()
+        
+        # Accept either a JSON array or a streamed NDJSON body
+        if request.mimetype in NDJSON_MIMETYPES:
+            records = iter_ndjson(request.stream)
+        else:
+            records = request.get_json(silent=True)
+            if not isinstance(records, list):
+                return jsonify({'error': 'Expected a JSON array or NDJSON body'}), 400
+        
+        chunk_size = max(1, request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int))
+        results = import_studies(records, current_user_id, chunk_size=chunk_size)
+        
+        return jsonify(summarize_results(results))
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def _study_etag(study_id, updated_at, applications_count, participants_current, researcher_updated_at, profile_updated_at):
+    """ETag for a study detail representation, including the embedded researcher.
+
+    Timestamps keep their full precision, so edits within the same second
+    still change the tag (which is why no Last-Modified is sent).
+    """
+    stamps = ':'.join(value.isoformat() if value else '' for value in (updated_at, researcher_updated_at, profile_updated_at))
+    version = f"{study_id}:{stamps}:{applications_count}:{participants_current}"
+    return hashlib.sha1(version.encode('utf-8')).hexdigest()
+
 @studies_bp.route('/<study_id>', methods=['GET'])
 def get_study(study_id):
     try:
-        study = Study.query.get(study_id)
+        # Cheap primary-key lookup of the cache validators first
+        validators = db.session.query(
+            Study.updated_at, Study.applications_count, Study.participants_current,
+            User.updated_at, ResearcherProfile.updated_at
+        ).outerjoin(
+            User, Study.researcher_id == User.id
+        ).outerjoin(
+            ResearcherProfile, ResearcherProfile.user_id == User.id
+        ).filter(Study.id == study_id).first()
         
-        if not study:
+        if not validators:
             return jsonify({'error': 'Study not found'}), 404
         
-        # Get applications count
-        applications_count = StudyApplication.query.filter_by(study_id=study_id).count()
-        
-        institution = study.institution
-        if not institution and study.researcher and study.researcher.researcher_profile:
-            institution = study.researcher.researcher_profile.institution
-        
-        study_data = {
-            'id': study.id,
-            'title': study.title,
-            'description': study.description,
-            'institution': institution,
-            'category': study.category,
-            'duration': study.duration,
-            'compensation': study.compensation,
-            'location': study.location,
-            'participants_needed': study.participants_needed,
-            'participants_current': study.participants_current,
-            'status': study.status.value,
-            'irb_approval_number': study.irb_approval_number,
-            'consent_form': study.consent_form,
-            'requirements': json.loads(study.requirements) if study.requirements else [],
-            'start_date': study.start_date.isoformat() if study.start_date else None,
-            'end_date': study.end_date.isoformat() if study.end_date else None,
-            'application_deadline': study.application_deadline.isoformat() if study.application_deadline else None,
-            'created_at': study.created_at.isoformat(),
-            'updated_at': study.updated_at.isoformat(),
-            'applications_count': applications_count,
-            'researcher': {
-                'id': study.researcher.id,
-                'name': study.researcher.name,
-                'email': study.researcher.email
-            }
-        }
-        
-        return jsonify(study_data)
+        etag = _study_etag(study_id, *validators)
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            study = Study.query.options(
+                joinedload(Study.researcher).joinedload(User.researcher_profile)
+            ).filter(Study.id == study_id).first()
+            response = jsonify(study_detail(study))
+        
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -195,106 +208,103 @@ def get_study(study_id):
 @jwt_required()
 def apply_to_study(study_id):
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
         
-        # Check if study exists
-        study = Study.query.get(study_id)
-        if not study:
-            return jsonify({'error': 'Study not found'}), 404
+        data = request.get_json(silent=True)
+        if data is None:
+            data = {}
+        elif not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
         
-        # Check if user has already applied
-        existing_application = StudyApplication.query.filter_by(
-            study_id=study_id,
-            user_id=current_user_id
-        ).first()
-        
-        if existing_application:
-            return jsonify({'error': 'Already applied to this study'}), 400
-        
-        # Create application
+        # Build the application up front so the insert needs no read-back
+        now = datetime.utcnow()
         application = StudyApplication(
             id=str(uuid.uuid4()),
             study_id=study_id,
             user_id=current_user_id,
             status=ApplicationStatus.PENDING,
-            message=request.json.get('message') if request.json else None
+            message=data.get('message'),
+            created_at=now,
+            updated_at=now
+        )
+        
+        # Insert only if the study exists; the (study_id, user_id) unique
+        # constraint turns a duplicate or concurrent application into a no-op
+        columns = ['id', 'study_id', 'user_id', 'status', 'message', 'created_at', 'updated_at']
+        source = select(*[
+            literal(getattr(application, name), type_=getattr(StudyApplication, name).type)
+            for name in columns
+        ]).where(Study.id == study_id)
+        result = db.session.execute(
+            conflict_insert(StudyApplication).from_select(columns, source).on_conflict_do_nothing(
+                index_elements=['study_id', 'user_id']
+            )
         )
         
-        db.session.add(application)
+        if result.rowcount == 0:
+            db.session.rollback()
+            existing_application = StudyApplication.query.filter_by(
+                study_id=study_id,
+                user_id=current_user_id
+            ).first()
+            if not existing_application:
+                return jsonify({'error': 'Study not found'}), 404
+            return jsonify({
+                'error': 'Already applied to this study',
+                'application': application_created(existing_application)
+            }), 400
+        
+        increment_applications(study_id)
         db.session.commit()
+        invalidate_study_members(study_id)
         
         return jsonify({
             'message': 'Application submitted successfully',
-            'application': {
-                'id': application.id,
-                'study_id': application.study_id,
-                'status': application.status.value,
-                'created_at': application.created_at.isoformat()
-            }
+            'application': application_created(application)
         }), 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def _study_owner(study_id):
+    """Researcher id of a study, or None when it does not exist"""
+    return db.session.query(Study.researcher_id).filter(Study.id == study_id).scalar()
+
 @studies_bp.route('/<study_id>/participants', methods=['GET'])
 @jwt_required()
 def get_study_participants(study_id):
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
 
         # Check if study exists and user is the researcher
-        study = Study.query.get(study_id)
-        if not study or study.researcher_id != current_user_id:
+        if _study_owner(study_id) != current_user_id:
             return jsonify({'error': 'Study not found or access denied'}), 404
 
-        # Get participants with their participation details
-        participants = db.session.query(
-            StudyParticipation, User
-        ).join(
-            User, StudyParticipation.user_id == User.id
+        # Participation statuses to include (enrolled participants by default)
+        status = request.args.get('status')
+        statuses = [ParticipationStatus(status)] if status else list(ENROLLED_STATUSES)
+
+        # Get one page of participants with their profiles in a single query
+        query = db.session.query(StudyParticipation).join(
+            StudyParticipation.user
+        ).options(
+            contains_eager(StudyParticipation.user).joinedload(User.participant_profile)
         ).filter(
             StudyParticipation.study_id == study_id,
-            StudyParticipation.status.in_(['ACTIVE', 'COMPLETED'])
-        ).all()
+            StudyParticipation.status.in_(statuses)
+        )
+        participations, next_cursor = paginate(
+            query, StudyParticipation.created_at, StudyParticipation.id,
+            cursor=request.args.get('cursor'), limit=page_size(request.args)
+        )
 
-        participants_data = []
-        for participation, user in participants:
-            participants_data.append({
-                'id': participation.id,
-                'status': participation.status.value,
-                'start_date': participation.start_date.isoformat() if participation.start_date else None,
-                'end_date': participation.end_date.isoformat() if participation.end_date else None,
-                'consent_given': participation.consent_given,
-                'notes': participation.notes,
-                'created_at': participation.created_at.isoformat(),
-                'user': {
-                    'id': user.id,
-                    'name': user.name,
-                    'email': user.email,
-                    'participant_profile': {
-                        'id': user.participant_profile.id,
-                        'date_of_birth': user.participant_profile.date_of_birth.isoformat() if user.participant_profile.date_of_birth else None,
-                        'gender': user.participant_profile.gender,
-                        'location': user.participant_profile.location,
-                        'bio': user.participant_profile.bio,
-                        'interests': user.participant_profile.interests,
-                        'availability': user.participant_profile.availability,
-                        'phone_number': user.participant_profile.phone_number
-                    } if user.participant_profile else None
-                }
-            })
+        participants_data = [participation_with_user(participation) for participation in participations]
 
-        return jsonify(participants_data)
+        return with_next_cursor(jsonify(participants_data), next_cursor)
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -302,51 +312,132 @@ def get_study_participants(study_id):
 @jwt_required()
 def get_study_applications(study_id):
     try:
-        identity = get_jwt_identity()
-        if isinstance(identity, dict):
-            current_user_id = identity['user_id']
-        else:
-            current_user_id = identity
+        current_user_id = get_current_user_id()
         
         # Check if study exists and user is the researcher
-        study = Study.query.get(study_id)
-        if not study or study.researcher_id != current_user_id:
+        if _study_owner(study_id) != current_user_id:
             return jsonify({'error': 'Study not found or access denied'}), 404
         
-        # Get applications with user details
-        applications = db.session.query(
-            StudyApplication, User
-        ).join(
-            User, StudyApplication.user_id == User.id
+        # Get one page of applications with applicant profiles in a single query
+        query = db.session.query(StudyApplication).join(
+            StudyApplication.user
+        ).options(
+            contains_eager(StudyApplication.user).joinedload(User.participant_profile)
         ).filter(
             StudyApplication.study_id == study_id
-        ).all()
+        )
+        if request.args.get('status'):
+            query = query.filter(StudyApplication.status == ApplicationStatus(request.args['status']))
+        
+        applications, next_cursor = paginate(
+            query, StudyApplication.created_at, StudyApplication.id,
+            cursor=request.args.get('cursor'), limit=page_size(request.args)
+        )
+        
+        applications_data = [application_with_user(application) for application in applications]
+        
+        return with_next_cursor(jsonify(applications_data), next_cursor)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _export_response(stmt, filename):
+    """Stream ``stmt`` as CSV or NDJSON, gzip-compressed when the client accepts it"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Format must be csv or ndjson'}), 400
+    
+    compress = 'gzip' in request.accept_encodings
+    response = current_app.response_class(
+        stream_with_context(stream_rows(stmt, fmt, compress=compress)),
+        mimetype=EXPORT_FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@studies_bp.route('/<study_id>/applications/export', methods=['GET'])
+@jwt_required()
+def export_study_applications(study_id):
+    try:
+        current_user_id = get_current_user_id()
+        
+        # Check if study exists and user is the researcher
+        if _study_owner(study_id) != current_user_id:
+            return jsonify({'error': 'Study not found or access denied'}), 404
+        
+        status = request.args.get('status')
+        statuses = [ApplicationStatus(status)] if status else None
+        
+        return _export_response(applications_query(study_id, statuses), f'study-{study_id}-applications')
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@studies_bp.route('/<study_id>/participants/export', methods=['GET'])
+@jwt_required()
+def export_study_participants(study_id):
+    try:
+        current_user_id = get_current_user_id()
         
-        applications_data = []
-        for application, user in applications:
-            applications_data.append({
-                'id': application.id,
-                'status': application.status.value,
-                'message': application.message,
-                'created_at': application.created_at.isoformat(),
-                'user': {
-                    'id': user.id,
-                    'name': user.name,
-                    'email': user.email,
-                    'participant_profile': {
-                        'id': user.participant_profile.id,
-                        'date_of_birth': user.participant_profile.date_of_birth.isoformat() if user.participant_profile.date_of_birth else None,
-                        'gender': user.participant_profile.gender,
-                        'location': user.participant_profile.location,
-                        'bio': user.participant_profile.bio,
-                        'interests': user.participant_profile.interests,
-                        'availability': user.participant_profile.availability,
-                        'phone_number': user.participant_profile.phone_number
-                    } if user.participant_profile else None
-                }
-            })
-        
-        return jsonify(applications_data)
+        # Check if study exists and user is the researcher
+        if _study_owner(study_id) != current_user_id:
+            return jsonify({'error': 'Study not found or access denied'}), 404
         
+        status = request.args.get('status')
+        statuses = [ParticipationStatus(status)] if status else list(ENROLLED_STATUSES)
+        
+        return _export_response(participants_query(study_id, statuses), f'study-{study_id}-participants')
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+@studies_bp.route('/<study_id>/applications/decisions', methods=['POST'])
+@jwt_required()
+def decide_study_applications(study_id):
+    try:
+        current_user_id = get_current_user_id()
+        
+        # Check if study exists and user is the researcher
+        if _study_owner(study_id) != current_user_id:
+            return jsonify({'error': 'Study not found or access denied'}), 404
+        
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('application_ids'), list) or 'decision' not in data:
+            return jsonify({'error': 'Missing required fields'}), 400
+        if len(data['application_ids']) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} applications per request'}), 400
+        
+        try:
+            decision = ApplicationStatus(data['decision'])
+        except ValueError:
+            decision = None
+        if decision not in DECISIONS:
+            return jsonify({'error': 'Decision must be APPROVED or REJECTED'}), 400
+        
+        try:
+            results = decide_applications(study_id, data['application_ids'], decision)
+        except DecisionConflict as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 409
+        
+        db.session.commit()
+        invalidate_study_members(study_id)
+        
+        return jsonify({
+            'decision': decision.value,
+            'updated': sum(1 for r in results if r['status'] == decision.value),
+            'results': results
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
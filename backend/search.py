@@ -0,0 +1,56 @@
+"""
+Full-text search over the caller's messages.
+
+Backed by the ``messages_fts`` and ``messages_archive_fts`` FTS5 tables
+declared in models.py, so it is only available on SQLite. Hot and archived
+messages are searched separately and their pages merged by the route. User input is never passed to MATCH as query
+syntax: every whitespace-separated term is quoted, and all terms must
+match.
+"""
+
+import html
+from sqlalchemy import func, literal_column, table, column
+from sqlalchemy.orm import joinedload
+from models import db, ArchivedMessage, Message
+
+SNIPPET_TOKENS = 12
+
+# Marker characters that cannot appear in escaped HTML; swapped for <mark>
+# tags after the snippet text is escaped
+_OPEN, _CLOSE = '\x02', '\x03'
+
+SEARCH_TABLES = {Message: 'messages_fts', ArchivedMessage: 'messages_archive_fts'}
+
+
+def search_supported():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query of quoted terms, or None if empty"""
+    terms = text.split()
+    if not terms:
+        return None
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and wrap the matched terms in <mark>"""
+    return html.escape(snippet).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search_messages_query(user_id, match, model=Message):
+    """Query of ``(model, snippet)`` for the user's messages matching ``match``"""
+    name = SEARCH_TABLES[model]
+    fts_table, fts = table(name, column('rowid')), literal_column(name)
+    snippet = func.snippet(fts, 0, _OPEN, _CLOSE, '…', SNIPPET_TOKENS).label('snippet')
+    return db.session.query(model, snippet).join(
+        fts_table, fts_table.c.rowid == model.search_rowid
+    ).filter(
+        fts.op('MATCH')(match),
+        (model.sender_id == user_id) | (model.receiver_id == user_id)
+    ).options(
+        joinedload(model.sender, innerjoin=True),
+        joinedload(model.receiver, innerjoin=True),
+        joinedload(model.study)
+    )
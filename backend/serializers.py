@@ -0,0 +1,210 @@
+"""
+Model serializers compiled once from declarative field specs.
+
+Each spec entry is either an attribute name, copied as is, or a
+``(name, kind)`` pair where ``kind`` is one of:
+
+    'iso'        date/datetime -> ISO 8601 string (None stays None)
+    'enum'       Enum -> its value
+    'json'       JSON text column -> decoded value ([] when empty)
+    serializer   nested object serialized with another compiled serializer
+    callable     value computed from the whole object
+
+``compile_serializer`` turns a spec into a plain function whose body is a
+single dict display with inlined attribute access, so serializing a row
+costs one function call instead of a loop over the spec.
+"""
+
+import json
+from datetime import date, datetime
+from enum import Enum
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _enum(value):
+    return value.value if value is not None else None
+
+
+def _json_list(value):
+    return json.loads(value) if value else []
+
+
+_CONVERTERS = {'iso': '_iso', 'enum': '_enum', 'json': '_json'}
+
+
+def _nested(serializer):
+    def serialize_nested(value):
+        return serializer(value) if value is not None else None
+    return serialize_nested
+
+
+def compile_serializer(spec, name='serialize'):
+    """Compile a field spec into a ``serialize(obj) -> dict`` function"""
+    spec = tuple(spec)
+    namespace = {'_iso': _iso, '_enum': _enum, '_json': _json_list}
+    items = []
+
+    for index, entry in enumerate(spec):
+        key, kind = (entry, None) if isinstance(entry, str) else entry
+        if not key.isidentifier():
+            raise ValueError(f'Invalid field name: {key!r}')
+
+        if kind is None:
+            expr = f'obj.{key}'
+        elif isinstance(kind, str):
+            expr = f'{_CONVERTERS[kind]}(obj.{key})'
+        elif hasattr(kind, 'spec'):
+            namespace[f'_f{index}'] = _nested(kind)
+            expr = f'_f{index}(obj.{key})'
+        elif callable(kind):
+            namespace[f'_f{index}'] = kind
+            expr = f'_f{index}(obj)'
+        else:
+            raise ValueError(f'Invalid kind for field {key!r}: {kind!r}')
+        items.append(f'        {key!r}: {expr},')
+
+    source = f'def {name}(obj):\n    return {{\n' + '\n'.join(items) + '\n    }\n'
+    exec(compile(source, f'<serializer {name}>', 'exec'), namespace)
+
+    serializer = namespace[name]
+    serializer.spec = spec
+    return serializer
+
+
+def extend(serializer, *spec, name=None):
+    """Compile a new serializer with extra fields appended to an existing spec"""
+    return compile_serializer(serializer.spec + spec, name or serializer.__name__)
+
+
+def many(serializer, objs):
+    return [serializer(obj) for obj in objs]
+
+
+def study_institution(study):
+    """Study institution, falling back to the researcher's profile"""
+    institution = study.institution
+    if not institution and study.researcher and study.researcher.researcher_profile:
+        institution = study.researcher.researcher_profile.institution
+    return institution
+
+
+# Users
+user_contact = compile_serializer(['id', 'name', 'email'], 'user_contact')
+user_with_role = extend(user_contact, ('role', 'enum'), name='user_with_role')
+user_account = compile_serializer([
+    'id', 'email', 'name', ('role', 'enum'), ('created_at', 'iso')
+], 'user_account')
+user_profile = extend(user_account, 'avatar', ('updated_at', 'iso'), name='user_profile')
+
+# Profiles. The summary variants return interests/availability as stored.
+participant_profile_summary = compile_serializer([
+    'id', ('date_of_birth', 'iso'), 'gender', 'location', 'bio',
+    'interests', 'availability', 'phone_number'
+], 'participant_profile_summary')
+participant_profile = compile_serializer([
+    'id', 'user_id', ('date_of_birth', 'iso'), 'gender', 'location', 'bio',
+    ('interests', 'json'), ('availability', 'json'), 'phone_number',
+    ('created_at', 'iso'), ('updated_at', 'iso')
+], 'participant_profile')
+researcher_profile_summary = compile_serializer([
+    'id', 'institution', 'department', 'title', 'bio', 'verified'
+], 'researcher_profile_summary')
+researcher_profile = extend(
+    researcher_profile_summary, 'user_id', ('created_at', 'iso'), ('updated_at', 'iso'),
+    name='researcher_profile'
+)
+user_with_profile = extend(
+    user_contact, ('participant_profile', participant_profile_summary), name='user_with_profile'
+)
+
+# Studies
+study_ref = compile_serializer(['id', 'title'], 'study_ref')
+study_card = compile_serializer([
+    'id', 'title', 'description', 'institution', 'category', 'duration',
+    'compensation', 'location', ('researcher', user_contact)
+], 'study_card')
+study_overview = extend(
+    study_card, 'participants_needed', 'participants_current', ('status', 'enum'),
+    ('application_deadline', 'iso'), name='study_overview'
+)
+study_match = compile_serializer([
+    'id', 'title', 'description', 'institution', 'category', 'duration',
+    'compensation', 'location', 'participants_needed', 'participants_current',
+    ('researcher', user_contact), ('created_at', 'iso')
+], 'study_match')
+study_created = compile_serializer([
+    'id', 'title', 'description', ('institution', study_institution), 'category',
+    'duration', 'compensation', 'location', 'participants_needed',
+    'participants_current', ('status', 'enum'), ('created_at', 'iso')
+], 'study_created')
+study_listing = extend(
+    study_created, 'irb_approval_number', ('requirements', 'json'), ('start_date', 'iso'),
+    ('end_date', 'iso'), ('application_deadline', 'iso'), ('updated_at', 'iso'),
+    ('researcher', user_contact), name='study_listing'
+)
+study_detail = extend(study_listing, 'consent_form', 'applications_count', name='study_detail')
+
+# Applications and participations
+application_base = compile_serializer([
+    'id', ('status', 'enum'), 'message', ('created_at', 'iso')
+], 'application_base')
+application_created = compile_serializer([
+    'id', 'study_id', ('status', 'enum'), ('created_at', 'iso')
+], 'application_created')
+application_with_user = extend(application_base, ('user', user_with_profile), name='application_with_user')
+application_with_study = extend(
+    application_base, ('updated_at', 'iso'), ('study', study_overview), name='application_with_study'
+)
+participation_base = compile_serializer([
+    'id', ('status', 'enum'), 'consent_given', ('start_date', 'iso'), ('end_date', 'iso'),
+    'notes', ('created_at', 'iso')
+], 'participation_base')
+participation_with_user = extend(participation_base, ('user', user_with_profile), name='participation_with_user')
+participation_with_study = extend(
+    participation_base, ('updated_at', 'iso'), ('study', study_card), name='participation_with_study'
+)
+
+# Messages
+message_preview = compile_serializer([
+    'id', 'content', ('type', 'enum'), ('created_at', 'iso')
+], 'message_preview')
+message_detail = extend(
+    message_preview, 'read', ('sender', user_with_role), ('receiver', user_with_role),
+    ('study', study_ref), name='message_detail'
+)
+
+
+def _json_default(o):
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Enum):
+        return o.value
+    return DefaultJSONProvider.default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes datetimes, dates and enums natively.
+
+    Datetimes and dates are written as ISO 8601 rather than Flask's HTTP date
+    format. When ``orjson`` is installed it is used for compact output (it
+    emits UTF-8 rather than ``\\u`` escapes).
+    """
+
+    default = staticmethod(_json_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and 'indent' not in kwargs:
+            option = orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        return super().dumps(obj, **kwargs)
@@ -7,6 +7,7 @@ from flask.testing import FlaskClient
 from flask_jwt_extended import create_access_token
 
 from app import app, db
+from caching import clear_all
 from models import User, ResearcherProfile, ParticipantProfile, Study, StudyApplication, StudyParticipation, Message, UserRole, StudyStatus, ApplicationStatus, MessageType
 
 
@@ -22,6 +23,7 @@ def client():
         yield app.test_client()
         db.session.remove()
         db.drop_all()
+        clear_all()
 
 
 @pytest.fixture
@@ -177,6 +179,31 @@ class TestParticipantProfileRoutes:
         response = client.get('/api/participants/profile')
         assert response.status_code == 401
 
+    def test_get_participant_profile_wrong_role(self, client, test_researcher):
+        """Test a researcher token is rejected by participant routes"""
+        headers = {'Authorization': f'Bearer {create_access_token(identity=test_researcher.id)}'}
+        response = client.get('/api/participants/profile', headers=headers)
+        assert response.status_code == 404
+        assert json.loads(response.data)['error'] == 'Participant not found'
+
+    def test_role_check_uses_user_summary_cache(self, client, test_participant, auth_headers_participant):
+        """Test repeated requests resolve the caller's role without a users query"""
+        from sqlalchemy import event
+
+        client.get('/api/participants/profile', headers=auth_headers_participant)
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = client.get('/api/participants/profile', headers=auth_headers_participant)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        assert response.status_code == 200
+        assert not any('FROM users' in statement for statement in statements)
+
     def test_update_participant_profile_success(self, client, test_participant, auth_headers_participant):
         """Test updating participant profile successfully"""
         update_data = {
@@ -279,6 +306,121 @@ class TestParticipantParticipationRoutes:
         assert response.status_code == 401
 
 
+@pytest.fixture
+def auth_headers_admin():
+    """Create an admin user and get auth headers for it"""
+    user = User(id=str(uuid.uuid4()), email='admin@test.com', name='Test Admin', role=UserRole.ADMIN)
+    user.set_password('password123')
+    db.session.add(user)
+    db.session.commit()
+    access_token = create_access_token(identity=user.id)
+    return {'Authorization': f'Bearer {access_token}'}
+
+
+class TestParticipantImportRoutes:
+    """Test bulk participant onboarding"""
+
+    def test_bulk_import_participants(self, client, test_participant, auth_headers_admin, monkeypatch):
+        """Test importing a roster with per-row results"""
+        monkeypatch.setitem(app.config, 'BCRYPT_LOG_ROUNDS', 4)
+        roster = [
+            {'email': f'clinic{i}@test.com', 'name': f'Clinic Participant {i}', 'password': f'secret{i}',
+             'location': 'Boston', 'interests': ['Sleep']}
+            for i in range(3)
+        ]
+        roster.append({'email': 'no.name@test.com', 'password': 'secret'})
+        roster.append({'email': 'CLINIC0@test.com', 'name': 'Duplicate', 'password': 'secret'})
+        roster.append({'email': 'Participant@Test.com', 'name': 'Existing', 'password': 'secret'})
+
+        response = client.post('/api/participants/bulk?chunk_size=2', json=roster, headers=auth_headers_admin)
+        assert response.status_code == 200
+
+        data = json.loads(response.data)
+        assert data['created'] == 3
+        assert data['failed'] == 3
+        assert [r['error'] for r in data['results'][3:]] == [
+            'Missing required fields', 'Duplicate email in import', 'User with this email already exists'
+        ]
+
+        user = User.query.filter_by(email_normalized='clinic1@test.com').one()
+        assert user.role == UserRole.PARTICIPANT
+        assert user.participant_profile.location == 'Boston'
+        response = client.post('/api/auth/login', json={'email': 'clinic1@test.com', 'password': 'secret1'})
+        assert response.status_code == 200
+
+    def test_bulk_import_participants_invalid_values(self, client, auth_headers_admin, monkeypatch):
+        """Test badly typed values fail their own row instead of the import"""
+        from passwords import hash_passwords
+
+        monkeypatch.setitem(app.config, 'BCRYPT_LOG_ROUNDS', 4)
+        roster = [
+            {'email': 'numeric@test.com', 'name': 'Numeric Password', 'password': 12345678},
+            {'email': 'empty@test.com', 'name': 'Empty Password', 'password': ''},
+            {'email': 'long@test.com', 'name': 'Long Password', 'password': 'x' * 73},
+            {'email': 'number.name@test.com', 'name': 42, 'password': 'secret'},
+            {'email': 'valid@test.com', 'name': 'Valid', 'password': 'secret'}
+        ]
+        response = client.post('/api/participants/bulk?chunk_size=2', json=roster, headers=auth_headers_admin)
+        assert response.status_code == 200
+
+        data = json.loads(response.data)
+        assert data['created'] == 1
+        assert [r['status'] for r in data['results']] == ['error'] * 4 + ['created']
+        assert User.query.filter_by(email_normalized='valid@test.com').count() == 1
+
+        # Hashing failures are reported in place rather than raised
+        hashes = hash_passwords(['secret', 12345678])
+        assert hashes[0].startswith('$2b$04$')
+        assert isinstance(hashes[1], TypeError)
+
+    def test_bulk_import_participants_with_invites(self, client, auth_headers_admin):
+        """Test invited participants set their password through the invite token"""
+        response = client.post('/api/participants/bulk?invite=true',
+                             json=[{'email': 'invited@test.com', 'name': 'Invited Participant'}],
+                             headers=auth_headers_admin)
+        result = json.loads(response.data)['results'][0]
+        assert result['status'] == 'created'
+
+        response = client.post('/api/auth/login', json={'email': 'invited@test.com', 'password': ''})
+        assert response.status_code == 401
+
+        response = client.post('/api/auth/accept-invite', json={'token': result['invite_token'], 'password': 'chosen123'})
+        assert response.status_code == 200
+        assert json.loads(response.data)['user']['id'] == result['id']
+
+        response = client.post('/api/auth/accept-invite', json={'token': result['invite_token'], 'password': 'again123'})
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'Invite already used'
+
+        response = client.post('/api/auth/login', json={'email': 'invited@test.com', 'password': 'chosen123'})
+        assert response.status_code == 200
+
+    def test_accept_invite_invalid_token(self, client):
+        """Test a forged invite token is rejected"""
+        response = client.post('/api/auth/accept-invite', json={'token': 'forged', 'password': 'secret'})
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'Invalid or expired invite'
+
+    def test_bulk_import_participants_requires_admin(self, client, test_participant, auth_headers_participant):
+        """Test only admins can import participants"""
+        response = client.post('/api/participants/bulk', json=[], headers=auth_headers_participant)
+        assert response.status_code == 404
+
+    def test_import_participants_command(self, client, tmp_path):
+        """Test onboarding a roster offline through the CLI"""
+        path = tmp_path / 'roster.ndjson'
+        path.write_text('\n'.join(json.dumps({'email': f'roster{i}@test.com', 'name': f'Roster {i}'}) for i in range(2)))
+        invites = tmp_path / 'invites.csv'
+
+        result = app.test_cli_runner().invoke(args=['import-participants', str(path), '--invite', '--invites-out', str(invites)])
+        assert result.exit_code == 0
+        assert 'Imported 2 participants, 0 failed' in result.output
+        lines = invites.read_text().splitlines()
+        assert lines[0] == 'email,invite_token'
+        assert [line.split(',')[0] for line in lines[1:]] == ['roster0@test.com', 'roster1@test.com']
+        assert ParticipantProfile.query.count() == 2
+
+
 class TestStudyApplicationRoutes:
     """Test study application routes for participants"""
 
@@ -299,6 +441,17 @@ class TestStudyApplicationRoutes:
         assert application['study_id'] == test_study.id
         assert application['status'] == 'PENDING'
 
+    def test_apply_to_study_increments_applications_count(self, client, test_participant, test_study, auth_headers_participant):
+        """Test applying to a study keeps the denormalized counter current"""
+        response = client.post(f'/api/studies/{test_study.id}/apply',
+                             json={'message': 'Count me in'},
+                             headers=auth_headers_participant)
+        assert response.status_code == 201
+
+        response = client.get(f'/api/studies/{test_study.id}')
+        data = json.loads(response.data)
+        assert data['applications_count'] == 1
+
     def test_apply_to_study_duplicate(self, client, test_participant, test_study, test_application, auth_headers_participant):
         """Test applying to a study when already applied"""
         application_data = {
@@ -313,6 +466,24 @@ class TestStudyApplicationRoutes:
         data = json.loads(response.data)
         assert 'error' in data
 
+    def test_apply_to_study_duplicate_returns_existing(self, client, test_participant, test_study, test_application, auth_headers_participant):
+        """Test a repeated application returns the existing one without counting twice"""
+        response = client.post(f'/api/studies/{test_study.id}/apply',
+                             json={'message': 'Again'},
+                             headers=auth_headers_participant)
+        assert response.status_code == 400
+
+        data = json.loads(response.data)
+        assert data['application']['id'] == test_application.id
+        assert StudyApplication.query.filter_by(study_id=test_study.id).count() == 1
+
+    def test_apply_to_study_invalid_body(self, client, test_participant, test_study, auth_headers_participant):
+        """Test a body that is not a JSON object is rejected"""
+        for body in ([], 'x'):
+            response = client.post(f'/api/studies/{test_study.id}/apply', json=body, headers=auth_headers_participant)
+            assert response.status_code == 400
+        assert StudyApplication.query.count() == 0
+
     def test_apply_to_study_not_found(self, client, test_participant, auth_headers_participant):
         """Test applying to a non-existent study"""
         application_data = {
@@ -461,6 +632,540 @@ class TestMessageRoutes:
                              headers=researcher_headers)
         assert response.status_code == 403
 
+    def test_get_messages_loads_related_rows_in_one_query(self, client, test_participant, test_researcher, test_study, auth_headers_participant):
+        """Test a thread is read without per-message user or study lookups"""
+        from sqlalchemy import event
+
+        for content in ('One', 'Two', 'Three'):
+            client.post('/api/messages/',
+                      json={'receiver_id': test_researcher.id, 'content': content, 'study_id': test_study.id},
+                      headers=auth_headers_participant)
+
+        study_id, participant_id = test_study.id, test_participant.id
+        statements = []
+        def count(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = client.get(f'/api/messages/?study_id={study_id}', headers=auth_headers_participant)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        data = json.loads(response.data)
+        assert [message['content'] for message in data] == ['One', 'Two', 'Three']
+        assert data[0]['sender']['id'] == participant_id
+        assert data[0]['study']['id'] == study_id
+        # The page itself, plus the archive lookup once the hot rows run out
+        assert len(statements) == 2
+        assert 'messages_archive' in statements[1]
+
+    def test_get_messages_cursor_pagination(self, client, test_participant, test_researcher, auth_headers_participant):
+        """Test a thread opens on the newest page and pages both ways"""
+        researcher_id = test_researcher.id
+        for content in ('m1', 'm2', 'm3', 'm4', 'm5'):
+            client.post('/api/messages/',
+                      json={'receiver_id': researcher_id, 'content': content},
+                      headers=auth_headers_participant)
+
+        url = f'/api/messages/?other_user_id={researcher_id}&limit=2'
+        response = client.get(url, headers=auth_headers_participant)
+        assert [m['content'] for m in json.loads(response.data)] == ['m4', 'm5']
+        after = response.headers['X-After-Cursor']
+
+        response = client.get(f"{url}&before={response.headers['X-Before-Cursor']}", headers=auth_headers_participant)
+        assert [m['content'] for m in json.loads(response.data)] == ['m2', 'm3']
+
+        response = client.get(f"{url}&before={response.headers['X-Before-Cursor']}", headers=auth_headers_participant)
+        assert [m['content'] for m in json.loads(response.data)] == ['m1']
+        assert 'X-Before-Cursor' not in response.headers
+
+        response = client.get(f'{url}&after={after}', headers=auth_headers_participant)
+        assert json.loads(response.data) == []
+        assert response.headers['X-After-Cursor'] == after
+
+        client.post('/api/messages/',
+                  json={'receiver_id': researcher_id, 'content': 'm6'},
+                  headers=auth_headers_participant)
+        response = client.get(f'{url}&after={after}', headers=auth_headers_participant)
+        assert [m['content'] for m in json.loads(response.data)] == ['m6']
+
+    def test_get_messages_pages_sent_and_received_together(self, client, test_participant, test_researcher, auth_headers_participant):
+        """Test each direction is paged on its own and merged in order"""
+        from sqlalchemy import event
+
+        researcher_id, participant_id = test_researcher.id, test_participant.id
+        researcher_headers = {'Authorization': f'Bearer {create_access_token(identity=researcher_id)}'}
+        for content, headers, receiver_id in (('m1', auth_headers_participant, researcher_id),
+                                              ('m2', researcher_headers, participant_id),
+                                              ('m3', researcher_headers, participant_id),
+                                              ('m4', auth_headers_participant, researcher_id),
+                                              ('m5', researcher_headers, participant_id)):
+            client.post('/api/messages/', json={'receiver_id': receiver_id, 'content': content}, headers=headers)
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        pages = []
+        url = '/api/messages/?limit=2'
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = client.get(url, headers=auth_headers_participant)
+            pages.append([m['content'] for m in json.loads(response.data)])
+            while 'X-Before-Cursor' in response.headers:
+                response = client.get(f"{url}&before={response.headers['X-Before-Cursor']}", headers=auth_headers_participant)
+                pages.append([m['content'] for m in json.loads(response.data)])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        assert pages == [['m4', 'm5'], ['m2', 'm3'], ['m1']]
+        assert any('UNION ALL' in statement for statement in statements)
+
+    def test_get_messages_default_page_size(self, client, test_participant, test_researcher, auth_headers_participant):
+        """Test a thread requested without limit or cursor returns only the newest page"""
+        from datetime import timedelta
+        from sqlalchemy import insert
+        from pagination import DEFAULT_PAGE_SIZE
+
+        now = datetime.utcnow()
+        db.session.execute(insert(Message), [
+            {'id': str(uuid.uuid4()), 'sender_id': test_participant.id, 'receiver_id': test_researcher.id,
+             'content': f'm{i}', 'created_at': now + timedelta(seconds=i)}
+            for i in range(DEFAULT_PAGE_SIZE + 1)
+        ])
+        db.session.commit()
+
+        response = client.get(f'/api/messages/?other_user_id={test_researcher.id}', headers=auth_headers_participant)
+        data = json.loads(response.data)
+        assert len(data) == DEFAULT_PAGE_SIZE
+        assert data[0]['content'] == 'm1'
+        assert 'X-Before-Cursor' in response.headers
+
+    def test_get_messages_invalid_cursor(self, client, auth_headers_participant):
+        """Test malformed or conflicting cursors are rejected"""
+        assert client.get('/api/messages/?before=bogus', headers=auth_headers_participant).status_code == 400
+        assert client.get('/api/messages/?before=a&after=b', headers=auth_headers_participant).status_code == 400
+
+    def test_message_stream_pushes_new_messages(self, client, test_participant, test_researcher, auth_headers_participant):
+        """Test the SSE stream relays new messages and unread counts to the receiver"""
+        from pubsub import hub
+
+        participant_id = test_participant.id
+        researcher_token = create_access_token(identity=test_researcher.id)
+        participant_token = create_access_token(identity=participant_id)
+
+        # EventSource authenticates with the token in the query string
+        response = client.get(f'/api/messages/stream?jwt={participant_token}', buffered=False)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        stream = iter(response.response)
+        assert next(stream) == b'retry: 3000\n\n'
+
+        client.post('/api/messages/',
+                  json={'receiver_id': participant_id, 'content': 'Pushed'},
+                  headers={'Authorization': f'Bearer {researcher_token}'})
+
+        message_frame = next(stream).decode()
+        assert message_frame.startswith('event: message\n')
+        assert json.loads(message_frame.split('data: ', 1)[1])['content'] == 'Pushed'
+        unread_frame = next(stream).decode()
+        assert unread_frame.startswith('event: unread_count\n')
+        assert json.loads(unread_frame.split('data: ', 1)[1]) == {'unread_count': 1}
+
+        response.close()
+        assert hub.broker.subscriber_count(hub.channel(participant_id)) == 0
+
+    def test_message_stream_released_without_iteration(self, client, test_participant):
+        """Test a stream closed before its body is read releases its subscription"""
+        from pubsub import hub
+
+        participant_id = test_participant.id
+        token = create_access_token(identity=participant_id)
+        response = client.get(f'/api/messages/stream?jwt={token}', buffered=False)
+        assert hub.broker.subscriber_count(hub.channel(participant_id)) == 1
+
+        response.close()
+        assert hub.broker.subscriber_count(hub.channel(participant_id)) == 0
+
+    def test_message_stream_requires_token(self, client):
+        """Test the SSE stream rejects unauthenticated clients"""
+        response = client.get('/api/messages/stream')
+        assert response.status_code == 401
+
+    def test_read_marker_scoped_to_conversation(self, client, test_participant, test_researcher, test_study, auth_headers_participant):
+        """Test the read marker only marks one conversation up to the given message"""
+        participant_id = test_participant.id
+        researcher_headers = {'Authorization': f'Bearer {create_access_token(identity=test_researcher.id)}'}
+        general_ids = []
+        for content in ('g1', 'g2', 'g3'):
+            response = client.post('/api/messages/',
+                                 json={'receiver_id': participant_id, 'content': content},
+                                 headers=researcher_headers)
+            general_ids.append(json.loads(response.data)['message_data']['id'])
+        client.post('/api/messages/',
+                  json={'receiver_id': participant_id, 'content': 's1', 'study_id': test_study.id},
+                  headers=researcher_headers)
+
+        # Viewing a thread no longer marks anything as read
+        client.get('/api/messages/', headers=auth_headers_participant)
+        assert Message.query.filter_by(receiver_id=participant_id, read=False).count() == 4
+
+        response = client.post('/api/messages/read-marker',
+                             json={'message_id': general_ids[1]},
+                             headers=auth_headers_participant)
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['marked'] == 2
+        assert data['unread_count'] == 2
+
+        read = {m.content: m for m in Message.query.filter_by(receiver_id=participant_id)}
+        assert read['g1'].read and read['g1'].read_at is not None
+        assert read['g2'].read
+        assert not read['g3'].read
+        assert not read['s1'].read
+
+        conversations = json.loads(client.get('/api/messages/conversations', headers=auth_headers_participant).data)
+        unread = {c['study']['id'] if c['study'] else None: c['unread_count'] for c in conversations}
+        assert unread == {None: 1, test_study.id: 1}
+
+    def test_unread_count_from_counters(self, client, test_participant, test_researcher, test_study, auth_headers_participant):
+        """Test the unread badge count and its per-study breakdown"""
+        from sqlalchemy import event
+
+        participant_id, study_id = test_participant.id, test_study.id
+        researcher_headers = {'Authorization': f'Bearer {create_access_token(identity=test_researcher.id)}'}
+        for content, study in (('a', None), ('b', study_id), ('c', study_id)):
+            response = client.post('/api/messages/',
+                                 json={'receiver_id': participant_id, 'content': content, 'study_id': study},
+                                 headers=researcher_headers)
+        last_id = json.loads(response.data)['message_data']['id']
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = client.get('/api/messages/unread-count?by_study=true', headers=auth_headers_participant)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        assert json.loads(response.data) == {'unread_count': 3, 'by_study': {'general': 1, study_id: 2}}
+        assert not any('messages' in statement.split('FROM', 1)[-1] for statement in statements)
+
+        client.post('/api/messages/read-marker', json={'message_id': last_id}, headers=auth_headers_participant)
+        response = client.get('/api/messages/unread-count', headers=auth_headers_participant)
+        assert json.loads(response.data) == {'unread_count': 1}
+
+        result = app.test_cli_runner().invoke(args=['rebuild-conversations'])
+        assert result.exit_code == 0
+        response = client.get('/api/messages/unread-count', headers=auth_headers_participant)
+        assert json.loads(response.data) == {'unread_count': 1}
+
+    def test_read_marker_not_found(self, client, auth_headers_participant):
+        """Test the read marker rejects unknown messages"""
+        response = client.post('/api/messages/read-marker',
+                             json={'message_id': 'missing'},
+                             headers=auth_headers_participant)
+        assert response.status_code == 404
+
+    def test_send_message_study_membership(self, client, test_participant, test_researcher, test_study, auth_headers_participant):
+        """Test study messages are authorized from the cached study membership"""
+        from caching import study_members
+
+        outsider = User(id=str(uuid.uuid4()), email='outsider@test.com', name='Outsider', role=UserRole.PARTICIPANT)
+        outsider.set_password('password123')
+        db.session.add(outsider)
+        db.session.commit()
+        outsider_headers = {'Authorization': f'Bearer {create_access_token(identity=outsider.id)}'}
+        study_id, researcher_id, participant_id = test_study.id, test_researcher.id, test_participant.id
+
+        response = client.post('/api/messages/',
+                             json={'receiver_id': participant_id, 'content': 'Hi', 'study_id': study_id},
+                             headers=outsider_headers)
+        assert response.status_code == 403
+        assert study_members.get(study_id) is not None
+
+        # Applying invalidates the cached membership
+        response = client.post(f'/api/studies/{study_id}/apply', json={}, headers=outsider_headers)
+        assert response.status_code == 201
+        assert study_members.get(study_id) is None
+
+        response = client.post('/api/messages/',
+                             json={'receiver_id': participant_id, 'content': 'Hi', 'study_id': study_id},
+                             headers=outsider_headers)
+        assert response.status_code == 201
+        assert json.loads(response.data)['message_data']['study'] == {'id': study_id, 'title': 'Test Study'}
+
+        response = client.post('/api/messages/',
+                             json={'receiver_id': researcher_id, 'content': 'Hi', 'study_id': 'missing'},
+                             headers=auth_headers_participant)
+        assert response.status_code == 404
+
+    def test_search_messages(self, client, test_participant, test_researcher, auth_headers_participant):
+        """Test full-text search is limited to the caller's messages and highlights matches"""
+        researcher_id = test_researcher.id
+        for content in ('Your <b>session</b> is on Monday', 'Bring the consent form', 'Session two is on Friday'):
+            client.post('/api/messages/',
+                      json={'receiver_id': researcher_id, 'content': content},
+                      headers=auth_headers_participant)
+
+        other = User(id=str(uuid.uuid4()), email='other@test.com', name='Other', role=UserRole.PARTICIPANT)
+        other.set_password('password123')
+        db.session.add(other)
+        db.session.add(Message(id=str(uuid.uuid4()), sender_id=other.id, receiver_id=researcher_id,
+                               content='My session is cancelled'))
+        db.session.commit()
+
+        response = client.get('/api/messages/search?q=session&limit=1', headers=auth_headers_participant)
+        assert response.status_code == 200
+        first = json.loads(response.data)
+        assert first[0]['content'] == 'Session two is on Friday'
+        assert first[0]['snippet'].startswith('<mark>Session</mark>')
+
+        response = client.get(f"/api/messages/search?q=session&cursor={response.headers['X-Next-Cursor']}",
+                            headers=auth_headers_participant)
+        second = json.loads(response.data)
+        assert len(second) == 1
+        assert second[0]['snippet'] == 'Your &lt;b&gt;<mark>session</mark>&lt;/b&gt; is on Monday'
+
+        response = client.get('/api/messages/search?q=consent%20"form', headers=auth_headers_participant)
+        assert [m['content'] for m in json.loads(response.data)] == ['Bring the consent form']
+
+        response = client.get('/api/messages/search?q=%20', headers=auth_headers_participant)
+        assert response.status_code == 400
+
+        result = app.test_cli_runner().invoke(args=['rebuild-search-index'])
+        assert result.exit_code == 0
+        response = client.get('/api/messages/search?q=friday', headers=auth_headers_participant)
+        assert len(json.loads(response.data)) == 1
+
+    def test_search_messages_survives_vacuum(self, client, test_participant, test_researcher, auth_headers_participant):
+        """Test the search index still points at the right messages after VACUUM"""
+        researcher_id = test_researcher.id
+        for content in ('Alpha reminder', 'Beta reminder', 'Gamma reminder'):
+            client.post('/api/messages/',
+                      json={'receiver_id': researcher_id, 'content': content},
+                      headers=auth_headers_participant)
+        db.session.delete(Message.query.filter_by(content='Alpha reminder').one())
+        db.session.commit()
+
+        # VACUUM may renumber the implicit rowids of a table with a TEXT key
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('VACUUM')
+
+        for term, expected in (('gamma', ['Gamma reminder']), ('beta', ['Beta reminder']), ('alpha', [])):
+            response = client.get(f'/api/messages/search?q={term}', headers=auth_headers_participant)
+            assert [m['content'] for m in json.loads(response.data)] == expected
+
+    def test_send_message_group_commit(self, client, test_participant, test_researcher, monkeypatch):
+        """Test concurrent sends are committed in shared batches when group commit is on"""
+        from concurrent.futures import ThreadPoolExecutor
+        from message_writer import message_writer, MessageWriter
+
+        batches = []
+        write = MessageWriter._write
+        monkeypatch.setattr(MessageWriter, '_write', staticmethod(lambda rows: (batches.append(len(rows)), write(rows))))
+        monkeypatch.setitem(app.config, 'MESSAGE_GROUP_COMMIT', True)
+        monkeypatch.setitem(app.config, 'MESSAGE_GROUP_COMMIT_INTERVAL_MS', 200)
+
+        researcher_id = test_researcher.id
+        headers = {'Authorization': f'Bearer {create_access_token(identity=test_participant.id)}'}
+
+        def send(i):
+            return app.test_client().post('/api/messages/',
+                                          json={'receiver_id': researcher_id, 'content': f'Burst {i}'},
+                                          headers=headers)
+
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                responses = list(pool.map(send, range(8)))
+        finally:
+            message_writer.stop()
+
+        assert all(response.status_code == 201 for response in responses)
+        assert Message.query.filter_by(receiver_id=researcher_id).count() == 8
+        assert sum(batches) == 8
+        assert len(batches) < 8
+
+        conversations = json.loads(client.get('/api/messages/conversations', headers=headers).data)
+        assert conversations[0]['total_messages'] == 8
+
+    def test_send_message_group_commit_timeout(self, client, test_participant, test_researcher, monkeypatch):
+        """Test a send that times out is withdrawn rather than committed later"""
+        import time
+        from message_writer import message_writer, MessageWriter
+
+        collect = MessageWriter._collect
+        monkeypatch.setattr(MessageWriter, '_collect', lambda self, batch: (time.sleep(0.3), collect(self, batch))[1])
+        monkeypatch.setitem(app.config, 'MESSAGE_GROUP_COMMIT', True)
+        monkeypatch.setitem(app.config, 'MESSAGE_GROUP_COMMIT_TIMEOUT', 0.05)
+
+        researcher_id = test_researcher.id
+        headers = {'Authorization': f'Bearer {create_access_token(identity=test_participant.id)}'}
+        try:
+            response = client.post('/api/messages/',
+                                 json={'receiver_id': researcher_id, 'content': 'Too slow'},
+                                 headers=headers)
+        finally:
+            message_writer.stop()
+
+        assert response.status_code == 503
+        assert Message.query.filter_by(receiver_id=researcher_id).count() == 0
+
+    def test_group_commit_timeout_from_future(self, client, monkeypatch):
+        """Test the futures timeout (distinct from the builtin before Python 3.11) withdraws the row"""
+        from concurrent import futures
+        from message_writer import message_writer, MessageWriter, WriteTimeout
+
+        class SlowFuture(futures.Future):
+            def result(self, timeout=None):
+                if timeout is not None:
+                    raise futures.TimeoutError()
+                return super().result()
+
+        future = SlowFuture()
+        monkeypatch.setattr(MessageWriter, 'submit', lambda self, row: future)
+        with pytest.raises(WriteTimeout):
+            message_writer.write({'id': 'never-written'})
+        assert future.cancelled()
+
+    def test_archived_messages_fallback(self, client, test_participant, test_researcher, test_study, auth_headers_participant):
+        """Test archived messages stay readable through threads and conversations, merged page by page"""
+        from datetime import timedelta
+        from models import ArchivedMessage
+        from conversations import record_messages
+
+        participant_id, researcher_id, study_id = test_participant.id, test_researcher.id, test_study.id
+        now = datetime.utcnow()
+        rows = [
+            {'id': str(uuid.uuid4()), 'sender_id': researcher_id, 'receiver_id': participant_id,
+             'study_id': None, 'content': f'general {i}', 'type': MessageType.TEXT, 'read': True,
+             'created_at': now - timedelta(days=days)}
+            for i, days in enumerate((90, 60, 1, 0))
+        ] + [
+            {'id': str(uuid.uuid4()), 'sender_id': researcher_id, 'receiver_id': participant_id,
+             'study_id': None, 'content': 'unread', 'type': MessageType.TEXT, 'read': False,
+             'created_at': now - timedelta(days=120)}
+        ] + [
+            {'id': str(uuid.uuid4()), 'sender_id': researcher_id, 'receiver_id': participant_id,
+             'study_id': study_id, 'content': 'study wrap-up', 'type': MessageType.TEXT, 'read': True,
+             'created_at': now - timedelta(days=2)}
+        ]
+        for row in rows:
+            db.session.add(Message(**row))
+        record_messages(rows)
+        test_study.status = StudyStatus.COMPLETED
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['archive-messages', '--older-than-days', '30'])
+        # Unread messages stay hot, however old
+        assert 'Archived 3 messages' in result.output
+        assert Message.query.count() == 3
+        assert ArchivedMessage.query.count() == 3
+        assert Message.query.filter_by(content='unread').count() == 1
+
+        url = f'/api/messages/?other_user_id={researcher_id}&limit=3'
+        response = client.get(url, headers=auth_headers_participant)
+        assert [m['content'] for m in json.loads(response.data)] == ['study wrap-up', 'general 2', 'general 3']
+        response = client.get(f"{url}&before={response.headers['X-Before-Cursor']}", headers=auth_headers_participant)
+        assert [m['content'] for m in json.loads(response.data)] == ['unread', 'general 0', 'general 1']
+        assert 'X-Before-Cursor' not in response.headers
+
+        # The newest page holds exactly the hot rows; archived rows follow
+        url = f'/api/messages/?other_user_id={researcher_id}&limit=2'
+        pages = []
+        response = client.get(url, headers=auth_headers_participant)
+        pages.append([m['content'] for m in json.loads(response.data)])
+        while 'X-Before-Cursor' in response.headers:
+            response = client.get(f"{url}&before={response.headers['X-Before-Cursor']}", headers=auth_headers_participant)
+            pages.append([m['content'] for m in json.loads(response.data)])
+        assert pages == [['general 2', 'general 3'], ['general 1', 'study wrap-up'], ['unread', 'general 0']]
+
+        # Archived messages stay searchable, merged newest first with hot ones
+        response = client.get('/api/messages/search?q=wrap', headers=auth_headers_participant)
+        assert [m['snippet'] for m in json.loads(response.data)] == ['study <mark>wrap</mark>-up']
+        url = '/api/messages/search?q=general&limit=3'
+        response = client.get(url, headers=auth_headers_participant)
+        assert [m['content'] for m in json.loads(response.data)] == ['general 3', 'general 2', 'general 1']
+        response = client.get(f"{url}&cursor={response.headers['X-Next-Cursor']}", headers=auth_headers_participant)
+        assert [m['content'] for m in json.loads(response.data)] == ['general 0']
+
+        # Ids of archived messages returned by threads are valid read markers
+        archived_id = ArchivedMessage.query.filter_by(content='general 1').one().id
+        response = client.post('/api/messages/read-marker', json={'message_id': archived_id},
+                             headers=auth_headers_participant)
+        assert response.status_code == 200
+        assert json.loads(response.data)['marked'] == 1
+        assert Message.query.filter_by(content='unread').one().read
+
+        conversations = json.loads(client.get('/api/messages/conversations', headers=auth_headers_participant).data)
+        study_conversation = next(c for c in conversations if c['study'])
+        assert study_conversation['last_message']['content'] == 'study wrap-up'
+
+        result = app.test_cli_runner().invoke(args=['rebuild-conversations'])
+        conversations = json.loads(client.get('/api/messages/conversations', headers=auth_headers_participant).data)
+        assert sorted(c['total_messages'] for c in conversations) == [1, 5]
+
+    def test_conversations_summary_maintained(self, client, test_participant, test_researcher, auth_headers_participant):
+        """Test sending and reading messages keeps both sides' summaries current"""
+        researcher_headers = {'Authorization': f'Bearer {create_access_token(identity=test_researcher.id)}'}
+        message_ids = []
+        for content in ('First', 'Second'):
+            response = client.post('/api/messages/',
+                                 json={'receiver_id': test_participant.id, 'content': content},
+                                 headers=researcher_headers)
+            message_ids.append(json.loads(response.data)['message_data']['id'])
+
+        response = client.get('/api/messages/conversations', headers=auth_headers_participant)
+        data = json.loads(response.data)
+        assert len(data) == 1
+        assert data[0]['id'] == f'{test_researcher.id}-general'
+        assert data[0]['other_user']['id'] == test_researcher.id
+        assert data[0]['last_message']['content'] == 'Second'
+        assert data[0]['unread_count'] == 2
+        assert data[0]['total_messages'] == 2
+
+        client.put(f'/api/messages/{message_ids[0]}/read', headers=auth_headers_participant)
+        data = json.loads(client.get('/api/messages/conversations', headers=auth_headers_participant).data)
+        assert data[0]['unread_count'] == 1
+
+        data = json.loads(client.get('/api/messages/conversations', headers=researcher_headers).data)
+        assert data[0]['other_user']['id'] == test_participant.id
+        assert data[0]['unread_count'] == 0
+        assert data[0]['total_messages'] == 2
+
+    def test_conversations_pagination(self, client, test_participant, test_researcher, test_study, auth_headers_participant):
+        """Test the inbox pages newest conversation first"""
+        for study_id in (None, test_study.id):
+            client.post('/api/messages/',
+                      json={'receiver_id': test_researcher.id, 'content': 'Hi', 'study_id': study_id},
+                      headers=auth_headers_participant)
+
+        response = client.get('/api/messages/conversations?limit=1', headers=auth_headers_participant)
+        first = json.loads(response.data)
+        assert first[0]['study']['id'] == test_study.id
+
+        cursor = response.headers['X-Next-Cursor']
+        response = client.get(f'/api/messages/conversations?limit=1&cursor={cursor}', headers=auth_headers_participant)
+        second = json.loads(response.data)
+        assert second[0]['study'] is None
+        assert 'X-Next-Cursor' not in response.headers
+
+    def test_rebuild_conversations_command(self, client, test_participant, test_researcher, auth_headers_participant):
+        """Test the rebuild command reproduces the incrementally maintained summaries"""
+        client.post('/api/messages/',
+                  json={'receiver_id': test_researcher.id, 'content': 'Hello'},
+                  headers=auth_headers_participant)
+        before = json.loads(client.get('/api/messages/conversations', headers=auth_headers_participant).data)
+
+        result = app.test_cli_runner().invoke(args=['rebuild-conversations'])
+        assert 'Rebuilt 2 conversation summaries' in result.output
+
+        after = json.loads(client.get('/api/messages/conversations', headers=auth_headers_participant).data)
+        assert after == before
+
 
 class TestAuthRoutes:
     """Test authentication routes used by participants"""
@@ -482,6 +1187,60 @@ class TestAuthRoutes:
         assert 'token' in data
         assert data['user']['role'] == 'PARTICIPANT'
 
+    def test_register_single_transaction(self, client):
+        """Test registration writes the user and profile without a lookup query"""
+        from sqlalchemy import event
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = client.post('/api/auth/register', json={
+                'email': 'New.Participant@Test.com', 'password': 'password123',
+                'name': 'New Participant', 'role': 'PARTICIPANT'
+            })
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        assert response.status_code == 201
+        assert [statement.split()[0] for statement in statements] == ['INSERT', 'INSERT']
+
+        user = User.query.filter_by(email='New.Participant@Test.com').one()
+        assert user.email_normalized == 'new.participant@test.com'
+        assert user.participant_profile is not None
+
+    def test_register_duplicate_email_case_insensitive(self, client, test_participant):
+        """Test an email differing only in case is rejected by the unique index"""
+        response = client.post('/api/auth/register', json={
+            'email': ' Participant@TEST.com', 'password': 'password123',
+            'name': 'Duplicate', 'role': 'RESEARCHER'
+        })
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'User with this email already exists'
+        assert User.query.count() == 1
+        assert ResearcherProfile.query.count() == 0
+
+    def test_login_email_case_insensitive(self, client, test_participant):
+        """Test login matches the email regardless of case"""
+        response = client.post('/api/auth/login', json={'email': 'PARTICIPANT@test.com', 'password': 'password123'})
+        assert response.status_code == 200
+
+    def test_login_rejects_non_string_credentials(self, client, test_participant):
+        """Test non-string emails or passwords, and non-object bodies, are rejected with 400"""
+        for body in ({'email': 42, 'password': 'password123'},
+                     {'email': ['participant@test.com'], 'password': 'password123'},
+                     {'email': None, 'password': 'password123'},
+                     {'email': 'participant@test.com', 'password': 123},
+                     ['email', 'password']):
+            response = client.post('/api/auth/login', json=body)
+            assert response.status_code == 400
+
+        response = client.post('/api/auth/register', json={
+            'email': 7, 'password': 'password123', 'name': 'Numbers', 'role': 'PARTICIPANT'
+        })
+        assert response.status_code == 400
+
     def test_login_participant_success(self, client, test_participant):
         """Test participant login successfully"""
         login_data = {
@@ -496,6 +1255,76 @@ class TestAuthRoutes:
         assert 'user' in data
         assert 'token' in data
 
+    def test_login_rehashes_outdated_cost(self, client, test_participant, monkeypatch):
+        """Test a hash with an outdated work factor is replaced on successful login"""
+        from passwords import hash_cost
+
+        monkeypatch.setitem(app.config, 'BCRYPT_LOG_ROUNDS', 5)
+        test_participant.set_password('password123')
+        db.session.commit()
+        assert hash_cost(test_participant.password_hash) == 5
+
+        monkeypatch.setitem(app.config, 'BCRYPT_LOG_ROUNDS', 6)
+        response = client.post('/api/auth/login', json={'email': 'participant@test.com', 'password': 'password123'})
+        assert response.status_code == 200
+
+        user = db.session.get(User, test_participant.id)
+        assert hash_cost(user.password_hash) == 6
+        assert user.check_password('password123')
+
+        # A failed login leaves the stored hash alone
+        monkeypatch.setitem(app.config, 'BCRYPT_LOG_ROUNDS', 7)
+        response = client.post('/api/auth/login', json={'email': 'participant@test.com', 'password': 'wrong'})
+        assert response.status_code == 401
+        assert hash_cost(db.session.get(User, test_participant.id).password_hash) == 6
+
+    def test_login_token_carries_claims(self, client, test_participant):
+        """Test issued tokens authorize role-gated routes from their claims"""
+        from flask_jwt_extended import decode_token
+        from sqlalchemy import event
+
+        participant_id = test_participant.id
+        profile_id = test_participant.participant_profile.id
+        response = client.post('/api/auth/login', json={'email': 'participant@test.com', 'password': 'password123'})
+        token = json.loads(response.data)['token']
+        claims = decode_token(token)
+        assert claims['sub'] == participant_id
+        assert claims['role'] == 'PARTICIPANT'
+        assert claims['profile_id'] == profile_id
+        assert claims['tv'] == 0
+
+        client.get('/api/participants/applications', headers={'Authorization': f'Bearer {token}'})
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = client.get('/api/participants/applications', headers={'Authorization': f'Bearer {token}'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        assert response.status_code == 200
+        assert len(statements) == 1
+        assert 'study_applications' in statements[0]
+
+    def test_revoke_tokens(self, client, test_participant, auth_headers_participant):
+        """Test revoking invalidates earlier tokens, including ones without a version claim"""
+        response = client.post('/api/auth/login', json={'email': 'participant@test.com', 'password': 'password123'})
+        headers = {'Authorization': f"Bearer {json.loads(response.data)['token']}"}
+        assert client.get('/api/auth/profile', headers=headers).status_code == 200
+
+        response = client.post('/api/auth/revoke', headers=headers)
+        assert response.status_code == 200
+
+        assert client.get('/api/auth/profile', headers=headers).status_code == 401
+        assert client.get('/api/auth/profile', headers=auth_headers_participant).status_code == 401
+
+        response = client.post('/api/auth/login', json={'email': 'participant@test.com', 'password': 'password123'})
+        token = json.loads(response.data)['token']
+        response = client.get('/api/auth/profile', headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 200
+
     def test_get_profile_participant(self, client, test_participant, auth_headers_participant):
         """Test getting participant profile"""
         response = client.get('/api/auth/profile', headers=auth_headers_participant)
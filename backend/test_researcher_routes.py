@@ -1,4 +1,5 @@
 import pytest
+import gzip
 import json
 import uuid
 from datetime import datetime, date
@@ -7,7 +8,8 @@ from flask.testing import FlaskClient
 from flask_jwt_extended import create_access_token
 
 from app import app, db
-from models import User, ResearcherProfile, ParticipantProfile, Study, StudyApplication, Message, UserRole, StudyStatus, ApplicationStatus, MessageType
+from caching import clear_all
+from models import User, ResearcherProfile, ParticipantProfile, Study, StudyApplication, StudyParticipation, Message, UserRole, StudyStatus, ApplicationStatus, ParticipationStatus, MessageType
 
 
 @pytest.fixture
@@ -22,6 +24,7 @@ def client():
         yield app.test_client()
         db.session.remove()
         db.drop_all()
+        clear_all()
 
 
 @pytest.fixture
@@ -156,6 +159,12 @@ class TestResearcherProfileRoutes:
         response = client.get('/api/researchers/profile')
         assert response.status_code == 401
 
+    def test_get_researcher_profile_wrong_role(self, client, test_participant, auth_headers_participant):
+        """Test a participant token is rejected by researcher routes"""
+        response = client.get('/api/researchers/profile', headers=auth_headers_participant)
+        assert response.status_code == 404
+        assert json.loads(response.data)['error'] == 'Researcher not found'
+
     def test_update_researcher_profile_success(self, client, test_researcher, auth_headers_researcher):
         """Test updating researcher profile successfully"""
         update_data = {
@@ -207,6 +216,57 @@ class TestStudyRoutes:
         assert study is not None
         assert study['title'] == 'Test Study'
 
+    def test_get_study_facets(self, client, test_study, test_researcher, auth_headers_researcher):
+        """Test catalog facet counts and their invalidation on study writes"""
+        response = client.get('/api/studies/facets')
+        assert response.status_code == 200
+
+        data = json.loads(response.data)
+        assert data['total'] == 1
+        assert data['category'] == {'Psychology': 1}
+        assert data['status'] == {'ACTIVE': 1}
+        assert data['location'] == {'unspecified': 1}
+        assert data['compensation'] == {'none': 1}
+
+        response = client.post('/api/studies/', json={
+            'title': 'Paid Study',
+            'description': 'Counts towards facets',
+            'institution': 'Test University',
+            'category': 'Health',
+            'duration': '1 week',
+            'participants_needed': 5,
+            'compensation': 40,
+            'location': 'Remote'
+        }, headers=auth_headers_researcher)
+        assert response.status_code == 201
+
+        data = json.loads(client.get('/api/studies/facets').data)
+        assert data['total'] == 2
+        assert data['compensation'] == {'none': 1, '25_to_50': 1}
+
+        data = json.loads(client.get('/api/studies/facets?status=DRAFT').data)
+        assert data['category'] == {'Health': 1}
+        assert data['location'] == {'Remote': 1}
+
+        # NULL and empty locations are counted together
+        response = client.post('/api/studies/', json={
+            'title': 'Blank Location Study',
+            'description': 'Counts as unspecified',
+            'institution': 'Test University',
+            'category': 'Health',
+            'duration': '1 week',
+            'participants_needed': 5,
+            'location': ''
+        }, headers=auth_headers_researcher)
+        assert response.status_code == 201
+        data = json.loads(client.get('/api/studies/facets').data)
+        assert data['location'] == {'unspecified': 2, 'Remote': 1}
+
+    def test_get_study_facets_invalid_filter(self, client):
+        """Test facets reject an unknown status filter"""
+        response = client.get('/api/studies/facets?status=BOGUS')
+        assert response.status_code == 400
+
     def test_get_studies_filtered(self, client, test_study, test_researcher):
         """Test getting studies with filters"""
         response = client.get(f'/api/studies/?researcher_id={test_researcher.id}')
@@ -254,6 +314,119 @@ class TestStudyRoutes:
         data = json.loads(response.data)
         assert 'error' in data
 
+    def test_bulk_import_studies_json_array(self, client, test_researcher, auth_headers_researcher):
+        """Test importing a JSON array of studies with per-row results"""
+        studies = [
+            {
+                'title': f'Imported Study {i}',
+                'description': 'Migrated from another system',
+                'institution': 'Test University',
+                'category': 'Psychology',
+                'duration': '1 month',
+                'participants_needed': 10,
+                'status': 'ACTIVE'
+            }
+            for i in range(3)
+        ]
+        studies.insert(1, {'title': 'Broken row'})
+
+        response = client.post('/api/studies/bulk?chunk_size=2',
+                             json=studies,
+                             headers=auth_headers_researcher)
+        assert response.status_code == 200
+
+        data = json.loads(response.data)
+        assert data['created'] == 3
+        assert data['failed'] == 1
+        assert data['results'][1] == {'index': 1, 'status': 'error', 'error': 'Missing required fields'}
+        assert Study.query.filter_by(researcher_id=test_researcher.id, status=StudyStatus.ACTIVE).count() == 3
+
+    def test_bulk_import_studies_bad_values(self, client, test_researcher, auth_headers_researcher):
+        """Test bad values and rejected inserts fail only their own rows within a chunk"""
+        from sqlalchemy import text
+
+        def study(**overrides):
+            row = {
+                'title': 'Valid Study',
+                'description': 'Migrated from another system',
+                'institution': 'Test University',
+                'category': 'Psychology',
+                'duration': '1 month',
+                'participants_needed': 10,
+                'compensation': 25.5
+            }
+            row.update(overrides)
+            return row
+
+        # Stands in for any row the database itself refuses
+        db.session.execute(text(
+            "CREATE TRIGGER reject_study BEFORE INSERT ON studies WHEN new.title = 'Rejected' "
+            "BEGIN SELECT RAISE(ABORT, 'rejected by test'); END"
+        ))
+        db.session.commit()
+
+        studies = [
+            study(),
+            study(compensation='abc'),
+            study(title={}),
+            study(participants_needed=0),
+            study(location=['Remote']),
+            study(title='Rejected'),
+            study(compensation=None)
+        ]
+        response = client.post('/api/studies/bulk', json=studies, headers=auth_headers_researcher)
+        assert response.status_code == 200
+
+        results = json.loads(response.data)['results']
+        assert [r['status'] for r in results] == ['created', 'error', 'error', 'error', 'error', 'error', 'created']
+        assert results[1]['error'] == 'compensation must be a number'
+        assert results[2]['error'] == 'title must be a string'
+        assert results[3]['error'] == 'participants_needed must be positive'
+        assert results[4]['error'] == 'location must be a string'
+        assert 'rejected by test' in results[5]['error']
+        assert Study.query.filter_by(researcher_id=test_researcher.id).count() == 2
+
+    def test_bulk_import_studies_ndjson(self, client, test_researcher, auth_headers_researcher):
+        """Test importing an NDJSON stream of studies"""
+        row = {
+            'title': 'NDJSON Study',
+            'description': 'Streamed import',
+            'institution': 'Test University',
+            'category': 'Health',
+            'duration': '2 weeks',
+            'participants_needed': 5,
+            'start_date': '2025-01-01'
+        }
+        body = json.dumps(row) + '\n\nnot json\n' + json.dumps(row) + '\n'
+
+        response = client.post('/api/studies/bulk',
+                             data=body,
+                             content_type='application/x-ndjson',
+                             headers=auth_headers_researcher)
+        assert response.status_code == 200
+
+        data = json.loads(response.data)
+        assert data['created'] == 2
+        assert data['failed'] == 1
+        assert data['results'][1]['error'].startswith('Invalid JSON')
+
+    def test_import_studies_command(self, client, test_researcher, tmp_path):
+        """Test loading studies offline through the CLI"""
+        path = tmp_path / 'studies.json'
+        path.write_text(json.dumps([{
+            'title': 'Offline Study',
+            'description': 'Loaded from a file',
+            'institution': 'Test University',
+            'category': 'Psychology',
+            'duration': '1 month',
+            'participants_needed': 8
+        }]))
+
+        result = app.test_cli_runner().invoke(args=['import-studies', str(path), '--researcher-id', test_researcher.id])
+        assert result.exit_code == 0
+        assert 'Imported 1 studies, 0 failed' in result.output
+        assert Study.query.filter_by(title='Offline Study').count() == 1
+
     def test_create_study_unauthorized(self, client):
         """Test creating a study without authentication"""
         study_data = {
@@ -277,11 +450,51 @@ class TestStudyRoutes:
         assert data['id'] == test_study.id
         assert data['title'] == 'Test Study'
 
+    def test_get_study_conditional(self, client, test_study, test_participant, auth_headers_participant, auth_headers_researcher):
+        """Test study detail revalidation with ETag"""
+        response = client.get(f'/api/studies/{test_study.id}')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert 'Last-Modified' not in response.headers
+
+        response = client.get(f'/api/studies/{test_study.id}', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+        # An edit of the embedded researcher changes the tag
+        response = client.put('/api/researchers/profile', json={'institution': 'Other University'}, headers=auth_headers_researcher)
+        assert response.status_code == 200
+        response = client.get(f'/api/studies/{test_study.id}', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+
+        # A new application changes the representation
+        response = client.post(f'/api/studies/{test_study.id}/apply', json={}, headers=auth_headers_participant)
+        assert response.status_code == 201
+
+        response = client.get(f'/api/studies/{test_study.id}', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert json.loads(response.data)['applications_count'] == 1
+
     def test_get_study_not_found(self, client):
         """Test getting a non-existent study"""
         response = client.get('/api/studies/non-existent-id')
         assert response.status_code == 404
 
+    def test_recount_studies_command(self, client, test_study, test_application):
+        """Test repairing study counters that drifted from their rows"""
+        assert test_study.applications_count == 0
+
+        result = app.test_cli_runner().invoke(args=['recount-studies'])
+        assert result.exit_code == 0
+        assert 'Repaired counters on 1 studies' in result.output
+
+        response = client.get(f'/api/studies/{test_study.id}')
+        data = json.loads(response.data)
+        assert data['applications_count'] == 1
+        assert data['participants_current'] == 0
+
     def test_get_study_applications_success(self, client, test_study, test_researcher, auth_headers_researcher):
         """Test getting applications for a study"""
         response = client.get(f'/api/studies/{test_study.id}/applications',
@@ -291,6 +504,210 @@ class TestStudyRoutes:
         data = json.loads(response.data)
         assert isinstance(data, list)
 
+    def test_seeded_timestamps_match_orm_format(self, client):
+        """Test init_db.py column defaults store timestamps in the form cursors compare against"""
+        import sqlite3
+        import init_db
+
+        connection = sqlite3.connect(':memory:')
+        cursor = connection.cursor()
+        init_db.create_tables(cursor)
+        cursor.execute("INSERT INTO users (id, email, email_normalized, name, role, password_hash) "
+                       "VALUES ('u1', 'a@test.com', 'a@test.com', 'A', 'PARTICIPANT', 'x')")
+        created_at = cursor.execute('SELECT created_at FROM users').fetchone()[0]
+        connection.close()
+
+        # Same text the ORM binds for the parsed value
+        parsed = datetime.strptime(created_at, init_db.TIMESTAMP_FORMAT)
+        orm_text = db.DateTime().dialect_impl(db.engine.dialect).bind_processor(db.engine.dialect)(parsed)
+        assert created_at == orm_text
+
+    def test_seeded_counters_match_rows(self, client):
+        """Test init_db.py seeds study counters that agree with its applications and participations"""
+        import sqlite3
+        import init_db
+
+        connection = sqlite3.connect(':memory:')
+        cursor = connection.cursor()
+        init_db.create_tables(cursor)
+        init_db.create_mock_data(connection, cursor)
+        drifted = cursor.execute('''
+            SELECT COUNT(*) FROM studies WHERE
+                applications_count != (SELECT COUNT(*) FROM study_applications WHERE study_id = studies.id)
+                OR participants_current != (SELECT COUNT(*) FROM study_participations
+                                            WHERE study_id = studies.id AND status IN ('ACTIVE', 'COMPLETED'))
+        ''').fetchone()[0]
+        seeded = cursor.execute('SELECT SUM(participants_current) FROM studies').fetchone()[0]
+        connection.close()
+        assert drifted == 0
+        assert seeded == 2
+
+    def test_get_study_applications_paginated(self, client, test_study, test_researcher, auth_headers_researcher):
+        """Test cursor pagination and status filtering of study applications"""
+        for i in range(3):
+            user = User(id=str(uuid.uuid4()), email=f'applicant{i}@test.com', name=f'Applicant {i}',
+                        role=UserRole.PARTICIPANT, password_hash='x')
+            db.session.add(user)
+            db.session.add(ParticipantProfile(id=str(uuid.uuid4()), user_id=user.id, gender='Female'))
+            db.session.add(StudyApplication(
+                id=str(uuid.uuid4()), study_id=test_study.id, user_id=user.id,
+                status=ApplicationStatus.REJECTED if i == 2 else ApplicationStatus.PENDING,
+                created_at=datetime(2025, 1, 1, 12, i)
+            ))
+        db.session.commit()
+
+        url = f'/api/studies/{test_study.id}/applications'
+        response = client.get(f'{url}?limit=2', headers=auth_headers_researcher)
+        assert response.status_code == 200
+        first_page = json.loads(response.data)
+        assert [a['user']['name'] for a in first_page] == ['Applicant 0', 'Applicant 1']
+        assert first_page[0]['user']['participant_profile']['gender'] == 'Female'
+
+        cursor = response.headers['X-Next-Cursor']
+        response = client.get(f'{url}?limit=2&cursor={cursor}', headers=auth_headers_researcher)
+        assert [a['user']['name'] for a in json.loads(response.data)] == ['Applicant 2']
+        assert 'X-Next-Cursor' not in response.headers
+
+        response = client.get(f'{url}?status=PENDING', headers=auth_headers_researcher)
+        assert len(json.loads(response.data)) == 2
+
+        # Without limit the default page size applies
+        from pagination import DEFAULT_PAGE_SIZE
+        for i in range(DEFAULT_PAGE_SIZE):
+            user = User(id=str(uuid.uuid4()), email=f'bulk{i}@test.com', name=f'Bulk {i}',
+                        role=UserRole.PARTICIPANT, password_hash='x')
+            db.session.add(user)
+            db.session.add(StudyApplication(id=str(uuid.uuid4()), study_id=test_study.id, user_id=user.id))
+        db.session.commit()
+        response = client.get(url, headers=auth_headers_researcher)
+        assert len(json.loads(response.data)) == DEFAULT_PAGE_SIZE
+        assert 'X-Next-Cursor' in response.headers
+
+        response = client.get(f'{url}?cursor=bogus', headers=auth_headers_researcher)
+        assert response.status_code == 400
+
+    def test_get_study_participants_success(self, client, test_study, test_participant, auth_headers_researcher):
+        """Test listing enrolled participants with their profiles"""
+        db.session.add(StudyParticipation(
+            id=str(uuid.uuid4()), study_id=test_study.id, user_id=test_participant.id,
+            status=ParticipationStatus.ACTIVE, consent_given=True
+        ))
+        db.session.commit()
+
+        response = client.get(f'/api/studies/{test_study.id}/participants', headers=auth_headers_researcher)
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert len(data) == 1
+        assert data[0]['user']['participant_profile']['location'] == 'New York'
+
+        response = client.get(f'/api/studies/{test_study.id}/participants?status=WITHDRAWN',
+                            headers=auth_headers_researcher)
+        assert json.loads(response.data) == []
+
+    def _create_applicants(self, study, count):
+        application_ids = []
+        for i in range(count):
+            user = User(id=str(uuid.uuid4()), email=f'bulk{i}@test.com', name=f'Bulk {i}',
+                        role=UserRole.PARTICIPANT, password_hash='x')
+            application = StudyApplication(id=str(uuid.uuid4()), study_id=study.id, user_id=user.id,
+                                           status=ApplicationStatus.PENDING,
+                                           created_at=datetime(2025, 1, 1, 12, i))
+            db.session.add_all([user, application])
+            application_ids.append(application.id)
+        db.session.commit()
+        return application_ids
+
+    def test_bulk_approve_applications_respects_capacity(self, client, test_study, auth_headers_researcher):
+        """Test approving applications in bulk enrols up to participants_needed"""
+        test_study.participants_needed = 2
+        db.session.commit()
+        application_ids = self._create_applicants(test_study, 3)
+
+        response = client.post(f'/api/studies/{test_study.id}/applications/decisions',
+                             json={'application_ids': application_ids + ['missing'], 'decision': 'APPROVED'},
+                             headers=auth_headers_researcher)
+        assert response.status_code == 200
+
+        data = json.loads(response.data)
+        assert data['updated'] == 2
+        assert [r['status'] for r in data['results']] == ['APPROVED', 'APPROVED', 'error', 'error']
+        assert data['results'][2]['error'] == 'Study is full'
+        assert data['results'][3]['error'] == 'Application not found'
+
+        assert StudyParticipation.query.filter_by(study_id=test_study.id).count() == 2
+        db.session.expire_all()
+        assert db.session.get(Study, test_study.id).participants_current == 2
+
+        # Already decided applications are reported, not re-applied
+        response = client.post(f'/api/studies/{test_study.id}/applications/decisions',
+                             json={'application_ids': application_ids[:1], 'decision': 'REJECTED'},
+                             headers=auth_headers_researcher)
+        assert json.loads(response.data)['results'][0]['error'] == 'Application is already APPROVED'
+
+    def test_bulk_reject_applications(self, client, test_study, auth_headers_researcher):
+        """Test rejecting applications in bulk"""
+        application_ids = self._create_applicants(test_study, 2)
+
+        response = client.post(f'/api/studies/{test_study.id}/applications/decisions',
+                             json={'application_ids': application_ids, 'decision': 'REJECTED'},
+                             headers=auth_headers_researcher)
+        assert response.status_code == 200
+        assert json.loads(response.data)['updated'] == 2
+        assert StudyApplication.query.filter_by(status=ApplicationStatus.REJECTED).count() == 2
+        assert StudyParticipation.query.count() == 0
+
+    def test_export_study_applications_csv(self, client, test_study, test_application, auth_headers_researcher):
+        """Test streaming applications as CSV"""
+        response = client.get(f'/api/studies/{test_study.id}/applications/export',
+                            headers=auth_headers_researcher)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        assert 'attachment' in response.headers['Content-Disposition']
+
+        lines = response.get_data(as_text=True).strip().splitlines()
+        assert lines[0].startswith('application_id,status,message,created_at,user_id,name,email')
+        assert len(lines) == 2
+        assert 'PENDING' in lines[1] and 'participant@test.com' in lines[1]
+
+    def test_export_study_participants_ndjson_gzip(self, client, test_study, test_participant, auth_headers_researcher):
+        """Test streaming participants as gzip-compressed NDJSON"""
+        db.session.add(StudyParticipation(
+            id=str(uuid.uuid4()), study_id=test_study.id, user_id=test_participant.id,
+            status=ParticipationStatus.ACTIVE, consent_given=True
+        ))
+        db.session.commit()
+
+        response = client.get(f'/api/studies/{test_study.id}/participants/export?format=ndjson',
+                            headers={**auth_headers_researcher, 'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+
+        rows = [json.loads(line) for line in gzip.decompress(response.data).decode().splitlines()]
+        assert len(rows) == 1
+        assert rows[0]['status'] == 'ACTIVE'
+        assert rows[0]['gender'] == 'Female'
+
+    def test_export_invalid_format(self, client, test_study, auth_headers_researcher):
+        """Test exports reject unknown formats"""
+        response = client.get(f'/api/studies/{test_study.id}/applications/export?format=xml',
+                            headers=auth_headers_researcher)
+        assert response.status_code == 400
+
+    def test_bulk_decision_invalid(self, client, test_study, auth_headers_researcher, auth_headers_participant):
+        """Test bulk decisions validate input and ownership"""
+        url = f'/api/studies/{test_study.id}/applications/decisions'
+        response = client.post(url, json={'application_ids': [], 'decision': 'PENDING'},
+                             headers=auth_headers_researcher)
+        assert response.status_code == 400
+
+        for body in ([], 'x'):
+            response = client.post(url, json=body, headers=auth_headers_researcher)
+            assert response.status_code == 400
+
+        response = client.post(url, json={'application_ids': [], 'decision': 'APPROVED'},
+                             headers=auth_headers_participant)
+        assert response.status_code == 404
+
     def test_get_study_applications_unauthorized(self, client, test_study, auth_headers_participant):
         """Test getting applications for a study as non-researcher"""
         response = client.get(f'/api/studies/{test_study.id}/applications',
@@ -441,6 +858,18 @@ class TestMatchingRoutes:
         response = client.get(f'/api/matching/participants/{test_study.id}')
         assert response.status_code == 401
 
+    def test_get_matched_participants_serializes_profile(self, client, test_study, test_participant, auth_headers_researcher):
+        """Test matched participants include a JSON participant profile"""
+        response = client.get(f'/api/matching/participants/{test_study.id}',
+                            headers=auth_headers_researcher)
+        assert response.status_code == 200
+
+        data = json.loads(response.data)
+        match = next(m for m in data['matches'] if m['id'] == test_participant.id)
+        assert match['participant_profile']['date_of_birth'] == '1990-01-01'
+        assert match['participant_profile']['gender'] == 'Female'
+        assert match['match_score'] >= 50
+
 
 class TestMessageRoutes:
     """Test message routes"""
@@ -487,6 +916,53 @@ class TestMessageRoutes:
         assert isinstance(data, list)
 
 
+    def test_broadcast_to_active_participants(self, client, test_researcher, test_study, auth_headers_researcher):
+        """Test a broadcast reaches every active participant in one request"""
+        from pubsub import hub
+
+        study_id = test_study.id
+        participants = []
+        for i, status in enumerate([ParticipationStatus.ACTIVE] * 3 + [ParticipationStatus.WITHDRAWN]):
+            user = User(id=str(uuid.uuid4()), email=f'broadcast{i}@test.com', name=f'Broadcast {i}',
+                        role=UserRole.PARTICIPANT)
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.add(StudyParticipation(id=str(uuid.uuid4()), study_id=study_id, user_id=user.id,
+                                              status=status, consent_given=True))
+            participants.append(user.id)
+        db.session.commit()
+
+        subscription = hub.subscribe(participants[0])
+        try:
+            response = client.post('/api/messages/broadcast',
+                                 json={'study_id': study_id, 'content': 'Session moved to Friday'},
+                                 headers=auth_headers_researcher)
+            events = [subscription.get(timeout=0), subscription.get(timeout=0)]
+        finally:
+            subscription.close()
+
+        assert response.status_code == 201
+        assert json.loads(response.data)['recipients'] == 3
+        assert Message.query.filter_by(study_id=study_id).count() == 3
+        assert Message.query.filter_by(receiver_id=participants[3]).count() == 0
+
+        assert events[0]['event'] == 'message'
+        assert events[0]['data']['content'] == 'Session moved to Friday'
+        assert events[0]['data']['study']['id'] == study_id
+        assert events[1] == {'event': 'unread_count', 'data': {'unread_count': 1}}
+
+        headers = {'Authorization': f'Bearer {create_access_token(identity=participants[1])}'}
+        conversations = json.loads(client.get('/api/messages/conversations', headers=headers).data)
+        assert conversations[0]['unread_count'] == 1
+        assert conversations[0]['last_message']['content'] == 'Session moved to Friday'
+
+    def test_broadcast_requires_study_owner(self, client, test_study, auth_headers_participant):
+        """Test only the study researcher can broadcast"""
+        response = client.post('/api/messages/broadcast',
+                             json={'study_id': test_study.id, 'content': 'Hi all'},
+                             headers=auth_headers_participant)
+        assert response.status_code == 404
+
 class TestAuthRoutes:
     """Test authentication routes used by researchers"""
 
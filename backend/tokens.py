@@ -0,0 +1,94 @@
+"""
+Access tokens with authorization claims.
+
+Tokens carry the user's ``role``, ``profile_id`` and token version (``tv``)
+next to the identity, so role-gated routes can authorize without loading the
+user (see ``identity.role_required``).
+
+Each user has a ``token_version``. Bumping it with ``revoke_tokens``
+invalidates every token issued before; ``is_token_revoked`` compares a
+token's ``tv`` (0 for tokens issued before the claim existed) against the
+current version, which is cached briefly per process.
+
+Invite tokens, handed to participants imported without a password, are
+signed with the app's ``SECRET_KEY`` (salt ``invite``) and expire after
+``INVITE_MAX_AGE`` seconds.
+"""
+
+from flask import current_app
+from flask_jwt_extended import create_access_token
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import update
+from models import db, User, UserRole
+from caching import token_versions
+
+TOKEN_VERSION_CLAIM = 'tv'
+INVITE_SALT = 'invite'
+DEFAULT_INVITE_MAX_AGE = 14 * 24 * 3600
+
+
+def token_claims(user):
+    """Claims embedded in ``user``'s access tokens"""
+    if user.role == UserRole.RESEARCHER:
+        profile = user.researcher_profile
+    elif user.role == UserRole.PARTICIPANT:
+        profile = user.participant_profile
+    else:
+        profile = None
+    return {
+        'role': user.role.value,
+        'profile_id': profile.id if profile else None,
+        TOKEN_VERSION_CLAIM: user.token_version or 0
+    }
+
+
+def issue_token(user):
+    return create_access_token(identity=user.id, additional_claims=token_claims(user))
+
+
+def current_token_version(user_id):
+    """Token version of a user, or None if the user does not exist"""
+    def load():
+        return db.session.query(User.token_version).filter(User.id == user_id).scalar()
+    return token_versions.get_or_set(user_id, load)
+
+
+def is_token_revoked(jwt_header, jwt_payload):
+    """``token_in_blocklist_loader`` callback for the JWT manager"""
+    identity = jwt_payload.get('sub')
+    if isinstance(identity, dict):
+        identity = identity.get('user_id')
+    version = current_token_version(identity)
+    if version is None:
+        # Unknown users are left to the routes, which answer 404
+        return False
+    return jwt_payload.get(TOKEN_VERSION_CLAIM, 0) < version
+
+
+def revoke_tokens(user_id):
+    """Invalidate every token issued to ``user_id`` so far (commits)"""
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(token_version=User.token_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    token_versions.invalidate(user_id)
+
+
+def _invite_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=INVITE_SALT)
+
+
+def issue_invite(user_id):
+    return _invite_serializer().dumps({'user_id': user_id})
+
+
+def load_invite(token):
+    """User id of a valid invite token, or None if it is forged or expired"""
+    max_age = current_app.config.get('INVITE_MAX_AGE', DEFAULT_INVITE_MAX_AGE)
+    try:
+        return _invite_serializer().loads(token, max_age=max_age)['user_id']
+    except (BadSignature, KeyError, TypeError):
+        return None
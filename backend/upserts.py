@@ -0,0 +1,24 @@
+"""
+Dialect-aware ``INSERT ... ON CONFLICT`` constructs.
+
+SQLite and PostgreSQL both support ``ON CONFLICT``; SQLAlchemy exposes it
+through dialect-specific ``insert()`` functions, picked here from the engine
+the session is bound to.
+"""
+
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db
+
+_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert
+}
+
+
+def conflict_insert(model):
+    """Return an ``insert()`` for ``model`` supporting ``on_conflict_do_*``"""
+    dialect = db.session.get_bind().dialect.name
+    try:
+        return _INSERTS[dialect](model)
+    except KeyError:
+        raise NotImplementedError(f'ON CONFLICT inserts are not supported on {dialect}')
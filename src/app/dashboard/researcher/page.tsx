@@ -142,6 +142,12 @@ export default function ResearcherDashboard() {
       if (studyId) params.study_id = studyId;
       const msgs = await messagesAPI.getMessages(params);
       setMessages(msgs);
+      // Opening the thread reads it: move the read marker to the newest message
+      const hasUnread = msgs.some((m: any) => !m.read && m.receiver?.id === user?.id);
+      if (hasUnread) {
+        await messagesAPI.markReadUpTo(msgs[msgs.length - 1].id);
+        fetchConversations();
+      }
     } catch (error) {
       console.error('Failed to fetch messages:', error);
     }
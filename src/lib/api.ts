@@ -62,6 +62,26 @@ export const apiClient = {
     return response.json();
   },
 
+  // Like get, but also returns the response headers (for pagination cursors)
+  getPage: async (endpoint: string, options?: RequestInit) => {
+    const token = localStorage.getItem('auth_token');
+    const response = await fetch(`${API_BASE_URL}${endpoint}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+        ...(token && { 'Authorization': `Bearer ${token}` }),
+        ...options?.headers,
+      },
+      ...options,
+    });
+    
+    if (!response.ok) {
+      throw new Error(`API Error: ${response.status} ${response.statusText}`);
+    }
+    
+    return { data: await response.json(), headers: response.headers };
+  },
+
   delete: async (endpoint: string, options?: RequestInit) => {
     const token = localStorage.getItem('auth_token');
     const response = await fetch(`${API_BASE_URL}${endpoint}`, {
@@ -82,6 +102,25 @@ export const apiClient = {
   },
 };
 
+// Fetch every page of a cursor-paginated list endpoint. Each response names
+// the next page's cursor in `cursorHeader`, sent back as `cursorParam`.
+// With `olderFirst`, later pages hold older rows and are put in front.
+export const getAllPages = async (
+  endpoint: string,
+  { cursorParam = 'cursor', cursorHeader = 'X-Next-Cursor', olderFirst = false } = {}
+) => {
+  let rows: any[] = [];
+  let cursor: string | null = null;
+  do {
+    const separator = endpoint.includes('?') ? '&' : '?';
+    const url: string = cursor ? `${endpoint}${separator}${cursorParam}=${encodeURIComponent(cursor)}` : endpoint;
+    const page = await apiClient.getPage(url);
+    rows = olderFirst ? [...page.data, ...rows] : [...rows, ...page.data];
+    cursor = page.headers.get(cursorHeader);
+  } while (cursor);
+  return rows;
+};
+
 // Auth API
 export const authAPI = {
   register: (userData: any) => apiClient.post('/auth/register', userData),
@@ -100,9 +139,9 @@ export const studiesAPI = {
   applyToStudy: (studyId: string, applicationData?: any) => 
     apiClient.post(`/studies/${studyId}/apply`, applicationData),
   getStudyApplications: (studyId: string) =>
-    apiClient.get(`/studies/${studyId}/applications`),
+    getAllPages(`/studies/${studyId}/applications`),
   getStudyParticipants: (studyId: string) =>
-    apiClient.get(`/studies/${studyId}/participants`),
+    getAllPages(`/studies/${studyId}/participants`),
 };
 
 // Matching API
@@ -115,14 +154,20 @@ export const matchingAPI = {
 
 // Messages API
 export const messagesAPI = {
+  // Loads the whole thread, scrolling back from the newest page
   getMessages: (params?: any) => {
     const queryString = params ? `?${new URLSearchParams(params).toString()}` : '';
-    return apiClient.get(`/messages/${queryString}`);
+    return getAllPages(`/messages/${queryString}`, {
+      cursorParam: 'before', cursorHeader: 'X-Before-Cursor', olderFirst: true,
+    });
   },
   sendMessage: (messageData: any) => apiClient.post('/messages', messageData),
-  getConversations: () => apiClient.get('/messages/conversations'),
+  getConversations: () => getAllPages('/messages/conversations'),
   markAsRead: (messageId: string) => 
     apiClient.put(`/messages/${messageId}/read`),
+  // Marks the conversation of `messageId` read up to and including it
+  markReadUpTo: (messageId: string) =>
+    apiClient.post('/messages/read-marker', { message_id: messageId }),
 };
 
 // Participants API